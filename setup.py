@@ -0,0 +1,29 @@
+"""Opt-in mypyc build of the message codec and the server hot path
+
+    just build-compiled
+
+Without LFGDEV_MYPYC this is the plain pure Python package, which stays the
+fallback for platforms without a compiled wheel. The compiled modules behave
+the same, so everything else is configured in pyproject.toml.
+"""
+
+import os
+from pathlib import Path
+
+from setuptools import setup
+
+COMPILED = [
+    *sorted(str(path) for path in Path("src/lfgdev/message").glob("*.py")),
+    "src/lfgdev/server/message_handler.py",
+    "src/lfgdev/server/pipeline.py",
+    "src/lfgdev/server/request_handler.py",
+]
+
+ext_modules = []
+if os.environ.get("LFGDEV_MYPYC") == "1":
+    # Needs mypy in the build environment, hence --no-build-isolation
+    from mypyc.build import mypycify
+
+    ext_modules = mypycify(COMPILED, opt_level="3")
+
+setup(ext_modules=ext_modules)
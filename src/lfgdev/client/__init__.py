@@ -1 +1,13 @@
-from lfgdev.client.main import Client as Client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from lfgdev.client.client import Client as Client
+
+
+def __getattr__(name: str) -> object:
+    # Imported on first use, so the CLI can start without asyncio and the codec
+    if name == "Client":
+        from lfgdev.client.client import Client
+
+        return Client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
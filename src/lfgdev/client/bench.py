@@ -0,0 +1,413 @@
+"""Load generator behind `lfgdev bench`
+
+Closed loop: each simulated user sends a request, waits for the reply and
+sends the next, so throughput is whatever the server sustains.
+
+Open loop: requests are due at a fixed rate whether or not earlier ones were
+answered, and latency counts from when a request was due. A stalled server
+then shows up as latency instead of quietly lowering the offered load.
+
+Requests that time out count towards latency too, at however long they were
+waited on, or a server falling over would only make the percentiles look
+better.
+
+Results are tagged with the git commit and stored as JSON, and each run is
+compared against the last stored run with the same settings.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import subprocess
+import time
+from collections import Counter
+from dataclasses import asdict, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Literal
+
+from lfgdev.message import Header, Hello, LastSeen, ListActive, Message, Register
+from lfgdev.types import ContentType, ProtocolVersion, Username, immutable, mutable
+
+if TYPE_CHECKING:
+    from lfgdev.client.client import Client
+
+LOG = logging.getLogger(__name__)
+
+Mode = Literal["closed", "open"]
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+BENCH_KINDS = (
+    ContentType.HELLO,
+    ContentType.LAST_SEEN,
+    ContentType.REGISTER,
+    ContentType.LIST_ACTIVE,
+)
+# Each histogram bucket is 1% wider than the one before it
+GROWTH = 1.01
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Parse e.g. "hello=8,last_seen=1,register=1" into relative weights"""
+    mix: dict[str, float] = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        kind = ContentType.from_name(name.strip())
+        if kind not in BENCH_KINDS:
+            raise ValueError(f"Can't bench {kind.name}")
+        mix[kind.name] = float(weight or 1)
+        if mix[kind.name] < 0:
+            raise ValueError(f"Negative weight for {kind.name}")
+    if not any(mix.values()):
+        raise ValueError("Mix needs at least one positive weight")
+    return mix
+
+
+@mutable
+class LatencyHistogram:
+    """Log-bucketed latencies; percentiles are accurate to about 1%"""
+
+    # Bucket i counts latencies in [GROWTH**i, GROWTH**(i + 1)) microseconds
+    buckets: Counter[int] = field(default_factory=Counter)
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def record(self, seconds: float) -> None:
+        micros = max(seconds * 1e6, 1.0)
+        self.buckets[int(math.log(micros, GROWTH))] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> float:
+        """Upper edge, in seconds, of the bucket holding the p-th percentile"""
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(GROWTH ** (index + 1) / 1e6, self.max)
+        return self.max
+
+
+@immutable
+class BenchConfig:
+    mode: Mode = "closed"
+    duration: float = 10.0
+    # Latencies from the first seconds, while connections open, are dropped
+    warmup: float = 1.0
+    users: int = 10
+    # Requests per second, open loop only
+    rate: float = 1000.0
+    mix: dict[str, float] = field(default_factory=lambda: {"HELLO": 1.0})
+    version: ProtocolVersion = ProtocolVersion.V2
+    seed: int | None = None
+
+
+@mutable
+class Recorder:
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    by_kind: Counter[str] = field(default_factory=Counter)
+    # Failed requests, i.e. no reply at all
+    errors: int = 0
+    # No reply before the client's timeout; also in latency, at that timeout
+    timeouts: int = 0
+    # Replies with an ERROR body, e.g. REGISTER for a taken username
+    error_replies: int = 0
+
+    async def request(
+        self, client: Client, message: Message, due: float, record: bool
+    ) -> None:
+        failed = False
+        try:
+            # None once the client's timeout is up
+            reply = await client.send(message)
+        except Exception as error:
+            LOG.debug(f"Request {message.header.identifier} failed: {error!r}")
+            reply, failed = None, True
+        if not record:
+            return
+        self.by_kind[message.header.content_type.name] += 1
+        if failed:
+            self.errors += 1
+            return
+        self.latency.record(asyncio.get_running_loop().time() - due)
+        if reply is None:
+            self.timeouts += 1
+        elif reply.header.content_type is ContentType.ERROR:
+            self.error_replies += 1
+
+
+@immutable
+class Bench:
+    config: BenchConfig
+    client: Client
+    recorder: Recorder = field(default_factory=Recorder)
+    rng: random.Random = field(default_factory=random.Random)
+
+    def __post_init__(self) -> None:
+        self.rng.seed(self.config.seed)
+
+    def message(self, user: int) -> Message:
+        mix = self.config.mix
+        kind = ContentType[self.rng.choices(list(mix), weights=list(mix.values()))[0]]
+        sender = Username(f"bench-{user}")
+        header = Header(sender=sender, content_type=kind, version=self.config.version)
+        match kind:
+            case ContentType.LAST_SEEN:
+                return Message(header=header, body=LastSeen(content=None))
+            case ContentType.REGISTER:
+                return Message(header=header, body=Register(content=sender))
+            case ContentType.LIST_ACTIVE:
+                # A lobby screen's poll: the first page of the last 5 minutes
+                return Message(header=header, body=ListActive(window=300))
+            case _:
+                return Message(header=header, body=Hello(content=None))
+
+    async def closed_user(self, user: int, start: float, end: float) -> None:
+        loop = asyncio.get_running_loop()
+        while (now := loop.time()) < end:
+            record = now >= start + self.config.warmup
+            await self.recorder.request(self.client, self.message(user), now, record)
+
+    async def open_loop(self, start: float, end: float) -> None:
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.config.rate
+        sent = 0
+        async with asyncio.TaskGroup() as tg:
+            while (due := start + sent * interval) < end:
+                if (delay := due - loop.time()) > 0:
+                    await asyncio.sleep(delay)
+                record = due >= start + self.config.warmup
+                message = self.message(sent % self.config.users)
+                tg.create_task(self.recorder.request(self.client, message, due, record))
+                sent += 1
+
+    async def run(self) -> BenchResult:
+        started = time.time()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        end = start + self.config.warmup + self.config.duration
+        if self.config.mode == "open":
+            await self.open_loop(start, end)
+        else:
+            async with asyncio.TaskGroup() as tg:
+                for user in range(self.config.users):
+                    tg.create_task(self.closed_user(user, start, end))
+        elapsed = loop.time() - start - self.config.warmup
+
+        recorder = self.recorder
+        latency = {f"p{p:g}": recorder.latency.percentile(p) for p in PERCENTILES}
+        return BenchResult(
+            commit=git_commit(),
+            started=started,
+            config=self.config,
+            requests=sum(recorder.by_kind.values()),
+            errors=recorder.errors,
+            timeouts=recorder.timeouts,
+            error_replies=recorder.error_replies,
+            elapsed=elapsed,
+            latency={
+                **latency,
+                "mean": recorder.latency.mean,
+                "max": recorder.latency.max,
+            },
+            by_kind=dict(recorder.by_kind),
+            histogram={
+                str(index): count
+                for index, count in sorted(recorder.latency.buckets.items())
+            },
+        )
+
+
+@immutable
+class BenchResult:
+    commit: str
+    started: float
+    config: BenchConfig
+    requests: int
+    errors: int
+    timeouts: int
+    error_replies: int
+    elapsed: float
+    # Seconds, keyed by "p50", "p90", "p99", "p99.9", "mean" and "max"
+    latency: dict[str, float]
+    by_kind: dict[str, int]
+    # Counts keyed by bucket index, see LatencyHistogram
+    histogram: dict[str, int]
+
+    @property
+    def throughput(self) -> float:
+        answered = self.requests - self.errors - self.timeouts
+        return answered / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_json(self) -> dict[str, Any]:
+        return {**asdict(self), "throughput": self.throughput}
+
+    def save(self, directory: Path) -> Path:
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"bench-{self.started:.0f}-{self.commit}.json"
+        path.write_text(json.dumps(self.to_json(), indent=2))
+        return path
+
+
+def git_commit() -> str:
+    """Short hash of HEAD, marked -dirty when the tree has local changes"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def find_baseline(directory: Path, result: BenchResult) -> dict[str, Any] | None:
+    """Most recent stored run with the same settings, other than the seed"""
+    config = {**asdict(result.config), "seed": None}
+    for path in sorted(directory.glob("bench-*.json"), reverse=True):
+        try:
+            previous: dict[str, Any] = json.loads(path.read_text())
+        except (OSError, ValueError) as error:
+            LOG.warning(f"Skipping unreadable bench result {path}: {error}")
+            continue
+        if previous["started"] >= result.started:
+            continue
+        if {**previous["config"], "seed": None} == config:
+            return previous
+    return None
+
+
+def compare(
+    baseline: dict[str, Any], result: BenchResult, threshold: float
+) -> list[str]:
+    """Regressions worse than threshold (a fraction) relative to baseline"""
+    regressions = []
+    if result.throughput < baseline["throughput"] * (1 - threshold):
+        regressions.append(
+            f"throughput {baseline['throughput']:.0f}/s -> {result.throughput:.0f}/s"
+        )
+    # Runs stored before timeouts were counted had them in errors
+    before_timeouts = baseline.get("timeouts", 0)
+    if result.timeouts > before_timeouts * (1 + threshold):
+        regressions.append(f"timeouts {before_timeouts} -> {result.timeouts}")
+    for name in (f"p{p:g}" for p in PERCENTILES):
+        before, after = baseline["latency"][name], result.latency[name]
+        if after > before * (1 + threshold):
+            regressions.append(f"{name} {before * 1000:.2f}ms -> {after * 1000:.2f}ms")
+    return regressions
+
+
+def report(result: BenchResult) -> str:
+    config = result.config
+    load = f"{config.rate:g}/s" if config.mode == "open" else "as fast as replies"
+    lines = [
+        f"{config.mode} loop, {config.users} users, {load}, commit {result.commit}",
+        f"mix: {', '.join(f'{k}={v:g}' for k, v in config.mix.items())}",
+        (
+            f"requests: {result.requests} in {result.elapsed:.1f}s "
+            f"({result.throughput:.0f}/s), {result.errors} failed, "
+            f"{result.timeouts} timed out, {result.error_replies} error replies"
+        ),
+        f"latency, {result.timeouts} timeouts included: "
+        + ", ".join(
+            f"{name}={seconds * 1000:.2f}ms" for name, seconds in result.latency.items()
+        ),
+    ]
+    return "\n".join(lines)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds to measure for"
+    )
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=1.0,
+        help="Seconds of load before measuring starts",
+    )
+    parser.add_argument(
+        "--users", type=int, default=10, help="Number of simulated users"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1000.0,
+        help="Requests per second in open-loop mode",
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default={"HELLO": 1.0},
+        help="Relative weights of each request, e.g. hello=8,last_seen=1,register=1",
+    )
+    parser.add_argument("--seed", type=int, help="Seed for picking requests")
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=Path(".profiling"),
+        help="Where results are stored and compared",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Fraction a result may be worse than the last run before it's flagged",
+    )
+
+
+def bench_main(args: argparse.Namespace, client: Client) -> int:
+    """Runs `lfgdev bench`; returns 1 when a regression is flagged"""
+    if not args.debug:
+        logging.getLogger("lfgdev").setLevel(logging.WARNING)
+    config = BenchConfig(
+        mode=args.mode,
+        duration=args.duration,
+        warmup=args.warmup,
+        users=args.users,
+        rate=args.rate,
+        mix=args.mix,
+        version=ProtocolVersion[f"V{args.protocol}"],
+        seed=args.seed,
+    )
+
+    async def run() -> BenchResult:
+        try:
+            return await Bench(config=config, client=client).run()
+        finally:
+            await client.close()
+
+    result = asyncio.run(run())
+    print(report(result))
+    path = result.save(args.output_dir)
+    print(f"saved to {path}")
+
+    if (baseline := find_baseline(args.output_dir, result)) is None:
+        print("no earlier run with these settings to compare against")
+        return 0
+    print(f"compared with commit {baseline['commit']}")
+    if regressions := compare(baseline, result, args.threshold):
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1
+    print("no regressions")
+    return 0
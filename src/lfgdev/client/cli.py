@@ -1,14 +1,14 @@
 import argparse
 import logging
 import sys
+from pathlib import Path
 
 from lfgdev.types import ContentType, Username
 
+DEFAULT_SOCKET = Path("/tmp/lfgdev.sock")
 
-def cli() -> argparse.Namespace:
-    client_logger = logging.getLogger("lfgdev")
-    client_logger.addHandler(logging.StreamHandler(sys.stdout))
-    client_logger.setLevel(logging.DEBUG)
+
+def build_parser(argv: list[str]) -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(prog="LFG Client CLI")
 
     parser.add_argument(
@@ -30,16 +30,66 @@ def cli() -> argparse.Namespace:
         type=Username,
         help="Username to log in with",
     )
+    parser.add_argument(
+        "--protocol",
+        type=int,
+        choices=[1, 2],
+        default=2,
+        help="Wire protocol version; use 1 for servers without length-prefixed bodies",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=5.0,
+        help="Seconds to wait for each reply",
+    )
     parser.add_argument(
         "-v",
         "--debug",
         action="store_true",
         help="Enable verbose/debug logging",
     )
+    parser.add_argument(
+        "--via",
+        type=Path,
+        default=None,
+        help="Hand the command to the `daemon` listening on this socket",
+    )
 
     # `send` command
     subparser = parser.add_subparsers(dest="command")
     send = subparser.add_parser("send")
     send.add_argument("-k", "--kind", choices=ContentType._member_names_)
+    send.add_argument(
+        "--window",
+        type=int,
+        default=300,
+        help="For LIST_ACTIVE, how many seconds back to look",
+    )
+
+    # `bench` command
+    bench = subparser.add_parser("bench", help="Generate load and report latency")
+    # Its options live with the load generator, which nothing else imports
+    if "bench" in argv:
+        from lfgdev.client.bench import add_arguments as add_bench_arguments
+
+        add_bench_arguments(bench)
+
+    # Long-lived modes, keeping the connection open between commands
+    subparser.add_parser("repl", help="Run `send` commands read from stdin")
+    daemon = subparser.add_parser(
+        "daemon", help="Run `send` commands from `lfgdev --via` on a Unix socket"
+    )
+    daemon.add_argument("--socket", type=Path, default=DEFAULT_SOCKET)
+
+    return parser
+
 
-    return parser.parse_args()
+def cli(argv: list[str] | None = None) -> argparse.Namespace:
+    if argv is None:
+        argv = sys.argv[1:]
+    args = build_parser(argv).parse_args(argv)
+    client_logger = logging.getLogger("lfgdev")
+    client_logger.addHandler(logging.StreamHandler(sys.stdout))
+    client_logger.setLevel(logging.DEBUG if args.debug else logging.INFO)
+    return args
@@ -0,0 +1,135 @@
+"""The client library: requests over pooled keep-alive connections"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from asyncio import StreamReader, StreamWriter
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import field
+
+from lfgdev.client.pool import Connection, ConnectionPool
+from lfgdev.message import (
+    ActivePlayer,
+    Header,
+    ListActive,
+    Message,
+    Presence,
+    Subscribe,
+)
+from lfgdev.types import ContentType, Username, immutable, mutable
+
+LOG = logging.getLogger(__name__)
+
+
+@mutable
+class ClientMetadata:
+    messages_sent: int = 0
+    timeouts: int = 0
+
+
+@immutable
+class Client:
+    username: Username
+    metadata: ClientMetadata = field(default_factory=ClientMetadata)
+    address: str
+    port: int
+    # Set to False to talk to a server running with --one-shot
+    keep_alive: bool = True
+    # Seconds to wait for each reply, connecting included
+    timeout: float = 5.0
+    pool: ConnectionPool = field(default_factory=ConnectionPool)
+
+    def __post__init__(self) -> None:
+        if len(self.username) > 24:
+            raise ValueError("Username too long; Must be less than 24 characters")
+
+    async def open_connection(self) -> tuple[StreamReader, StreamWriter]:
+        for _ in range(10):
+            try:
+                return await asyncio.open_connection(host=self.address, port=self.port)
+            except OSError as error:
+                LOG.error(error)
+                await asyncio.sleep(0.1)
+
+        raise ConnectionError(
+            f"Unable to establish connection to {self.address}:{self.port}"
+        )
+
+    @asynccontextmanager
+    async def connect(self) -> AsyncGenerator[tuple[StreamReader, StreamWriter], None]:
+        reader, writer = await self.open_connection()
+        try:
+            yield reader, writer
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def send(
+        self, message: Message, timeout: float | None = None
+    ) -> Message | None:
+        """Send a message and wait for its reply, or None if it doesn't come in time"""
+        try:
+            async with asyncio.timeout(self.timeout if timeout is None else timeout):
+                if not self.keep_alive:
+                    return await self.send_once(message)
+                conn = await self.pool.acquire(self.open_connection)
+                self.metadata.messages_sent += 1
+                reply = await conn.request(message)
+                LOG.debug(f"Received reply: {reply}")
+                return reply
+        except TimeoutError:
+            LOG.error(f"Request {message.header.identifier} timed out")
+            self.metadata.timeouts += 1
+        return None
+
+    async def send_once(self, message: Message) -> Message:
+        async with self.connect() as conn:
+            reader, writer = conn
+            await message.send(writer)
+            self.metadata.messages_sent += 1
+            reply = await Message.receive(stream=reader)
+            LOG.debug(f"Received reply: {reply}")
+            return reply
+
+    async def list_active(
+        self, window: int = 300, page_size: int = 50
+    ) -> AsyncIterator[ActivePlayer]:
+        """Players seen in the last window seconds, newest first, a page at a time"""
+        cursor = None
+        while True:
+            header = Header(sender=self.username, content_type=ContentType.LIST_ACTIVE)
+            body = ListActive(window=window, limit=page_size, cursor=cursor)
+            reply = await self.send(Message(header=header, body=body))
+            if reply is None or not isinstance(reply.body, ListActive):
+                raise RuntimeError(f"LIST_ACTIVE failed: {reply}")
+            for player in reply.body.content:
+                yield player
+            if (cursor := reply.body.cursor) is None:
+                return
+
+    async def subscribe(self) -> AsyncIterator[Presence]:
+        """Presence changes as the server pushes them, until it disconnects
+
+        Uses a connection of its own, outside the pool, so it's never evicted
+        for looking idle.
+        """
+        reader, writer = await self.open_connection()
+        pushes: asyncio.Queue[Message | None] = asyncio.Queue()
+        conn = Connection(reader=reader, writer=writer, pushes=pushes)
+        conn.start()
+        try:
+            header = Header(sender=self.username, content_type=ContentType.SUBSCRIBE)
+            async with asyncio.timeout(self.timeout):
+                reply = await conn.request(Message(header=header, body=Subscribe()))
+            if not isinstance(reply.body, Subscribe):
+                raise RuntimeError(f"SUBSCRIBE failed: {reply}")
+            while (push := await pushes.get()) is not None:
+                if isinstance(push.body, Presence):
+                    yield push.body
+        finally:
+            await conn.close()
+
+    async def close(self) -> None:
+        await self.pool.close()
@@ -0,0 +1,198 @@
+"""What the CLI's commands do, and the modes that keep a client warm
+
+`send` on its own runs a single command and exits. `repl` reads one command
+a line from stdin, and `daemon` takes them from `lfgdev --via` over a Unix
+socket; either way the event loop and the pooled connection to the server
+stay open from one command to the next.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import shlex
+import sys
+import threading
+from collections.abc import Awaitable
+from dataclasses import replace
+from pathlib import Path
+from typing import TextIO, TypeVar
+
+from lfgdev.client.cli import build_parser
+from lfgdev.client.client import Client
+from lfgdev.message import (
+    Body,
+    Error,
+    Header,
+    Hello,
+    LastSeen,
+    Message,
+    Register,
+    Stats,
+)
+from lfgdev.types import ContentType, ProtocolVersion, Username
+
+LOG = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+
+async def send(client: Client, args: argparse.Namespace, out: TextIO) -> int:
+    """Prints the reply; 1 if it's an Error or doesn't come"""
+    kind = ContentType.from_name(args.kind)
+    if kind == ContentType.LIST_ACTIVE:
+        async for player in client.list_active(window=args.window):
+            print(f"{player.username}\t{player.last_seen}", file=out)
+        return 0
+
+    body: Body
+    match kind:
+        case ContentType.HELLO:
+            body = Hello(content=None)
+        case ContentType.LAST_SEEN:
+            body = LastSeen(content=None)
+        case ContentType.REGISTER:
+            body = Register(content=client.username)
+        case ContentType.STATS:
+            body = Stats()
+        case _:
+            raise NotImplementedError("Unsupported message type")
+    header = Header(
+        sender=client.username,
+        content_type=kind,
+        version=ProtocolVersion[f"V{args.protocol}"],
+    )
+    reply = await client.send(Message(header=header, body=body))
+    if reply is None:
+        return 1
+    if isinstance(reply.body, Stats):
+        print(reply.body.content, end="", file=out)
+    else:
+        print(reply.body, file=out)
+    return 1 if isinstance(reply.body, Error) else 0
+
+
+async def print_presence(client: Client) -> None:
+    async for presence in client.subscribe():
+        player = presence.content
+        print(f"{presence.event.name}\t{player.username}\t{player.last_seen}")
+
+
+async def run_in_session(client: Client, args: argparse.Namespace, out: TextIO) -> int:
+    """A command from repl or daemon, which carries on whatever happens to it"""
+    if args.command != "send" or args.kind == ContentType.SUBSCRIBE.name:
+        print("Only `send` runs here, and not -k SUBSCRIBE", file=out)
+        return 2
+    # Same pool, so the same warm connection, whoever it's sent as
+    if args.username is not None and args.username != client.username:
+        client = replace(client, username=args.username)
+    try:
+        return await send(client, args, out)
+    except Exception as error:
+        print(f"{type(error).__name__}: {error}", file=out)
+        return 1
+
+
+async def read_line(prompt: str) -> str | None:
+    """input() off the event loop; None at the end of stdin
+
+    A daemon thread, unlike the default executor's, doesn't keep Ctrl-C
+    waiting for a line that isn't coming.
+    """
+    loop = asyncio.get_running_loop()
+    line: asyncio.Future[str | None] = loop.create_future()
+
+    def deliver(result: str | None) -> None:
+        # Unless the wait was cancelled, say by Ctrl-C
+        if not line.done():
+            line.set_result(result)
+
+    def read() -> None:
+        try:
+            result: str | None = input(prompt)
+        except EOFError:
+            result = None
+        loop.call_soon_threadsafe(deliver, result)
+
+    threading.Thread(target=read, daemon=True).start()
+    return await line
+
+
+async def repl(client: Client) -> int:
+    parser = build_parser([])
+    prompt = "lfg> " if sys.stdin.isatty() else ""
+    status = 0
+    while (line := await read_line(prompt)) is not None:
+        if not line.strip():
+            continue
+        try:
+            try:
+                words = shlex.split(line)
+            except ValueError as error:
+                # Unbalanced quotes; reported like any other bad command
+                parser.error(str(error))
+            args = parser.parse_args(words)
+        except SystemExit:
+            # argparse has already said what was wrong
+            continue
+        status = await run_in_session(client, args, sys.stdout)
+        sys.stdout.flush()
+    return status
+
+
+async def daemon(client: Client, path: Path) -> None:
+    """One command per connection: JSON options in, JSON status and output out"""
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            args = argparse.Namespace(**json.loads(await reader.readline()))
+            if args.username is not None:
+                args.username = Username(args.username)
+            out = io.StringIO()
+            status = await run_in_session(client, args, out)
+            response = {"status": status, "output": out.getvalue()}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        except (ConnectionError, ValueError, TypeError) as error:
+            LOG.error(f"Dropped a forwarded command: {error!r}")
+        finally:
+            writer.close()
+
+    # Left behind by a daemon that didn't get to clean up
+    path.unlink(missing_ok=True)
+    server = await asyncio.start_unix_server(handle, path=path)
+    LOG.info(f"Forwarding commands from {path} to {client.address}:{client.port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        path.unlink(missing_ok=True)
+
+
+async def closing(client: Client, command: Awaitable[_T]) -> _T:
+    try:
+        return await command
+    finally:
+        await client.close()
+
+
+def run(client: Client, args: argparse.Namespace) -> int:
+    """Runs a send, repl or daemon command to completion, for its exit status"""
+    if args.command == "send" and args.kind != ContentType.SUBSCRIBE.name:
+        return asyncio.run(closing(client, send(client, args, sys.stdout)))
+    # The rest carry on until they're interrupted, which is how they're stopped
+    try:
+        if args.command == "repl":
+            return asyncio.run(closing(client, repl(client)))
+        if args.command == "daemon":
+            asyncio.run(closing(client, daemon(client, args.socket)))
+        else:
+            asyncio.run(closing(client, print_presence(client)))
+    except KeyboardInterrupt:
+        pass
+    return 0
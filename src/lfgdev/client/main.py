@@ -1,95 +1,61 @@
-from __future__ import annotations
-
-import asyncio
-import logging
-from asyncio import StreamReader, StreamWriter
-from contextlib import asynccontextmanager
-from dataclasses import field
-from typing import AsyncGenerator
+"""The lfgdev command line
 
-from lfgdev.client.cli import cli
-from lfgdev.message import Header, Hello, LastSeen, Message, Register
-from lfgdev.types import ContentType, Username, immutable, mutable
+Scripts call this in loops, so it imports only what the command it's given
+needs: `--via` hands the command to a daemon without loading asyncio or the
+message codec at all, and only `bench` loads the load generator. See what's
+left with `python -X importtime`, or test_client_startup under profiling.
+"""
 
-LOG = logging.getLogger(__name__)
+from __future__ import annotations
 
+import argparse
+import json
+import socket
+import sys
+from pathlib import Path
 
-@mutable
-class ClientMetadata:
-    messages_sent: int = 0
+from lfgdev.client.cli import cli
 
+# Parsed options that make up a command, as opposed to where it's sent
+COMMAND_OPTIONS = ("command", "kind", "window", "protocol", "username")
 
-@immutable
-class Client:
-    username: Username
-    metadata: ClientMetadata = field(default_factory=ClientMetadata)
-    address: str
-    port: int
 
-    def __post__init__(self) -> None:
-        if len(self.username) > 24:
-            raise ValueError("Username too long; Must be less than 24 characters")
+def forward(path: Path, args: argparse.Namespace) -> int:
+    """Run a command on the daemon listening there, printing what it printed"""
+    request = {name: getattr(args, name, None) for name in COMMAND_OPTIONS}
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(str(path))
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as reply:
+            response = json.loads(reply.readline())
+    sys.stdout.write(response["output"])
+    return int(response["status"])
 
-    @asynccontextmanager
-    async def connect(self) -> AsyncGenerator[tuple[StreamReader, StreamWriter], None]:
-        reader: StreamReader | None = None
-        writer: StreamWriter | None = None
-        for _ in range(10):
-            try:
-                reader, writer = await asyncio.open_connection(
-                    host=self.address, port=self.port
-                )
-                break
-            except OSError as error:
-                LOG.error(error)
-                if "Connect call failed" in error.args[0]:
-                    await asyncio.sleep(0.1)
-                raise
 
-        if reader is None or writer is None:
-            raise ConnectionError(
-                f"Unable to establish connection to {self.address}:{self.port}"
-            )
+def main() -> None:
+    args = cli()
+    if args.via is not None:
         try:
-            yield reader, writer
-        finally:
-            writer.close()
-            await writer.wait_closed()
-
-    async def send(self, message: Message) -> Message | None:
-        async with self.connect() as conn:
-            reader, writer = conn
-            try:
-                await message.send(writer)
-                self.metadata.messages_sent += 1
-                reply = await Message.receive(stream=reader)
-                LOG.debug(f"Received reply: {reply}")
-                return reply
-            except TimeoutError:
-                LOG.error("Request timed out")
-        return None
+            sys.exit(forward(args.via, args))
+        except (OSError, ValueError) as error:
+            sys.exit(f"No daemon at {args.via}: {error}")
+    if args.command is None:
+        return
 
+    # Everything from here on needs the event loop and the codec
+    from lfgdev.client.client import Client
 
-def main() -> None:
-    args = cli()
     client = Client(
         username=args.username,
         address=args.host,
         port=args.port,
+        timeout=args.timeout,
     )
+    if args.command == "bench":
+        from lfgdev.client.bench import bench_main
 
-    if args.command == "send":
-        message_kind = ContentType.from_name(args.kind)
-        header = Header(sender=client.username, content_type=message_kind)
+        sys.exit(bench_main(args, client))
 
-        match message_kind:
-            case ContentType.HELLO:
-                message = Message(header=header, body=Hello(content=None))
-            case ContentType.LAST_SEEN:
-                message = Message(header=header, body=LastSeen(content=None))
-            case ContentType.REGISTER:
-                message = Message(header=header, body=Register(content=args.username))
-            case _:
-                raise NotImplementedError("Unsupported message type")
+    from lfgdev.client.commands import run
 
-        asyncio.run(client.send(message))
+    sys.exit(run(client, args))
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from asyncio import Future, IncompleteReadError, StreamReader, StreamWriter, Task
+from collections import deque
+from dataclasses import field
+from typing import Awaitable, Callable
+from uuid import UUID
+
+from lfgdev.message import Message
+from lfgdev.types import ContentType, mutable
+
+LOG = logging.getLogger(__name__)
+
+Opener = Callable[[], Awaitable[tuple[StreamReader, StreamWriter]]]
+
+
+@mutable
+class Connection:
+    """A single keep-alive socket, multiplexing requests by Header.identifier"""
+
+    reader: StreamReader
+    writer: StreamWriter
+    # Requests reusing an identifier are answered first come, first served
+    pending: dict[UUID, deque[Future[Message]]] = field(default_factory=dict)
+    in_flight: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    listener: Task[None] | None = None
+    # Where PRESENCE pushes go on a subscribed connection, ending with None
+    # once it closes. Left unset, pushes are dropped like any unsolicited frame
+    pushes: asyncio.Queue[Message | None] | None = None
+
+    def start(self) -> None:
+        self.listener = asyncio.create_task(self.listen())
+
+    @property
+    def healthy(self) -> bool:
+        return (
+            self.listener is not None
+            and not self.listener.done()
+            and not self.writer.is_closing()
+        )
+
+    def idle_for(self, now: float) -> float:
+        if self.in_flight:
+            return 0.0
+        return now - self.last_used
+
+    async def listen(self) -> None:
+        error: Exception = ConnectionError("Connection closed by server")
+        try:
+            while True:
+                reply = await Message.receive(self.reader)
+                waiters = self.pending.get(reply.header.identifier)
+                if not waiters:
+                    if reply.header.content_type is not ContentType.PRESENCE:
+                        LOG.warning(
+                            f"Dropping unsolicited reply {reply.header.identifier}"
+                        )
+                    elif self.pushes is not None:
+                        self.pushes.put_nowait(reply)
+                    continue
+                future = waiters.popleft()
+                if not waiters:
+                    del self.pending[reply.header.identifier]
+                if not future.done():
+                    future.set_result(reply)
+        except IncompleteReadError:
+            pass
+        except Exception as exc:
+            error = exc
+        finally:
+            if self.pushes is not None:
+                self.pushes.put_nowait(None)
+            for waiters in self.pending.values():
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(error)
+            self.pending.clear()
+
+    async def request(self, message: Message) -> Message:
+        identifier = message.header.identifier
+        future: Future[Message] = asyncio.get_running_loop().create_future()
+        waiters = self.pending.setdefault(identifier, deque())
+        waiters.append(future)
+        self.in_flight += 1
+        try:
+            await message.send(self.writer)
+            return await future
+        finally:
+            if not future.done() and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self.pending[identifier]
+            self.in_flight -= 1
+            self.last_used = time.monotonic()
+
+    async def close(self) -> None:
+        if self.listener is not None:
+            self.listener.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+@mutable
+class ConnectionPool:
+    """Bounded set of keep-alive connections shared by every Client.send
+
+    Requests go to the least loaded healthy connection; a new socket is only
+    opened once every existing one has max_in_flight requests outstanding.
+    """
+
+    max_connections: int = 4
+    max_in_flight: int = 64
+    idle_timeout: float = 30.0
+    connections: list[Connection] = field(default_factory=list)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    async def evict(self) -> None:
+        now = time.monotonic()
+        evicted = [
+            conn
+            for conn in self.connections
+            if not conn.healthy or conn.idle_for(now) > self.idle_timeout
+        ]
+        for conn in evicted:
+            self.connections.remove(conn)
+            await conn.close()
+        if evicted:
+            LOG.debug(f"Evicted {len(evicted)} pooled connection(s)")
+
+    async def acquire(self, opener: Opener) -> Connection:
+        async with self.lock:
+            await self.evict()
+            conn = min(self.connections, key=lambda c: c.in_flight, default=None)
+            if conn is None or (
+                conn.in_flight >= self.max_in_flight
+                and len(self.connections) < self.max_connections
+            ):
+                reader, writer = await opener()
+                conn = Connection(reader=reader, writer=writer)
+                conn.start()
+                self.connections.append(conn)
+            return conn
+
+    async def close(self) -> None:
+        async with self.lock:
+            for conn in self.connections:
+                await conn.close()
+            self.connections.clear()
@@ -1,9 +1,16 @@
 # Exports
+from lfgdev.message.batch import Batch as Batch
 from lfgdev.message.body import Body as Body
 from lfgdev.message.error import Error as Error
 from lfgdev.message.header import Header as Header
 from lfgdev.message.hello import Hello as Hello
 from lfgdev.message.hello import NoHello as NoHello
 from lfgdev.message.last_seen import LastSeen as LastSeen
+from lfgdev.message.list_active import ActivePlayer as ActivePlayer
+from lfgdev.message.list_active import ListActive as ListActive
 from lfgdev.message.main import Message as Message
+from lfgdev.message.presence import Presence as Presence
+from lfgdev.message.presence import Subscribe as Subscribe
+from lfgdev.message.presence import Unsubscribe as Unsubscribe
 from lfgdev.message.register import Register as Register
+from lfgdev.message.stats import Stats as Stats
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from struct import Struct
+from typing import ClassVar, Self
+
+from lfgdev.message.body import Body
+from lfgdev.message.codec import decode_frame
+from lfgdev.message.decoder import register_decoder
+from lfgdev.message.main import Message
+from lfgdev.types import ContentType, ProtocolVersion, immutable
+
+
+@register_decoder(ContentType.BATCH)
+@immutable
+class Batch(Body):
+    """Many sub-messages, each a complete frame, sent as one"""
+
+    # Only exists in v2, so the fixed layout is never used
+    STRUCT: ClassVar[Struct] = Struct("!")
+    MIN_VERSION: ClassVar[ProtocolVersion] = ProtocolVersion.V2
+    content: tuple[Message, ...]
+
+    def pack_args(self) -> tuple[()]:
+        return ()
+
+    def encode_v2(self) -> bytes:
+        return b"".join(message.encode() for message in self.content)
+
+    @classmethod
+    def decode(cls, data: bytes) -> Self:
+        return cls.decode_v2(data)
+
+    @classmethod
+    def decode_v2(cls, data: bytes) -> Self:
+        messages: list[Message] = []
+        offset = 0
+        while offset < len(data):
+            if (frame := decode_frame(data, offset)) is None:
+                raise ValueError("Truncated message in batch")
+            header, body, offset = frame
+            messages.append(Message(header=header, body=body))
+        return cls(content=tuple(messages))
@@ -4,12 +4,14 @@ from abc import ABC, abstractmethod
 from struct import Struct
 from typing import Any, ClassVar, Self
 
-from lfgdev.types import immutable
+from lfgdev.types import ProtocolVersion, immutable
 
 
 @immutable
 class Body(ABC):
     STRUCT: ClassVar[Struct]
+    # Bodies that can't be laid out in a fixed size Struct need v2
+    MIN_VERSION: ClassVar[ProtocolVersion] = ProtocolVersion.V1
     content: Any
 
     @classmethod
@@ -17,4 +19,16 @@ class Body(ABC):
     def decode(cls, data: bytes) -> Self: ...
 
     @abstractmethod
-    def encode(self) -> bytes: ...
+    def pack_args(self) -> tuple[Any, ...]:
+        """Values for STRUCT.pack, so a codec can pack header and body together"""
+
+    def encode(self) -> bytes:
+        return self.STRUCT.pack(*self.pack_args())
+
+    def encode_v2(self) -> bytes:
+        """Length-prefixed body; only as many bytes as the content needs"""
+        return self.encode()
+
+    @classmethod
+    def decode_v2(cls, data: bytes) -> Self:
+        return cls.decode(data)
@@ -0,0 +1,150 @@
+"""Fast path for turning Messages into frames and back
+
+A frame is a fixed-size Header followed by its body. In protocol v1 the body
+size is fixed by the content type's Struct; in v2 the header carries the body
+length, so bodies only take the bytes they need. The version lives in a byte
+v1 always sent as padding, so both can be told apart from the header alone.
+
+Encoding packs a v1 header and body with one precompiled Struct per body type
+into a single bytes object; decoding unpacks straight out of the received
+buffer at an offset instead of slicing out intermediate copies.
+
+Whatever a client sends that can't be decoded raises ValueError, which is
+what the server closes connections on as malformed.
+"""
+
+from __future__ import annotations
+
+from struct import Struct
+from struct import error as StructError
+from uuid import UUID, SafeUUID
+
+from lfgdev.message.body import Body
+from lfgdev.message.decoder import registered_decoder
+from lfgdev.message.header import VERSION_OFFSET, Header
+from lfgdev.types import ContentType, ProtocolVersion, Username
+
+HEADER_SIZE = Header.STRUCT.size
+MAX_BODY_SIZE = 0xFFFF
+
+_content_types: dict[int, ContentType] = {
+    member.value: member for member in ContentType
+}
+_frame_structs: dict[type[Body], Struct] = {}
+# Senders repeat constantly, so skip the strip + decode for ones seen recently
+_usernames: dict[bytes, Username] = {}
+_MAX_USERNAMES = 4096
+
+
+def frame_struct(body: type[Body]) -> Struct:
+    if (struct := _frame_structs.get(body)) is None:
+        body_format = body.STRUCT.format.removeprefix("!")
+        struct = _frame_structs[body] = Struct(Header.STRUCT.format + body_format)
+    return struct
+
+
+def encode_frame(header: Header, body: Body) -> bytes:
+    if header.version < body.MIN_VERSION:
+        raise ValueError(f"{header.content_type.name} requires protocol v2")
+    if header.version is ProtocolVersion.V1:
+        return frame_struct(type(body)).pack(
+            header.identifier.bytes,
+            header.sender.encode("UTF-8"),
+            header.content_type,
+            *body.pack_args(),
+        )
+
+    payload = body.encode_v2()
+    if len(payload) > MAX_BODY_SIZE:
+        raise ValueError(f"{header.content_type.name} body too large: {len(payload)}")
+    prefix = Header.STRUCT_V2.pack(
+        header.identifier.bytes,
+        header.version,
+        header.sender.encode("UTF-8"),
+        header.content_type,
+        len(payload),
+    )
+    return prefix + payload
+
+
+def decode_uuid(data: bytes) -> UUID:
+    # Same result as UUID(bytes=data), minus the argument checking that
+    # dominates decoding a header
+    uuid = object.__new__(UUID)
+    object.__setattr__(uuid, "int", int.from_bytes(data))
+    object.__setattr__(uuid, "is_safe", SafeUUID.unknown)
+    return uuid
+
+
+def decode_username(data: bytes) -> Username:
+    if (username := _usernames.get(data)) is None:
+        username = Username(data.rstrip(b"\x00").decode("UTF-8"))
+        if len(_usernames) >= _MAX_USERNAMES:
+            _usernames.clear()
+        _usernames[data] = username
+    return username
+
+
+def decode_content_type(value: int) -> ContentType:
+    if (content := _content_types.get(value)) is None:
+        raise ValueError(f"Unknown content type: {value}")
+    return content
+
+
+def decode_frame_header(data: bytes, offset: int = 0) -> tuple[Header, int]:
+    """Returns the header and the size of the body that follows it"""
+    version = data[offset + VERSION_OFFSET]
+    if version == ProtocolVersion.V1:
+        identifier, sender, content_type = Header.STRUCT.unpack_from(data, offset)
+        content = decode_content_type(content_type)
+        body = registered_decoder(content)
+        if body.MIN_VERSION is not ProtocolVersion.V1:
+            raise ValueError(f"{content.name} requires protocol v2")
+        size = body.STRUCT.size
+    elif version == ProtocolVersion.V2:
+        identifier, _, sender, content_type, size = Header.STRUCT_V2.unpack_from(
+            data, offset
+        )
+        content = decode_content_type(content_type)
+    else:
+        raise ValueError(f"Unsupported protocol version: {version}")
+
+    header = Header(
+        identifier=decode_uuid(identifier),
+        sender=decode_username(sender),
+        content_type=content,
+        version=ProtocolVersion(version),
+    )
+    return header, size
+
+
+def decode_header(data: bytes, offset: int = 0) -> Header:
+    return decode_frame_header(data, offset)[0]
+
+
+def decode_body(header: Header, data: bytes) -> Body:
+    body = registered_decoder(header.content_type)
+    try:
+        if header.version is ProtocolVersion.V1:
+            return body.decode(data)
+        return body.decode_v2(data)
+    except (StructError, IndexError) as error:
+        # Too short, or too long, for what the content type says it holds
+        raise ValueError(
+            f"Malformed {header.content_type.name} body: {error}"
+        ) from error
+
+
+def decode_frame(data: bytes, offset: int = 0) -> tuple[Header, Body, int] | None:
+    """Decode one frame from a buffer, returning where the next one starts
+
+    Returns None when the buffer doesn't hold a complete frame yet.
+    """
+    if len(data) - offset < HEADER_SIZE:
+        return None
+    header, size = decode_frame_header(data, offset)
+    start = offset + HEADER_SIZE
+    end = start + size
+    if len(data) < end:
+        return None
+    return header, decode_body(header, data[start:end]), end
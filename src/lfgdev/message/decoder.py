@@ -17,10 +17,13 @@ def register_decoder(content_type: ContentType) -> Callable[[type[Body]], type[B
     return decorator
 
 
-async def decode(content_type: ContentType, reader: StreamReader) -> Body:
+def registered_decoder(content_type: ContentType) -> type[Body]:
     if content_type not in _registered_decoders:
         raise Exception(f"Decoder for {content_type.name} not registered")
+    return _registered_decoders[content_type]
+
 
-    body = _registered_decoders[content_type]
+async def decode(content_type: ContentType, reader: StreamReader) -> Body:
+    body = registered_decoder(content_type)
     data = await reader.readexactly(body.STRUCT.size)
     return body.decode(data)
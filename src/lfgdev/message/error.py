@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import logging
-from typing import Self
+from struct import Struct
+from typing import ClassVar, Self
 
 from lfgdev.message.body import Body
 from lfgdev.message.decoder import register_decoder
@@ -11,23 +12,29 @@ from lfgdev.types import ContentType, immutable
 LOG = logging.getLogger(__name__)
 
 
-@immutable
 @register_decoder(ContentType.ERROR)
+@immutable
 class Error(Body):
-    STRUCT = MessageStructs.ERROR
+    STRUCT: ClassVar[Struct] = MessageStructs.ERROR
     content: str
 
-    def encode(self) -> bytes:
-        # TODO: Testing out no struct on the class
-        bytes = MessageStructs.ERROR.pack(self.content.encode("UTF-8"))
+    def pack_args(self) -> tuple[bytes]:
         if len(self.content) > MessageStructs.ERROR.size:
             LOG.warning(
                 f"Error content too long: {self.content}, truncating to {MessageStructs.ERROR.size} characters"
             )
 
-        return bytes
+        return (self.content.encode("UTF-8"),)
+
+    def encode_v2(self) -> bytes:
+        # Not truncated, unlike v1
+        return self.content.encode("UTF-8")
 
     @classmethod
     def decode(cls, data: bytes) -> Self:
         decoded = MessageStructs.ERROR.unpack(data)[0]
-        return cls(content=decoded)
+        return cls(content=decoded.rstrip(b"\x00").decode("UTF-8", errors="replace"))
+
+    @classmethod
+    def decode_v2(cls, data: bytes) -> Self:
+        return cls(content=data.decode("UTF-8"))
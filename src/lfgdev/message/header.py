@@ -5,19 +5,31 @@ from struct import Struct
 from typing import ClassVar
 from uuid import UUID, uuid4
 
-from lfgdev.types import ContentType, Username, immutable
+from lfgdev.types import ContentType, ProtocolVersion, Username, immutable
+
+# Where a v2 header keeps its version. Not a ClassVar: mypyc records
+# ClassVar[int] in __annotations__ as int, which dataclass() makes a field
+VERSION_OFFSET = 16
 
 
 @immutable
 class Header:
+    # Both layouts are the same size; v2 takes the first pad byte for the
+    # version and splits the content type field to carry the body length
     STRUCT: ClassVar[Struct] = Struct("!16sx24sxI")
+    STRUCT_V2: ClassVar[Struct] = Struct("!16sB24sxHH")
     identifier: UUID = field(default_factory=uuid4)
     content_type: ContentType
     sender: Username
+    version: ProtocolVersion = ProtocolVersion.V2
 
     @staticmethod
     def decode(data: bytes) -> Header:
-        identifier, sender, content_type = Header.STRUCT.unpack(data)
+        version = ProtocolVersion(data[VERSION_OFFSET])
+        if version is ProtocolVersion.V1:
+            identifier, sender, content_type = Header.STRUCT.unpack(data)
+        else:
+            identifier, _, sender, content_type, _ = Header.STRUCT_V2.unpack(data)
 
         sender = sender.decode("UTF-8").strip("\x00")
         sender = Username(sender)
@@ -26,11 +38,20 @@ class Header:
             identifier=UUID(bytes=identifier),
             sender=Username(sender),
             content_type=ContentType(content_type),
+            version=version,
         )
 
-    def encode(self) -> bytes:
-        return Header.STRUCT.pack(
+    def encode(self, body_length: int = 0) -> bytes:
+        if self.version is ProtocolVersion.V1:
+            return Header.STRUCT.pack(
+                self.identifier.bytes,
+                self.sender.encode("UTF-8"),
+                self.content_type,
+            )
+        return Header.STRUCT_V2.pack(
             self.identifier.bytes,
+            self.version,
             self.sender.encode("UTF-8"),
             self.content_type,
+            body_length,
         )
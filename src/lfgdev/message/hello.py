@@ -8,28 +8,34 @@ from lfgdev.message.decoder import register_decoder
 from lfgdev.types import ContentType, immutable
 
 
-@immutable
 @register_decoder(ContentType.HELLO)
+@immutable
 class Hello(Body):
     STRUCT: ClassVar[Struct] = Struct("!xI")
     content: None = None
 
-    def encode(self) -> bytes:
-        return self.STRUCT.pack(0)
+    def pack_args(self) -> tuple[int]:
+        return (0,)
+
+    def encode_v2(self) -> bytes:
+        return b""
 
     @classmethod
     def decode(cls, data: bytes) -> Self:
         return cls()
 
 
-@immutable
 @register_decoder(ContentType.NO_HELLO)
+@immutable
 class NoHello(Body):
     STRUCT: ClassVar[Struct] = Struct("!xI")
     content: None = None
 
-    def encode(self) -> bytes:
-        return self.STRUCT.pack(0)
+    def pack_args(self) -> tuple[int]:
+        return (0,)
+
+    def encode_v2(self) -> bytes:
+        return b""
 
     @classmethod
     def decode(cls, data: bytes) -> Self:
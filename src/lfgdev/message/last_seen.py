@@ -5,24 +5,33 @@ from typing import ClassVar, Self
 
 from lfgdev.message.body import Body
 from lfgdev.message.decoder import register_decoder
+from lfgdev.message.structs import MessageStructs
 from lfgdev.types import ContentType, immutable
 
 
-@immutable
 @register_decoder(ContentType.LAST_SEEN)
+@immutable
 class LastSeen(Body):
     STRUCT: ClassVar[Struct] = Struct("!xI")
     content: int | None
 
-    def encode(self) -> bytes:
+    def pack_args(self) -> tuple[int]:
         if self.content is not None:
-            bytes = self.STRUCT.pack(self.content)
-        else:
-            bytes = self.STRUCT.pack(0)
+            return (self.content,)
+        return (0,)
 
-        return bytes
+    def encode_v2(self) -> bytes:
+        if self.content is None:
+            return b""
+        return MessageStructs.TIMESTAMP.pack(self.content)
 
     @classmethod
     def decode(cls, data: bytes) -> Self:
         decoded = cls.STRUCT.unpack(data)[0]
         return cls(content=decoded)
+
+    @classmethod
+    def decode_v2(cls, data: bytes) -> Self:
+        if not data:
+            return cls(content=None)
+        return cls(content=MessageStructs.TIMESTAMP.unpack(data)[0])
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from struct import Struct
+from typing import ClassVar, Self
+
+from lfgdev.message.body import Body
+from lfgdev.message.decoder import register_decoder
+from lfgdev.message.structs import MessageStructs
+from lfgdev.types import ContentType, ProtocolVersion, Username, immutable
+
+
+@immutable
+class ActivePlayer:
+    username: Username
+    last_seen: int
+
+    def encode(self) -> bytes:
+        username = self.username.encode("UTF-8")
+        return MessageStructs.PLAYER.pack(self.last_seen, len(username)) + username
+
+    @classmethod
+    def decode(cls, data: bytes, offset: int) -> tuple[ActivePlayer, int]:
+        start = offset + MessageStructs.PLAYER.size
+        if start > len(data):
+            raise ValueError("Truncated player in LIST_ACTIVE")
+        last_seen, size = MessageStructs.PLAYER.unpack_from(data, offset)
+        if start + size > len(data):
+            raise ValueError("Truncated player in LIST_ACTIVE")
+        username = Username(data[start : start + size].decode("UTF-8"))
+        return cls(username=username, last_seen=last_seen), start + size
+
+
+@register_decoder(ContentType.LIST_ACTIVE)
+@immutable
+class ListActive(Body):
+    """Players seen in the last window seconds, newest first, a page at a time
+
+    Requests leave content empty. Replies hold a page and the cursor to send
+    for the next one, which is None once there are no more.
+    """
+
+    # Only exists in v2, so the fixed layout is never used
+    STRUCT: ClassVar[Struct] = Struct("!")
+    MIN_VERSION: ClassVar[ProtocolVersion] = ProtocolVersion.V2
+    window: int = 300
+    limit: int = 50
+    # The last player of the previous page; None starts from the newest
+    cursor: ActivePlayer | None = None
+    content: tuple[ActivePlayer, ...] = ()
+
+    def pack_args(self) -> tuple[()]:
+        return ()
+
+    def encode_v2(self) -> bytes:
+        page = MessageStructs.PAGE.pack(
+            self.window, self.limit, self.cursor is not None
+        )
+        cursor = self.cursor.encode() if self.cursor is not None else b""
+        return b"".join([page, cursor, *(player.encode() for player in self.content)])
+
+    @classmethod
+    def decode(cls, data: bytes) -> Self:
+        return cls.decode_v2(data)
+
+    @classmethod
+    def decode_v2(cls, data: bytes) -> Self:
+        if len(data) < MessageStructs.PAGE.size:
+            raise ValueError("Truncated LIST_ACTIVE")
+        window, limit, has_cursor = MessageStructs.PAGE.unpack_from(data)
+        offset = MessageStructs.PAGE.size
+        cursor = None
+        if has_cursor:
+            cursor, offset = ActivePlayer.decode(data, offset)
+        players: list[ActivePlayer] = []
+        while offset < len(data):
+            player, offset = ActivePlayer.decode(data, offset)
+            players.append(player)
+        return cls(window=window, limit=limit, cursor=cursor, content=tuple(players))
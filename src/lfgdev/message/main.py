@@ -3,7 +3,12 @@ from __future__ import annotations
 from asyncio import StreamReader, StreamWriter
 
 from lfgdev.message.body import Body
-from lfgdev.message.decoder import decode
+from lfgdev.message.codec import (
+    HEADER_SIZE,
+    decode_body,
+    decode_frame_header,
+    encode_frame,
+)
 from lfgdev.message.header import Header
 from lfgdev.types import immutable
 
@@ -14,19 +19,20 @@ class Message:
     body: Body
 
     @staticmethod
-    async def parse_header(reader: StreamReader) -> Header:
-        header_data = await reader.readexactly(Header.STRUCT.size)
-        header = Header.decode(header_data)
-        return header
+    async def parse_header(reader: StreamReader) -> tuple[Header, int]:
+        header_data = await reader.readexactly(HEADER_SIZE)
+        return decode_frame_header(header_data)
+
+    def encode(self) -> bytes:
+        return encode_frame(self.header, self.body)
 
     async def send(self, stream: StreamWriter) -> None:
-        stream.write(self.header.encode())
-        if self.body is not None:
-            stream.write(self.body.encode())
+        stream.write(self.encode())
         await stream.drain()
 
     @staticmethod
     async def receive(stream: StreamReader) -> Message:
-        header = await Message.parse_header(stream)
-        body = await decode(header.content_type, reader=stream)
-        return Message(header=header, body=body)
+        # The body size is only known once the header has been read
+        header, size = await Message.parse_header(stream)
+        data = await stream.readexactly(size)
+        return Message(header=header, body=decode_body(header, data))
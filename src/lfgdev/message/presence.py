@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from struct import Struct
+from typing import ClassVar, Self
+
+from lfgdev.message.body import Body
+from lfgdev.message.decoder import register_decoder
+from lfgdev.message.list_active import ActivePlayer
+from lfgdev.message.structs import MessageStructs
+from lfgdev.types import ContentType, PresenceEvent, ProtocolVersion, immutable
+
+
+@register_decoder(ContentType.SUBSCRIBE)
+@immutable
+class Subscribe(Body):
+    """Asks for PRESENCE pushes on this connection; echoed back once it's done"""
+
+    # Pushes only exist in v2, so the fixed layout is never used
+    STRUCT: ClassVar[Struct] = Struct("!")
+    MIN_VERSION: ClassVar[ProtocolVersion] = ProtocolVersion.V2
+    content: None = None
+
+    def pack_args(self) -> tuple[()]:
+        return ()
+
+    def encode_v2(self) -> bytes:
+        return b""
+
+    @classmethod
+    def decode(cls, data: bytes) -> Self:
+        return cls()
+
+
+@register_decoder(ContentType.UNSUBSCRIBE)
+@immutable
+class Unsubscribe(Body):
+    STRUCT: ClassVar[Struct] = Struct("!")
+    MIN_VERSION: ClassVar[ProtocolVersion] = ProtocolVersion.V2
+    content: None = None
+
+    def pack_args(self) -> tuple[()]:
+        return ()
+
+    def encode_v2(self) -> bytes:
+        return b""
+
+    @classmethod
+    def decode(cls, data: bytes) -> Self:
+        return cls()
+
+
+@register_decoder(ContentType.PRESENCE)
+@immutable
+class Presence(Body):
+    """Pushed by the server, unasked, when a player registers, shows up or expires"""
+
+    STRUCT: ClassVar[Struct] = Struct("!")
+    MIN_VERSION: ClassVar[ProtocolVersion] = ProtocolVersion.V2
+    event: PresenceEvent
+    content: ActivePlayer
+
+    def pack_args(self) -> tuple[()]:
+        return ()
+
+    def encode_v2(self) -> bytes:
+        return MessageStructs.EVENT.pack(self.event) + self.content.encode()
+
+    @classmethod
+    def decode(cls, data: bytes) -> Self:
+        return cls.decode_v2(data)
+
+    @classmethod
+    def decode_v2(cls, data: bytes) -> Self:
+        if len(data) < MessageStructs.EVENT.size:
+            raise ValueError("Truncated PRESENCE")
+        (event,) = MessageStructs.EVENT.unpack_from(data)
+        player, offset = ActivePlayer.decode(data, MessageStructs.EVENT.size)
+        if offset != len(data):
+            raise ValueError("Trailing bytes in PRESENCE")
+        return cls(event=PresenceEvent(event), content=player)
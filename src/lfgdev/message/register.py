@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import Self
+from struct import Struct
+from typing import ClassVar, Self
 
 from lfgdev.message.body import Body
 from lfgdev.message.decoder import register_decoder
@@ -8,18 +9,23 @@ from lfgdev.message.structs import MessageStructs
 from lfgdev.types import ContentType, Username, immutable
 
 
-@immutable
 @register_decoder(ContentType.REGISTER)
+@immutable
 class Register(Body):
-    STRUCT = MessageStructs.USERNAME
+    STRUCT: ClassVar[Struct] = MessageStructs.USERNAME
     content: Username
 
-    def encode(self) -> bytes:
-        # TODO: Testing out no struct on the class
-        bytes = MessageStructs.USERNAME.pack(self.content.encode("UTF-8"))
-        return bytes
+    def pack_args(self) -> tuple[bytes]:
+        return (self.content.encode("UTF-8"),)
+
+    def encode_v2(self) -> bytes:
+        return self.content.encode("UTF-8")
 
     @classmethod
     def decode(cls, data: bytes) -> Self:
         decoded = MessageStructs.USERNAME.unpack(data)[0]
-        return cls(content=decoded)
+        return cls(content=Username(decoded.rstrip(b"\x00").decode("UTF-8")))
+
+    @classmethod
+    def decode_v2(cls, data: bytes) -> Self:
+        return cls(content=Username(data.decode("UTF-8")))
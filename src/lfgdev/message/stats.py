@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from struct import Struct
+from typing import ClassVar, Self
+
+from lfgdev.message.body import Body
+from lfgdev.message.decoder import register_decoder
+from lfgdev.types import ContentType, ProtocolVersion, immutable
+
+
+@register_decoder(ContentType.STATS)
+@immutable
+class Stats(Body):
+    """Server metrics in Prometheus text format; empty when requesting them"""
+
+    # Only exists in v2, so the fixed layout is never used
+    STRUCT: ClassVar[Struct] = Struct("!")
+    MIN_VERSION: ClassVar[ProtocolVersion] = ProtocolVersion.V2
+    content: str = ""
+
+    def pack_args(self) -> tuple[()]:
+        return ()
+
+    def encode_v2(self) -> bytes:
+        return self.content.encode("UTF-8")
+
+    @classmethod
+    def decode(cls, data: bytes) -> Self:
+        return cls.decode_v2(data)
+
+    @classmethod
+    def decode_v2(cls, data: bytes) -> Self:
+        return cls(content=data.decode("UTF-8"))
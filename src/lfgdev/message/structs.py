@@ -1,10 +1,18 @@
 from struct import Struct
+from typing import ClassVar
 
 from lfgdev.types import immutable
 
 
 @immutable
 class MessageStructs:
-    UUID = Struct("!16s")
-    USERNAME = Struct("!24s")
-    ERROR = Struct("!100s")
+    UUID: ClassVar[Struct] = Struct("!16s")
+    USERNAME: ClassVar[Struct] = Struct("!24s")
+    ERROR: ClassVar[Struct] = Struct("!100s")
+    TIMESTAMP: ClassVar[Struct] = Struct("!I")
+    # Window in seconds, page size, whether a cursor follows
+    PAGE: ClassVar[Struct] = Struct("!IHB")
+    # last_seen and the length of the UTF-8 username that follows
+    PLAYER: ClassVar[Struct] = Struct("!IB")
+    # PresenceEvent, followed by a PLAYER
+    EVENT: ClassVar[Struct] = Struct("!B")
@@ -0,0 +1,92 @@
+"""Limits on what the server takes on, so one noisy client can't starve the rest
+
+Everything here is checked before a request is processed. A request over a
+limit is answered straight away with an Error rather than queued behind the
+ones already running.
+
+The exception is a sender that's already out of tokens. That's clear from the
+header, so the body isn't decoded, and the connection reads nothing more until
+the sender has a token again. Only then does the Error go out. Retrying
+straight away gets a flooding client nowhere, and costs the server no more
+than reading its bytes.
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from collections import OrderedDict
+from dataclasses import field
+
+from lfgdev.types import Username, mutable
+
+OVERLOADED = "overloaded, retry later"
+RATE_LIMITED = "rate limited, retry later"
+
+
+@mutable
+class TokenBucket:
+    rate: float
+    burst: float
+    tokens: float
+    updated: float
+
+    def take(self, now: float, cost: float = 1.0) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    def wait(self, now: float, cost: float = 1.0) -> float:
+        """Seconds until take() would succeed, without taking anything"""
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        if tokens >= cost:
+            return 0.0
+        return (cost - tokens) / self.rate if self.rate > 0 else math.inf
+
+
+@mutable
+class Admission:
+    # None means no limit
+    max_connections: int | None = 1024
+    # Requests being processed at once, across every connection
+    max_requests: int | None = 1024
+    # Requests a second per Header.sender, with bursts of up to sender_burst
+    sender_rate: float | None = None
+    sender_burst: float = 20.0
+    # Least recently seen senders lose their bucket, i.e. start over full
+    max_senders: int = 10_000
+    # Longest a connection is held up for a sender out of tokens
+    max_sender_wait: float = 1.0
+    buckets: OrderedDict[Username, TokenBucket] = field(default_factory=OrderedDict)
+
+    def admit_connection(self, active_connections: int) -> bool:
+        return self.max_connections is None or active_connections < self.max_connections
+
+    def admit_request(self, in_flight: int) -> bool:
+        return self.max_requests is None or in_flight < self.max_requests
+
+    def admit_sender(self, sender: Username, cost: float = 1.0) -> bool:
+        if self.sender_rate is None:
+            return True
+        now = time.monotonic()
+        if (bucket := self.buckets.get(sender)) is None:
+            if len(self.buckets) >= self.max_senders:
+                self.buckets.popitem(last=False)
+            bucket = self.buckets[sender] = TokenBucket(
+                rate=self.sender_rate,
+                burst=self.sender_burst,
+                tokens=self.sender_burst,
+                updated=now,
+            )
+        else:
+            self.buckets.move_to_end(sender)
+        return bucket.take(now, cost)
+
+    def sender_wait(self, sender: Username) -> float:
+        """How long until this sender has a token again; 0 if it has one now"""
+        if self.sender_rate is None or (bucket := self.buckets.get(sender)) is None:
+            return 0.0
+        return min(bucket.wait(time.monotonic()), self.max_sender_wait)
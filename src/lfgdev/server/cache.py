@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import field, replace
+from typing import TYPE_CHECKING
+
+from lfgdev.types import Username, immutable, mutable
+
+if TYPE_CHECKING:
+    from lfgdev.server.db import Player
+
+
+@immutable
+class CacheEntry:
+    # None is a negative entry: the player is known not to exist
+    player: Player | None
+    expires: float
+
+
+@mutable
+class CacheStats:
+    hits: int = 0
+    negative_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.negative_hits + self.misses
+        return (self.hits + self.negative_hits) / lookups if lookups else 0.0
+
+
+@mutable
+class PlayerCache:
+    """Bounded LRU of Player records with a TTL, including negative entries"""
+
+    max_size: int = 10_000
+    ttl: float = 5.0
+    negative_ttl: float = 1.0
+    entries: OrderedDict[Username, CacheEntry] = field(default_factory=OrderedDict)
+    stats: CacheStats = field(default_factory=CacheStats)
+    # Bumped on every invalidation so a lookup racing a write can't cache stale data
+    generation: int = 0
+
+    def get(self, username: Username) -> CacheEntry | None:
+        entry = self.entries.get(username)
+        if entry is None or entry.expires < time.monotonic():
+            if entry is not None:
+                del self.entries[username]
+            self.stats.misses += 1
+            return None
+
+        self.entries.move_to_end(username)
+        if entry.player is None:
+            self.stats.negative_hits += 1
+        else:
+            self.stats.hits += 1
+        return entry
+
+    def put(self, username: Username, player: Player | None) -> None:
+        ttl = self.ttl if player is not None else self.negative_ttl
+        self.entries[username] = CacheEntry(
+            player=player, expires=time.monotonic() + ttl
+        )
+        self.entries.move_to_end(username)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def fill(self, username: Username, player: Player | None, generation: int) -> None:
+        """Cache a database read, unless a write landed while it was in flight"""
+        if generation == self.generation:
+            self.put(username, player)
+
+    def refresh(self, username: Username, last_seen: int) -> None:
+        """Update a cached player's last_seen without extending its TTL"""
+        entry = self.entries.get(username)
+        if entry is not None and entry.player is not None:
+            player = replace(entry.player, last_seen=last_seen)
+            self.entries[username] = replace(entry, player=player)
+
+    def invalidate(self, username: Username) -> None:
+        self.generation += 1
+        self.entries.pop(username, None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.entries.clear()
@@ -0,0 +1,63 @@
+from typing import Literal
+
+from lfgdev.server.presence import SlowPolicy
+from lfgdev.server.storage import StorageEngine
+from lfgdev.types import immutable
+
+Engine = Literal["stream", "protocol"]
+
+
+@immutable
+class ServerConfig:
+    # Connections
+    engine: Engine = "stream"
+    keep_alive: bool = True
+    max_in_flight: int = 32
+
+    # Deadlines, in seconds. A connection that misses one is closed and
+    # counted in lfgdev_timeouts_total
+    # Between frames on a keep-alive connection
+    idle_timeout: float = 30.0
+    # For a header once it has started arriving, or a new connection's first
+    header_timeout: float = 10.0
+    # For the rest of a frame once its header is in
+    body_timeout: float = 10.0
+    # For a client to read a reply, i.e. for the socket to drain
+    write_timeout: float = 10.0
+    # For connections to finish what they've sent once asked to stop, and for
+    # a new process to get ready on restart; see lfgdev.server.lifecycle
+    drain_timeout: float = 10.0
+    handoff_timeout: float = 30.0
+
+    # Admission control, see lfgdev.server.admission; None is no limit
+    max_connections: int | None = 1024
+    max_requests: int | None = 1024
+    sender_rate: float | None = None
+    sender_burst: float = 20.0
+
+    # Where players are kept, see lfgdev.server.storage
+    storage: StorageEngine = "sqlite"
+    # sqlite files players are spread over, see lfgdev.server.shards
+    shards: int = 1
+    # Seconds between snapshots of memory storage, which also trim its log
+    snapshot_interval: float = 60.0
+
+    # Write-behind buffer for last_seen
+    flush_interval: float = 1.0
+    max_pending_last_seen: int = 1024
+
+    # Player cache
+    cache_size: int = 10_000
+    cache_ttl: float = 5.0
+    negative_cache_ttl: float = 1.0
+
+    # Reaper, see lfgdev.server.reaper; players are kept forever without a TTL
+    player_ttl: float | None = None
+    reap_interval: float = 60.0
+    reap_batch_size: int = 500
+    reap_pause: float = 0.05
+    vacuum_pages: int = 0
+
+    # Presence pushes, see lfgdev.server.presence
+    subscriber_queue: int = 256
+    slow_subscribers: SlowPolicy = "disconnect"
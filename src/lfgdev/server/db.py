@@ -1,88 +1,470 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import math
 import sqlite3
 import time
-from contextlib import contextmanager
-from dataclasses import dataclass
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from functools import partial
 from pathlib import Path
-from typing import Iterator
+from typing import AsyncIterator, Callable, Iterable, Iterator, ParamSpec, TypeVar
 
-from lfgdev.types import Username
+from lfgdev.server.cache import PlayerCache
+from lfgdev.server.metrics import Metrics
+from lfgdev.server.presence import PresenceHub
+from lfgdev.server.storage import Player, Storage
+from lfgdev.server.write_behind import LastSeenBuffer
+from lfgdev.types import PresenceEvent, Username
 
 LOG = logging.getLogger(__name__)
 
+_P = ParamSpec("_P")
+_T = TypeVar("_T")
+
+# Set while the current task holds AsyncDatabase.transaction()
+_in_transaction: ContextVar[bool] = ContextVar("in_transaction", default=False)
+# Presence events from the open transaction, published once it commits
+_unpublished: ContextVar[list[tuple[PresenceEvent, Username, int | None]]] = ContextVar(
+    "unpublished"
+)
+
+
+# Each takes the schema up one version, in a transaction of its own. The first
+# is how lfg was made before versions were kept, so those files skip through it
+MIGRATIONS: tuple[tuple[str, ...], ...] = (
+    (
+        """
+        CREATE TABLE IF NOT EXISTS lfg (
+            username TEXT PRIMARY KEY UNIQUE,
+            last_seen INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS lfg_last_seen ON lfg (last_seen, username)",
+    ),
+    # Rows live in the primary key's b-tree, with no rowid, and without the
+    # second index on username that UNIQUE added. Index entries carry the
+    # primary key, so lfg_last_seen still covers list_active and expire
+    (
+        """
+        CREATE TABLE lfg_v2 (
+            username TEXT PRIMARY KEY,
+            last_seen INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "INSERT INTO lfg_v2 SELECT username, coalesce(last_seen, 0) FROM lfg",
+        "DROP TABLE lfg",
+        "ALTER TABLE lfg_v2 RENAME TO lfg",
+        "CREATE INDEX lfg_last_seen ON lfg (last_seen)",
+    ),
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# sqlite3 keeps each connection's prepared statements keyed by their text, so
+# these are compiled on first use and reused from then on
+FIND = "SELECT username, last_seen FROM lfg WHERE username = ?"
+LIST_ACTIVE = """
+    SELECT username, last_seen FROM lfg
+    WHERE last_seen >= ?
+    ORDER BY last_seen DESC, username DESC
+    LIMIT ?
+"""
+LIST_ACTIVE_AFTER = """
+    SELECT username, last_seen FROM lfg
+    WHERE last_seen >= ? AND (last_seen, username) < (?, ?)
+    ORDER BY last_seen DESC, username DESC
+    LIMIT ?
+"""
+# One statement whether or not they're already registered, so two workers
+# registering the same name can't both succeed
+SAVE = "INSERT INTO lfg VALUES (?, ?) ON CONFLICT (username) DO NOTHING"
+# Not an upsert: a heartbeat from someone who never registered changes nothing
+UPDATE = "UPDATE lfg SET last_seen = ? WHERE username = ?"
+REMOVE = "DELETE FROM lfg WHERE username = ?"
+# The subquery is a range scan of lfg_last_seen from its oldest end
+EXPIRE = """
+    DELETE FROM lfg WHERE username IN (
+        SELECT username FROM lfg WHERE last_seen < ? LIMIT ?
+    )
+    RETURNING username, last_seen
+"""
 
-@dataclass(frozen=True, slots=True, kw_only=True)
-class Player:
-    """Ideally this maps to the record in sqlite"""
 
-    username: Username
-    last_seen: int
+def schema_version(connection: sqlite3.Connection) -> int:
+    """0 for a file from before versions were kept, or a new one"""
+    connection.execute("CREATE TABLE IF NOT EXISTS lfg_schema (version INTEGER)")
+    row = connection.execute("SELECT version FROM lfg_schema").fetchone()
+    return 0 if row is None else int(row[0])
+
+
+def migrate(connection: sqlite3.Connection, path: Path) -> None:
+    while True:
+        # Taking the write lock first means a second process to start waits,
+        # then finds the work done
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(connection)
+            if version > SCHEMA_VERSION:
+                raise ValueError(
+                    f"{path} is at schema version {version}, "
+                    f"newer than this lfgdev's {SCHEMA_VERSION}"
+                )
+            if version == SCHEMA_VERSION:
+                connection.rollback()
+                return
+            LOG.info(f"Migrating {path} to schema version {version + 1}")
+            for statement in MIGRATIONS[version]:
+                connection.execute(statement)
+            connection.execute("DELETE FROM lfg_schema")
+            connection.execute("INSERT INTO lfg_schema VALUES (?)", (version + 1,))
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
 
 
 @dataclass(frozen=True, slots=True, kw_only=True)
-class Database:
-    """Only intended to have a single table, lfg"""
+class Database(Storage):
+    """sqlite Storage; only intended to have a single table, lfg"""
 
     path: Path
+    # Long-lived, opened once by init(); AsyncDatabase's worker thread uses it
+    connection: sqlite3.Connection
 
     @contextmanager
     @staticmethod
-    def init(path: Path) -> Iterator[Database]:
-        connection = sqlite3.connect(path)
+    def init(path: Path, busy_timeout: float = 5.0) -> Iterator[Database]:
+        # busy_timeout is how long to wait on another process's write lock
+        connection = sqlite3.connect(
+            path, timeout=busy_timeout, check_same_thread=False
+        )
         LOG.debug(f"Initializing database at {path}")
         try:
-            statement = """
-            CREATE TABLE IF NOT EXISTS lfg (
-                username TEXT PRIMARY KEY UNIQUE,
-                last_seen INTEGER
-            )
-            """
-            cursor = connection.cursor()
-            cursor.execute(statement)
-            yield Database(path=path)
+            # Only takes on a new file, before anything else writes to it, and
+            # is what lets the reaper hand pages back with incremental_vacuum
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL lets readers carry on while a worker writes; NORMAL sync is
+            # crash safe under WAL and skips an fsync per commit
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            migrate(connection, path)
+            yield Database(path=path, connection=connection)
         finally:
             connection.close()
 
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Commit on exit, unless an outer begin() owns the transaction"""
+        if self.connection.in_transaction:
+            yield self.connection
+        else:
+            with self.connection as conn:
+                yield conn
+
+    def begin(self) -> None:
+        # Take the write lock up front; a deferred transaction that later
+        # upgrades can fail with "database is locked" without waiting
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def rollback(self) -> None:
+        self.connection.rollback()
+
     def find_by_username(self, username: Username) -> Player | None:
-        statement = "SELECT * from lfg where username is :username"
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            response = cursor.execute(statement, {"username": username})
-            data = response.fetchone()
-        try:
-            return Player(username=data[0], last_seen=data[1])
-        except Exception:
-            LOG.debug(f"Player {username} not found")
+        row = self.connection.execute(FIND, (username,)).fetchone()
+        if row is None:
+            LOG.debug("Player %s not found", username)
             return None
+        return Player(username=row[0], last_seen=row[1])
 
-    def save(self, username: Username) -> None:
-        last_seen = math.floor(time.time())
-        statement = """
-            INSERT INTO lfg VALUES(
-                :username,
-                :last_seen
-            )
+    def list_active(
+        self, since: int, limit: int, after: Player | None = None
+    ) -> list[Player]:
+        """Keyset pagination on (last_seen, username)
+
+        Every page is a range scan of lfg_last_seen, however far in it
+        starts, and never an OFFSET.
         """
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(statement, {"username": username, "last_seen": last_seen})
+        if after is None:
+            rows = self.connection.execute(LIST_ACTIVE, (since, limit))
+        else:
+            params = (since, after.last_seen, after.username, limit)
+            rows = self.connection.execute(LIST_ACTIVE_AFTER, params)
+        return [
+            Player(username=username, last_seen=seen)
+            for username, seen in rows.fetchall()
+        ]
+
+    def save(self, username: Username) -> bool:
+        with self.transaction() as conn:
+            cursor = conn.execute(SAVE, (username, math.floor(time.time())))
+        return cursor.rowcount == 1
 
     def update(self, username: Username) -> None:
-        last_seen = math.floor(time.time())
-        statement = """
-            UPDATE lfg SET last_seen = :last_seen WHERE username = :username
-        """
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(statement, {"username": username, "last_seen": last_seen})
+        with self.transaction() as conn:
+            conn.execute(UPDATE, (math.floor(time.time()), username))
+
+    def update_many(self, last_seen: Iterable[tuple[Username, int]]) -> None:
+        params = ((timestamp, username) for username, timestamp in last_seen)
+        with self.transaction() as conn:
+            conn.executemany(UPDATE, params)
 
     def remove(self, username: Username) -> None:
-        statement = """
-            DELETE FROM lfg WHERE username IS :username
+        with self.transaction() as conn:
+            conn.execute(REMOVE, (username,))
+
+    def expire(self, before: int, limit: int) -> list[Player]:
+        with self.transaction() as conn:
+            rows = conn.execute(EXPIRE, (before, limit))
+            return [
+                Player(username=username, last_seen=last_seen)
+                for username, last_seen in rows.fetchall()
+            ]
+
+    def incremental_vacuum(self, pages: int) -> bool:
+        # Files created before auto_vacuum was set need a full VACUUM first
+        if self.connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return False
+        # execute() only steps the pragma once, which frees a single page
+        self.connection.executescript(f"PRAGMA incremental_vacuum({pages:d});")
+        return True
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class AsyncDatabase:
+    """Awaitable facade over a Storage
+
+    For sqlite, every call runs on a single dedicated worker thread which owns
+    the long-lived connection, so a slow fsync never blocks the event loop.
+    Storage in several parts, like sharded sqlite, is called on each part's
+    own thread instead. Storage that doesn't block is called in place.
+    Heartbeats go through touch(), which buffers them until the next flush,
+    and lookups are served from a PlayerCache where possible.
+    """
+
+    db: Storage
+    executor: ThreadPoolExecutor = field(
+        default_factory=lambda: ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="lfgdev-db"
+        )
+    )
+    last_seen: LastSeenBuffer = field(default_factory=LastSeenBuffer)
+    cache: PlayerCache = field(default_factory=PlayerCache)
+    # Held by an open transaction, which keeps other tasks' reads out
+    write_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # One per Storage.parts(), so writes to different parts go ahead together
+    part_locks: defaultdict[int, asyncio.Lock] = field(
+        default_factory=lambda: defaultdict(asyncio.Lock)
+    )
+    # The server's registry; handlers get at it through the db they're given
+    metrics: Metrics = field(default_factory=Metrics)
+    # Likewise for publishing presence changes to subscribed connections
+    presence: PresenceHub = field(default_factory=PresenceHub)
+
+    def part_of(self, username: Username) -> tuple[int, Storage]:
+        part = self.db.part_of(username)
+        return part, self.db.parts()[part][0]
+
+    def executor_for(self, part: int | None) -> Executor:
+        """Where a call to that part runs; None is a call to the whole storage"""
+        if part is None:
+            return self.executor
+        return self.db.parts()[part][1] or self.executor
+
+    @asynccontextmanager
+    async def every_part(self) -> AsyncIterator[None]:
+        # Always in the same order, so two of these can't deadlock
+        async with AsyncExitStack() as stack:
+            for part in range(len(self.db.parts())):
+                await stack.enter_async_context(self.part_locks[part])
+            yield
+
+    async def run(
+        self, fn: Callable[_P, _T], *args: _P.args, **kwargs: _P.kwargs
+    ) -> _T:
+        return await self.call(None, fn, *args, **kwargs)
+
+    async def call(
+        self,
+        part: int | None,
+        fn: Callable[_P, _T],
+        *args: _P.args,
+        **kwargs: _P.kwargs,
+    ) -> _T:
+        # Includes waiting for the worker thread, as a request would see it
+        start = time.perf_counter()
+        try:
+            if not self.db.BLOCKING:
+                return fn(*args, **kwargs)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor_for(part), partial(fn, *args, **kwargs)
+            )
+        finally:
+            self.metrics.observe(self.metrics.stages, "db", time.perf_counter() - start)
+
+    async def read(
+        self,
+        part: int | None,
+        fn: Callable[_P, _T],
+        *args: _P.args,
+        **kwargs: _P.kwargs,
+    ) -> _T:
+        """Run after any other task's open transaction, so only commits show"""
+        if self.write_lock.locked() and not _in_transaction.get():
+            async with self.write_lock:
+                return await self.call(part, fn, *args, **kwargs)
+        return await self.call(part, fn, *args, **kwargs)
+
+    async def write(
+        self,
+        part: int | None,
+        fn: Callable[_P, _T],
+        *args: _P.args,
+        **kwargs: _P.kwargs,
+    ) -> _T:
+        """Under that part's lock, or every part's for the whole storage"""
+        if _in_transaction.get():
+            return await self.call(part, fn, *args, **kwargs)
+        if part is not None:
+            async with self.part_locks[part]:
+                return await self.call(part, fn, *args, **kwargs)
+        async with self.every_part():
+            return await self.call(part, fn, *args, **kwargs)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        """Group every write made by this task into one commit
+
+        Other tasks' reads and writes wait until it's done, and presence
+        events published meanwhile go out after the commit, or not at all.
         """
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(statement, {"username": username})
+        if _in_transaction.get():
+            yield
+            return
+
+        async with self.write_lock, self.every_part():
+            token = _in_transaction.set(True)
+            unpublished = _unpublished.set([])
+            await self.run(self.db.begin)
+            try:
+                yield
+            except BaseException:
+                await self.run(self.db.rollback)
+                # Rolled back writes may already be reflected in the cache
+                self.cache.clear()
+                raise
+            else:
+                await self.run(self.db.commit)
+                for event in _unpublished.get():
+                    self.presence.publish(*event)
+            finally:
+                _unpublished.reset(unpublished)
+                _in_transaction.reset(token)
+
+    async def find_by_username(self, username: Username) -> Player | None:
+        if entry := self.cache.get(username):
+            player = entry.player
+        else:
+            generation = self.cache.generation
+            part, storage = self.part_of(username)
+            player = await self.read(part, storage.find_by_username, username)
+            # Not what's uncommitted, which other tasks could then see
+            if not _in_transaction.get():
+                self.cache.fill(username, player, generation)
+        if player is not None and (buffered := self.last_seen.get(username)):
+            player = replace(player, last_seen=buffered)
+        return player
+
+    async def list_active(
+        self, since: int, limit: int, after: Player | None = None
+    ) -> list[Player]:
+        # Straight from sqlite, so heartbeats still in the write-behind buffer
+        # show up after the next flush
+        return await self.read(None, self.db.list_active, since, limit, after)
+
+    async def save(self, username: Username) -> bool:
+        part, storage = self.part_of(username)
+        saved = await self.write(part, storage.save, username)
+        self.cache.invalidate(username)
+        return saved
+
+    async def update(self, username: Username) -> None:
+        part, storage = self.part_of(username)
+        await self.write(part, storage.update, username)
+        self.cache.invalidate(username)
+
+    async def remove(self, username: Username) -> None:
+        part, storage = self.part_of(username)
+        await self.write(part, storage.remove, username)
+        self.cache.invalidate(username)
+        self.cache.put(username, None)
+
+    async def expire(self, before: int, limit: int) -> list[Player]:
+        expired = await self.write(None, self.db.expire, before, limit)
+        for player in expired:
+            self.cache.invalidate(player.username)
+        return expired
+
+    async def incremental_vacuum(self, pages: int) -> bool:
+        return await self.write(None, self.db.incremental_vacuum, pages)
+
+    def publish(
+        self, event: PresenceEvent, username: Username, last_seen: int | None = None
+    ) -> None:
+        """PresenceHub.publish, held back until the open transaction commits"""
+        if _in_transaction.get():
+            _unpublished.get().append((event, username, last_seen))
+        else:
+            self.presence.publish(event, username, last_seen)
+
+    async def touch(self, username: Username) -> None:
+        if self.last_seen.record(username):
+            await self.flush()
+
+    async def flush(self) -> None:
+        # Each part's executor is FIFO, so reads queued after this see the
+        # flushed rows
+        if pending := self.last_seen.drain():
+            by_part: defaultdict[int, dict[Username, int]] = defaultdict(dict)
+            for username, last_seen in pending.items():
+                by_part[self.db.part_of(username)][username] = last_seen
+            LOG.debug(f"Flushing last_seen for {len(pending)} player(s)")
+            parts = self.db.parts()
+            results = await asyncio.gather(
+                *(
+                    self.write(part, parts[part][0].update_many, list(rows.items()))
+                    for part, rows in by_part.items()
+                ),
+                return_exceptions=True,
+            )
+            failed: BaseException | None = None
+            for rows, result in zip(by_part.values(), results, strict=True):
+                if isinstance(result, BaseException):
+                    # Keep them for the next flush so the reaper doesn't
+                    # expire players who were sending heartbeats
+                    self.last_seen.restore(rows)
+                    failed = failed or result
+                else:
+                    for username, last_seen in rows.items():
+                        self.cache.refresh(username, last_seen)
+            if failed is not None:
+                raise failed
+
+    async def flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.last_seen.flush_interval)
+            try:
+                await self.flush()
+            except sqlite3.Error:
+                LOG.exception("Failed to flush last_seen")
+
+    def close(self) -> None:
+        self.presence.close()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,219 @@
+"""Starting, stopping and restarting a server without dropping requests
+
+Ready: once it's listening, the server says so through a ready file holding
+its pid, systemd's NOTIFY_SOCKET, and the pipe a predecessor handing over to
+it is waiting on, whichever of those apply.
+
+Stop, on SIGTERM or SIGINT: stop accepting, let every connection finish the
+requests it has already sent while reading nothing more, then close it.
+Whatever's still open after drain_timeout is aborted, and pending last_seen
+writes are flushed on the way out. A second Ctrl-C aborts straight away.
+
+Restart, on SIGHUP: start a new copy of this process, handing it the
+listening sockets, and stop as above once it says it's ready. The sockets
+never close, so connections arriving in between queue for whichever process
+accepts first. Keep-alive clients move over one by one, as each reconnects
+for its next request, rather than all at once.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from dataclasses import field
+from pathlib import Path
+
+from lfgdev.types import mutable
+
+LOG = logging.getLogger(__name__)
+
+# File descriptors a restarting server hands its successor, comma separated
+LISTEN_FDS = "LFGDEV_LISTEN_FDS"
+# Where that successor writes a line once it's ready
+READY_FD = "LFGDEV_READY_FD"
+
+
+def half_close(transport: asyncio.BaseTransport) -> None:
+    """Read what's already arrived, then EOF, as if the client had half-closed
+
+    Both engines already answer what they've read before closing on EOF.
+    """
+    with contextlib.suppress(OSError):
+        transport.get_extra_info("socket").shutdown(socket.SHUT_RD)
+
+
+@mutable
+class Connections:
+    open: set[asyncio.WriteTransport] = field(default_factory=set)
+    draining: bool = False
+    # Set once the last one closes while draining
+    closed_all: asyncio.Event | None = None
+
+    def opened(self, transport: asyncio.WriteTransport) -> None:
+        self.open.add(transport)
+        # Accepted just before the listener closed
+        if self.draining:
+            half_close(transport)
+
+    def closed(self, transport: asyncio.WriteTransport) -> None:
+        self.open.discard(transport)
+        if not self.open and self.closed_all is not None:
+            self.closed_all.set()
+
+    def abort(self) -> int:
+        aborting = list(self.open)
+        for transport in aborting:
+            transport.abort()
+        return len(aborting)
+
+    async def drain(self, timeout: float) -> int:
+        """Stop every connection reading; how many were aborted after timeout"""
+        self.draining = True
+        self.closed_all = asyncio.Event()
+        for transport in list(self.open):
+            half_close(transport)
+        if self.open:
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(timeout):
+                    await self.closed_all.wait()
+        return self.abort()
+
+
+@mutable
+class Lifecycle:
+    connections: Connections = field(default_factory=Connections)
+    # Whether SIGHUP starts a successor; not for --workers, where it's the
+    # supervisor that would need starting again
+    restartable: bool = False
+    requested: asyncio.Event = field(default_factory=asyncio.Event)
+    restarting: bool = False
+
+    def install(self) -> None:
+        """Handle signals on the running loop, if it's the main thread's"""
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        loop.add_signal_handler(signal.SIGINT, self.interrupt)
+        if self.restartable:
+            loop.add_signal_handler(signal.SIGHUP, self.restart)
+
+    def stop(self) -> None:
+        self.restarting = False
+        self.requested.set()
+
+    def interrupt(self) -> None:
+        """Like stop, but the second Ctrl-C aborts whatever's left
+
+        Only SIGINT: a supervisor follows Ctrl-C with SIGTERM for its workers.
+        """
+        if self.requested.is_set() and not self.restarting:
+            LOG.warning(f"Aborting {self.connections.abort()} connection(s)")
+        else:
+            self.stop()
+
+    def restart(self) -> None:
+        if not self.requested.is_set():
+            self.restarting = True
+            self.requested.set()
+
+    async def wait(self) -> bool:
+        """Until a stop or restart is asked for; True if it's a restart"""
+        await self.requested.wait()
+        return self.restarting
+
+    def carry_on(self) -> None:
+        """After a restart that didn't happen, unless a stop came in meanwhile"""
+        if self.restarting:
+            self.restarting = False
+            self.requested.clear()
+
+
+def inherited_listeners() -> list[socket.socket]:
+    """The sockets a restarting predecessor handed over, if any"""
+    fds = os.environ.pop(LISTEN_FDS, "")
+    return [socket.socket(fileno=int(fd)) for fd in fds.split(",") if fd]
+
+
+def notify_systemd(state: str) -> None:
+    if not (address := os.environ.get("NOTIFY_SOCKET")):
+        return
+    # A leading @ is the abstract namespace
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(state.encode(), address)
+    except OSError as error:
+        LOG.warning(f"Couldn't notify systemd: {error}")
+
+
+def announce_ready(ready_file: Path | None) -> None:
+    if ready_file is not None:
+        ready_file.write_text(f"{os.getpid()}\n")
+    # Restarted servers are a new pid, which systemd needs telling about
+    notify_systemd(f"READY=1\nMAINPID={os.getpid()}")
+    if fd := os.environ.pop(READY_FD, ""):
+        with open(int(fd), "wb") as predecessor:
+            predecessor.write(b"ready\n")
+
+
+def withdraw_ready(ready_file: Path | None) -> None:
+    """Remove the ready file, unless a successor has already replaced it"""
+    if ready_file is None:
+        return
+    with contextlib.suppress(FileNotFoundError):
+        if ready_file.read_text().strip() == str(os.getpid()):
+            ready_file.unlink()
+
+
+async def hand_off(fds: list[int], timeout: float) -> bool:
+    """Start this same command again on these sockets; True once it's ready
+
+    If it isn't ready in time it's killed, and this process carries on.
+    """
+    ready_read, ready_write = os.pipe()
+    env = os.environ | {
+        LISTEN_FDS: ",".join(map(str, fds)),
+        READY_FD: str(ready_write),
+    }
+    try:
+        successor = await asyncio.create_subprocess_exec(
+            sys.executable,
+            *sys.orig_argv[1:],
+            env=env,
+            pass_fds=(*fds, ready_write),
+        )
+    except OSError:
+        os.close(ready_read)
+        LOG.exception("Couldn't start a new server")
+        return False
+    finally:
+        os.close(ready_write)
+    LOG.info(f"Handing over to a new server (pid {successor.pid})")
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(ready_read, "rb")
+    )
+    try:
+        async with asyncio.timeout(timeout):
+            # Empty if it exits first
+            ready = await reader.readline()
+    except TimeoutError:
+        ready = b""
+    finally:
+        transport.close()
+    if ready:
+        return True
+    LOG.error(f"New server (pid {successor.pid}) never got ready; carrying on")
+    successor.kill()
+    await successor.wait()
+    return False
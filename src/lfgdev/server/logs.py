@@ -0,0 +1,163 @@
+"""Logging that stays off the event loop
+
+Every lfgdev logger feeds a queue, and a QueueListener thread does the
+formatting and the writing, so a slow terminal or pipe can't stall requests.
+Per-request lines carry their content type, which is what sampling keys on,
+and the access log can be plain text or one JSON object per line.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sys
+from collections import Counter
+from dataclasses import field
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Literal
+
+from lfgdev.types import ContentType, immutable, mutable
+
+AccessFormat = Literal["text", "json"]
+
+# One line per request, written after the reply. Off unless configured
+ACCESS_LOG = logging.getLogger("lfgdev.access")
+ACCESS_LOG.disabled = True
+ACCESS_FIELDS = ("identifier", "sender", "content_type", "reply", "duration_ms")
+TEXT_ACCESS_FORMAT = (
+    "%(asctime)s %(identifier)s %(sender)s %(content_type)s -> %(reply)s "
+    "%(duration_ms).3fms"
+)
+
+
+def parse_sample(value: str) -> dict[str, float]:
+    """Parse e.g. "hello=0.01,last_seen=0.1" into the fraction of lines kept"""
+    rates: dict[str, float] = {}
+    for part in value.split(","):
+        name, _, rate = part.partition("=")
+        kind = ContentType.from_name(name.strip())
+        rates[kind.name] = float(rate or 1)
+        if not 0 <= rates[kind.name] <= 1:
+            raise ValueError(f"Sample rate for {kind.name} must be between 0 and 1")
+    return rates
+
+
+@immutable
+class LogConfig:
+    level: int = logging.INFO
+    # Fraction of request lines kept per content type; the rest keep them all
+    sample: dict[str, float] = field(default_factory=dict)
+    # Most request lines a second per content type, after sampling
+    rate_limit: float | None = None
+    # A file path, or "-" for stdout
+    access_log: str | None = None
+    access_format: AccessFormat = "text"
+
+
+@mutable
+class RequestSampler:
+    """logging filter thinning out request lines, i.e. those with a content_type
+
+    Sampling counts rather than rolls dice, so a rate of 0.01 keeps exactly
+    every hundredth line. Anything without a content type always passes.
+    """
+
+    rates: dict[str, float] = field(default_factory=dict)
+    rate_limit: float | None = None
+    seen: Counter[tuple[str, str]] = field(default_factory=Counter)
+    # (second, lines let through in it) per logger and content type
+    windows: dict[tuple[str, str], tuple[int, int]] = field(default_factory=dict)
+    dropped: int = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        content_type = getattr(record, "content_type", None)
+        if content_type is None:
+            return True
+        key = (record.name, content_type)
+
+        rate = self.rates.get(content_type, 1.0)
+        if rate < 1.0:
+            count = self.seen[key]
+            self.seen[key] = count + 1
+            if int((count + 1) * rate) == int(count * rate):
+                self.dropped += 1
+                return False
+
+        if self.rate_limit is not None:
+            second = int(record.created)
+            window, count = self.windows.get(key, (second, 0))
+            if window != second:
+                count = 0
+            if count >= self.rate_limit:
+                self.dropped += 1
+                return False
+            self.windows[key] = (second, count + 1)
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queues records as they are, leaving msg % args to the listener thread
+
+    QueueHandler.prepare formats in the logging thread, which is the cost
+    being moved off the loop. Only tracebacks are rendered up front, while
+    the frames they refer to are still around.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, object] = {"time": round(record.created, 6)}
+        for name in ACCESS_FIELDS:
+            if (value := getattr(record, name, None)) is not None:
+                entry[name] = value
+        return json.dumps(entry, separators=(",", ":"))
+
+
+def access_handler(config: LogConfig) -> logging.Handler:
+    handler: logging.Handler
+    if config.access_log == "-":
+        handler = logging.StreamHandler(sys.stdout)
+    else:
+        handler = logging.FileHandler(str(config.access_log))
+    if config.access_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_ACCESS_FORMAT))
+    # Only access lines, which in turn never reach the console handler
+    handler.addFilter(lambda record: record.name == ACCESS_LOG.name)
+    return handler
+
+
+def configure_logging(config: LogConfig | None = None) -> QueueListener:
+    """Route lfgdev logging through a queue; stop the listener to flush it"""
+    config = config or LogConfig()
+    console = logging.StreamHandler(sys.stdout)
+    console.addFilter(lambda record: record.name != ACCESS_LOG.name)
+    handlers: list[logging.Handler] = [console]
+    if config.access_log is not None:
+        handlers.append(access_handler(config))
+    ACCESS_LOG.disabled = config.access_log is None
+
+    queue: SimpleQueue[logging.LogRecord] = SimpleQueue()
+    handler = LazyQueueHandler(queue)
+    if config.sample or config.rate_limit is not None:
+        handler.addFilter(
+            RequestSampler(rates=config.sample, rate_limit=config.rate_limit)
+        )
+
+    server_logger = logging.getLogger("lfgdev")
+    server_logger.addHandler(handler)
+    server_logger.setLevel(config.level)
+    # Access lines are INFO, and -v shouldn't be needed to get them
+    ACCESS_LOG.setLevel(logging.INFO)
+
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,50 +1,491 @@
 import argparse
 import asyncio
+import atexit
 import logging
-import sys
+import os
+import socket
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
+from typing import Any
 
-from lfgdev.server.db import Database
+from lfgdev.server.admission import Admission
+from lfgdev.server.cache import PlayerCache
+from lfgdev.server.config import ServerConfig
+from lfgdev.server.db import AsyncDatabase, Database
+from lfgdev.server.lifecycle import (
+    Lifecycle,
+    announce_ready,
+    hand_off,
+    inherited_listeners,
+    notify_systemd,
+    withdraw_ready,
+)
+from lfgdev.server.logs import LogConfig, configure_logging, parse_sample
+from lfgdev.server.memory import MemoryStorage, snapshot_periodically
+from lfgdev.server.presence import PresenceHub
+from lfgdev.server.protocol import FrameProtocol
+from lfgdev.server.reaper import Reaper
 from lfgdev.server.request_handler import RequestHandler
+from lfgdev.server.shards import ShardedDatabase, check_shard
+from lfgdev.server.storage import Storage, StorageEngine
+from lfgdev.server.workers import Supervisor
+from lfgdev.server.write_behind import LastSeenBuffer
 
 LOG = logging.getLogger(__name__)
 
+# Used when --db isn't given
+DEFAULT_PATHS: dict[StorageEngine, Path] = {
+    "sqlite": Path("/tmp/lfg.db"),
+    "memory": Path("/tmp/lfg.log"),
+}
 
-async def serve(host: str, port: int, db: Database) -> None:
-    request_handler = RequestHandler(db=db)
-    server = await asyncio.start_server(
-        client_connected_cb=request_handler.handle,
-        host=host,
-        port=port,
-        reuse_port=True,
-        reuse_address=True,
-        start_serving=False,
+
+@contextmanager
+def open_storage(
+    engine: StorageEngine, path: Path | None, shards: int = 1
+) -> Iterator[Storage]:
+    """Memory storage without a path keeps nothing on disk; sqlite needs one"""
+    if engine == "memory":
+        with MemoryStorage.init(path=path) as storage:
+            yield storage
+    elif shards > 1:
+        with ShardedDatabase.init(path or DEFAULT_PATHS["sqlite"], shards) as db:
+            yield db
+    else:
+        with Database.init(path=path or DEFAULT_PATHS["sqlite"]) as db:
+            check_shard(db, 0, 1)
+            yield db
+
+
+async def serve(
+    host: str,
+    port: int,
+    db: Storage,
+    config: ServerConfig | None = None,
+    lifecycle: Lifecycle | None = None,
+    ready: Callable[[], None] | None = None,
+    listeners: Sequence[socket.socket] = (),
+) -> None:
+    """Until stopped, see lfgdev.server.lifecycle
+
+    Binds host and port, unless given sockets already listening, e.g. by a
+    restart. ready is called once connections are being accepted.
+    """
+    config = config or ServerConfig()
+    lifecycle = lifecycle or Lifecycle()
+    async_db = AsyncDatabase(
+        db=db,
+        last_seen=LastSeenBuffer(
+            flush_interval=config.flush_interval,
+            max_pending=config.max_pending_last_seen,
+        ),
+        cache=PlayerCache(
+            max_size=config.cache_size,
+            ttl=config.cache_ttl,
+            negative_ttl=config.negative_cache_ttl,
+        ),
+        presence=PresenceHub(
+            max_queue=config.subscriber_queue,
+            slow_policy=config.slow_subscribers,
+        ),
+    )
+    request_handler = RequestHandler(
+        db=async_db,
+        keep_alive=config.keep_alive,
+        idle_timeout=config.idle_timeout,
+        header_timeout=config.header_timeout,
+        body_timeout=config.body_timeout,
+        write_timeout=config.write_timeout,
+        max_in_flight=config.max_in_flight,
+        admission=Admission(
+            max_connections=config.max_connections,
+            max_requests=config.max_requests,
+            sender_rate=config.sender_rate,
+            sender_burst=config.sender_burst,
+        ),
+        connections=lifecycle.connections,
     )
-    async with server:
-        await server.serve_forever()
+    places: list[dict[str, Any]] = [{"sock": sock} for sock in listeners] or [
+        {"host": host, "port": port, "reuse_port": True, "reuse_address": True}
+    ]
+    servers: list[asyncio.Server] = []
+    for place in places:
+        if config.engine == "protocol":
+            server = await asyncio.get_running_loop().create_server(
+                lambda: FrameProtocol(request_handler=request_handler),
+                start_serving=False,
+                **place,
+            )
+        else:
+            server = await asyncio.start_server(
+                client_connected_cb=request_handler.handle,
+                start_serving=False,
+                **place,
+            )
+        servers.append(server)
+    tasks = [asyncio.create_task(async_db.flush_periodically())]
+    if config.player_ttl is not None:
+        reaper = Reaper(
+            db=async_db,
+            ttl=config.player_ttl,
+            interval=config.reap_interval,
+            batch_size=config.reap_batch_size,
+            pause=config.reap_pause,
+            vacuum_pages=config.vacuum_pages,
+        )
+        tasks.append(asyncio.create_task(reaper.run()))
+    if isinstance(db, MemoryStorage) and db.path is not None:
+        snapshots = snapshot_periodically(async_db, db, config.snapshot_interval)
+        tasks.append(asyncio.create_task(snapshots))
+    lifecycle.install()
+    try:
+        for server in servers:
+            await server.start_serving()
+        if ready is not None:
+            ready()
+        handed_over = False
+        while await lifecycle.wait():
+            if isinstance(db, MemoryStorage):
+                # Its players are in this process, not the file
+                LOG.error("Can't hand memory storage over; stop and start instead")
+            else:
+                fds = [sock.fileno() for server in servers for sock in server.sockets]
+                handed_over = await hand_off(fds, config.handoff_timeout)
+                if handed_over:
+                    break
+            lifecycle.carry_on()
+        if not handed_over:
+            notify_systemd("STOPPING=1")
 
+        LOG.info("Draining connections...")
+        for server in servers:
+            server.close()
+        if aborted := await lifecycle.connections.drain(config.drain_timeout):
+            LOG.warning(f"Aborted {aborted} connection(s) still busy after draining")
+            request_handler.metrics.timeouts["drain"] += aborted
+        for server in servers:
+            await server.wait_closed()
+    finally:
+        for server in servers:
+            server.close()
+        for task in tasks:
+            task.cancel()
+        await async_db.flush()
+        async_db.close()
+
+
+def run_worker(
+    host: str,
+    port: int,
+    db_path: Path | None,
+    config: ServerConfig,
+    log_config: LogConfig,
+) -> None:
+    """Entry point for each process started by --workers"""
+    listener = configure_logging(log_config)
+    try:
+        with open_storage(config.storage, db_path, config.shards) as db:
+            asyncio.run(serve(host=host, port=port, db=db, config=config))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.stop()
 
-def main() -> None:
-    server_logger = logging.getLogger("lfgdev")
-    server_logger.addHandler(logging.StreamHandler(sys.stdout))
-    server_logger.setLevel(logging.DEBUG)
 
+def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=1337)
     parser.add_argument("--local-only", action="store_true")
     parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument(
+        "--one-shot",
+        action="store_true",
+        help="Close each connection after a single reply (legacy behaviour)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["stream", "protocol"],
+        default="stream",
+        help="Serve connections with asyncio streams or a raw asyncio.Protocol",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=["sqlite", "memory"],
+        default="sqlite",
+        help="Keep players in sqlite, or in memory with a log to recover from",
+    )
+    parser.add_argument(
+        "--db",
+        type=Path,
+        default=None,
+        help="The sqlite file, or memory storage's log "
+        f"(default: {DEFAULT_PATHS['sqlite']} or {DEFAULT_PATHS['memory']})",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Spread sqlite players over this many files by username "
+        "(lfg.0.db, lfg.1.db, ...); change it with lfgdev-reshard",
+    )
+    parser.add_argument(
+        "--ephemeral",
+        action="store_true",
+        help="With --storage memory, keep nothing on disk",
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between snapshots of memory storage",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between last_seen write-behind flushes",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=10_000,
+        help="Maximum number of players held in the lookup cache",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=5.0,
+        help="Seconds a cached player stays valid",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of server processes sharing the port",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=30.0,
+        help="Seconds a keep-alive connection may wait between frames",
+    )
+    parser.add_argument(
+        "--header-timeout",
+        type=float,
+        default=10.0,
+        help="Seconds to send a header once started, or a new connection's first",
+    )
+    parser.add_argument(
+        "--body-timeout",
+        type=float,
+        default=10.0,
+        help="Seconds to send the rest of a frame once its header is in",
+    )
+    parser.add_argument(
+        "--write-timeout",
+        type=float,
+        default=10.0,
+        help="Seconds a client may leave a reply unread before it's disconnected",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=10.0,
+        help="Seconds connections get to finish their requests when stopping",
+    )
+    parser.add_argument(
+        "--handoff-timeout",
+        type=float,
+        default=30.0,
+        help="Seconds the new process gets to start on SIGHUP before it's killed",
+    )
+    parser.add_argument(
+        "--ready-file",
+        type=Path,
+        default=None,
+        help="Write the pid here once accepting connections, removed on exit",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=1024,
+        help="Connections per process; more are closed straight away",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=1024,
+        help="Requests processed at once per process; more get an overloaded Error",
+    )
+    parser.add_argument(
+        "--sender-rate",
+        type=float,
+        default=None,
+        help="Requests a second allowed per sender (default: unlimited)",
+    )
+    parser.add_argument(
+        "--sender-burst",
+        type=float,
+        default=20.0,
+        help="Requests a sender may send at once before --sender-rate applies",
+    )
+    parser.add_argument(
+        "--player-ttl",
+        type=float,
+        default=None,
+        help="Delete players not seen for this many seconds (default: never)",
+    )
+    parser.add_argument(
+        "--reap-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between sweeps for players past --player-ttl",
+    )
+    parser.add_argument(
+        "--reap-batch-size",
+        type=int,
+        default=500,
+        help="Players deleted per transaction during a sweep",
+    )
+    parser.add_argument(
+        "--vacuum-pages",
+        type=int,
+        default=0,
+        help="Free pages returned to the filesystem after each sweep",
+    )
+    parser.add_argument(
+        "--subscriber-queue",
+        type=int,
+        default=256,
+        help="Presence events held per subscriber before it counts as slow",
+    )
+    parser.add_argument(
+        "--slow-subscribers",
+        choices=["drop", "disconnect"],
+        default="disconnect",
+        help="Skip events for a slow subscriber, or disconnect it",
+    )
+    parser.add_argument(
+        "--log-sample",
+        type=parse_sample,
+        default={},
+        help='Fraction of request lines logged per content type, e.g. "hello=0.01"',
+    )
+    parser.add_argument(
+        "--log-rate-limit",
+        type=float,
+        default=None,
+        help="Most request lines logged a second per content type",
+    )
+    parser.add_argument(
+        "--access-log",
+        default=None,
+        help='Write one line per request to this file, or "-" for stdout',
+    )
+    parser.add_argument(
+        "--access-log-format",
+        choices=["text", "json"],
+        default="text",
+        help="Plain text or JSON lines",
+    )
     args = parser.parse_args()
+    if args.storage == "memory" and args.workers > 1:
+        # Each would have players of its own, all logging to the same file
+        parser.error("--storage memory can't be shared by --workers")
+    if args.ephemeral and args.storage != "memory":
+        parser.error("--ephemeral needs --storage memory")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.shards > 1 and args.storage != "sqlite":
+        parser.error("--shards needs --storage sqlite")
+    if args.ready_file is not None and args.workers > 1:
+        parser.error("--ready-file can't be shared by --workers")
 
-    if args.verbose:
-        server_logger.setLevel(logging.DEBUG)
-    else:
-        server_logger.setLevel(logging.INFO)
+    log_config = LogConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        sample=args.log_sample,
+        rate_limit=args.log_rate_limit,
+        access_log=args.access_log,
+        access_format=args.access_log_format,
+    )
+    listener = configure_logging(log_config)
+    # Drains whatever is still queued, on whichever way out
+    atexit.register(listener.stop)
+
+    config = ServerConfig(
+        keep_alive=not args.one_shot,
+        engine=args.engine,
+        flush_interval=args.flush_interval,
+        cache_size=args.cache_size,
+        cache_ttl=args.cache_ttl,
+        idle_timeout=args.idle_timeout,
+        header_timeout=args.header_timeout,
+        body_timeout=args.body_timeout,
+        write_timeout=args.write_timeout,
+        drain_timeout=args.drain_timeout,
+        handoff_timeout=args.handoff_timeout,
+        max_connections=args.max_connections,
+        max_requests=args.max_requests,
+        sender_rate=args.sender_rate,
+        sender_burst=args.sender_burst,
+        player_ttl=args.player_ttl,
+        reap_interval=args.reap_interval,
+        reap_batch_size=args.reap_batch_size,
+        vacuum_pages=args.vacuum_pages,
+        subscriber_queue=args.subscriber_queue,
+        slow_subscribers=args.slow_subscribers,
+        storage=args.storage,
+        shards=args.shards,
+        snapshot_interval=args.snapshot_interval,
+    )
 
+    hostname = "localhost" if args.local_only else "0.0.0.0"
+    db_path = args.db or DEFAULT_PATHS[args.storage]
+    if args.ephemeral:
+        db_path = None
+    if args.workers > 1:
+        LOG.info(f"Starting {args.workers} workers on {hostname}:{args.port}...")
+        # Create the schema and switch to WAL once, before workers race to
+        with open_storage(args.storage, db_path, args.shards):
+            pass
+        supervisor = Supervisor(
+            target=run_worker,
+            args=(hostname, args.port, db_path, config, log_config),
+            workers=args.workers,
+            # Workers drain before they exit
+            stop_timeout=args.drain_timeout + 5.0,
+        )
+        supervisor.run()
+        LOG.info("Shutting down...")
+        return
+
+    # Handed over by the server this one is restarting
+    listeners = inherited_listeners()
     try:
-        hostname = "localhost" if args.local_only else "0.0.0.0"
         LOG.info("Starting server...")
-        with Database.init(path=Path("/tmp/lfg.db")) as db:
-            LOG.info(f"Listening on {hostname}:{args.port}...")
-            asyncio.run(serve(host=hostname, port=args.port, db=db))
+        with open_storage(args.storage, db_path, args.shards) as db:
+            if listeners:
+                LOG.info(
+                    f"Taking over {hostname}:{args.port} from pid {os.getppid()}..."
+                )
+            else:
+                LOG.info(f"Listening on {hostname}:{args.port}...")
+            asyncio.run(
+                serve(
+                    host=hostname,
+                    port=args.port,
+                    db=db,
+                    config=config,
+                    lifecycle=Lifecycle(restartable=True),
+                    ready=partial(announce_ready, args.ready_file),
+                    listeners=listeners,
+                )
+            )
     except KeyboardInterrupt:
-        LOG.info("Shutting down...")
+        # Before signals were being handled
+        pass
+    finally:
+        withdraw_ready(args.ready_file)
+    LOG.info("Shut down")
@@ -0,0 +1,325 @@
+"""Storage in a dict, for when lookups matter more than durability
+
+Besides the dict, players are indexed by the second they were last seen in:
+a set of usernames per second, with the seconds in a sorted list. That's what
+list_active and expire walk. A heartbeat moves its player into the newest
+second, so it's a set add and remove, plus an append to the list for the
+first heartbeat of each second.
+
+On disk there's optionally a log, which every committed write is appended to,
+and a snapshot, which is the log compacted down to one record per player.
+Start-up loads the snapshot and replays the log on top. Appends reach the OS
+on every commit but are only fsynced by snapshots: a crashed process loses
+nothing, a crashed machine loses the last few seconds of heartbeats.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import field
+from pathlib import Path
+from struct import Struct
+from typing import BinaryIO, ClassVar
+
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.server.storage import Player, Storage
+from lfgdev.types import Username, mutable
+
+LOG = logging.getLogger(__name__)
+
+_SET = 1
+_DELETE = 2
+# Operation, last_seen and the length of the UTF-8 username that follows
+_RECORD = Struct("!BIB")
+
+
+def encode_record(op: int, username: Username, last_seen: int = 0) -> bytes:
+    name = username.encode("UTF-8")
+    return _RECORD.pack(op, last_seen, len(name)) + name
+
+
+def read_log(path: Path, latest: dict[Username, int | None]) -> None:
+    """Each player's last_seen as of the end of the log, None if deleted"""
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return
+    unpack_from = _RECORD.unpack_from
+    header = _RECORD.size
+    end = len(data)
+    offset = 0
+    while offset + header <= end:
+        op, last_seen, size = unpack_from(data, offset)
+        start = offset + header
+        if start + size > end:
+            break
+        offset = start + size
+        username = Username(data[start:offset].decode("UTF-8"))
+        if op == _SET:
+            latest[username] = last_seen
+        elif op == _DELETE:
+            latest[username] = None
+        else:
+            raise ValueError(f"{path} isn't a player log")
+    if offset < end:
+        # Cut off mid-write by a crash; everything before it still counts
+        LOG.warning(f"Ignoring a truncated record at the end of {path}")
+
+
+@mutable
+class MemoryStorage(Storage):
+    BLOCKING: ClassVar[bool] = False
+
+    # The log; None keeps nothing on disk
+    path: Path | None = None
+    # Whole records, so a lookup hands one out rather than building it
+    players: dict[Username, Player] = field(default_factory=dict)
+    # Distinct last_seen values, ascending, and who was last seen in each
+    seconds: list[int] = field(default_factory=list)
+    by_second: dict[int, set[Username]] = field(default_factory=dict)
+    log: BinaryIO | None = None
+    # Records not yet appended to the log, i.e. the open transaction's
+    unlogged: list[bytes] = field(default_factory=list)
+    # Each player's last_seen (None if absent) from before the open transaction
+    undo: dict[Username, int | None] | None = None
+    # Held from rotating the log until the snapshot that replaces it is written
+    snapshotting: threading.Lock = field(default_factory=threading.Lock)
+
+    @contextmanager
+    @staticmethod
+    def init(path: Path | None = None) -> Iterator[MemoryStorage]:
+        if path is None:
+            yield MemoryStorage()
+            return
+        storage = MemoryStorage.load(path)
+        storage.log = path.open("ab")
+        try:
+            yield storage
+        finally:
+            # Next start-up has a snapshot to load rather than a log to replay
+            try:
+                storage.snapshot()
+            finally:
+                if storage.log is not None:
+                    storage.log.close()
+
+    @staticmethod
+    def load(path: Path) -> MemoryStorage:
+        """Players as of the last commit logged there, not yet logging to it"""
+        LOG.debug(f"Loading players from {path}")
+        storage = MemoryStorage(path=path)
+        latest: dict[Username, int | None] = {}
+        for source in (storage.snapshot_path, storage.old_log_path, path):
+            read_log(source, latest)
+        # Built in one go rather than a record at a time, so the seconds are
+        # sorted once instead of inserted into one by one
+        for username, last_seen in latest.items():
+            if last_seen is not None:
+                storage.players[username] = Player(
+                    username=username, last_seen=last_seen
+                )
+                if (bucket := storage.by_second.get(last_seen)) is None:
+                    bucket = storage.by_second[last_seen] = set()
+                bucket.add(username)
+        storage.seconds = sorted(storage.by_second)
+        return storage
+
+    @property
+    def snapshot_path(self) -> Path:
+        assert self.path is not None
+        return self.path.with_name(self.path.name + ".snapshot")
+
+    @property
+    def old_log_path(self) -> Path:
+        """The log as of the snapshot being written, until it's done"""
+        assert self.path is not None
+        return self.path.with_name(self.path.name + ".old")
+
+    def apply(self, username: Username, last_seen: int | None) -> None:
+        """Set or delete a player, keeping the index in step"""
+        if (previous := self.players.get(username)) is not None:
+            left = self.by_second[previous.last_seen]
+            left.discard(username)
+            if not left:
+                del self.by_second[previous.last_seen]
+                del self.seconds[bisect_left(self.seconds, previous.last_seen)]
+        if last_seen is None:
+            self.players.pop(username, None)
+            return
+        self.players[username] = Player(username=username, last_seen=last_seen)
+        if (bucket := self.by_second.get(last_seen)) is None:
+            bucket = self.by_second[last_seen] = set()
+            # Almost always the newest second, so an append
+            insort(self.seconds, last_seen)
+        bucket.add(username)
+
+    def write(self, username: Username, last_seen: int | None) -> None:
+        if self.undo is not None and username not in self.undo:
+            previous = self.players.get(username)
+            self.undo[username] = previous.last_seen if previous else None
+        self.apply(username, last_seen)
+        if self.path is not None:
+            if last_seen is None:
+                self.unlogged.append(encode_record(_DELETE, username))
+            else:
+                self.unlogged.append(encode_record(_SET, username, last_seen))
+
+    def append_log(self) -> None:
+        """Hand what's been written so far to the OS, unless in a transaction"""
+        if self.undo is not None or not self.unlogged:
+            return
+        if self.log is not None:
+            self.log.write(b"".join(self.unlogged))
+            self.log.flush()
+        self.unlogged.clear()
+
+    def begin(self) -> None:
+        self.undo = {}
+
+    def commit(self) -> None:
+        self.undo = None
+        self.append_log()
+
+    def rollback(self) -> None:
+        if self.undo is not None:
+            for username, last_seen in self.undo.items():
+                self.apply(username, last_seen)
+        self.undo = None
+        self.unlogged.clear()
+
+    def find_by_username(self, username: Username) -> Player | None:
+        return self.players.get(username)
+
+    def list_active(
+        self, since: int, limit: int, after: Player | None = None
+    ) -> list[Player]:
+        seconds = self.seconds
+        if after is None:
+            end = len(seconds)
+        else:
+            end = bisect_right(seconds, after.last_seen)
+        page: list[Player] = []
+        for i in range(end - 1, bisect_left(seconds, since) - 1, -1):
+            second = seconds[i]
+            usernames: Iterable[Username] = self.by_second[second]
+            if after is not None and second == after.last_seen:
+                usernames = [name for name in usernames if name < after.username]
+            # Only as many of a crowded second as the page has room for
+            for username in heapq.nlargest(limit - len(page), usernames):
+                page.append(self.players[username])
+            if len(page) >= limit:
+                break
+        return page
+
+    def save(self, username: Username) -> bool:
+        if username in self.players:
+            return False
+        self.write(username, math.floor(time.time()))
+        self.append_log()
+        return True
+
+    def update(self, username: Username) -> None:
+        if username in self.players:
+            self.write(username, math.floor(time.time()))
+            self.append_log()
+
+    def update_many(self, last_seen: Iterable[tuple[Username, int]]) -> None:
+        for username, timestamp in last_seen:
+            if username in self.players:
+                self.write(username, timestamp)
+        self.append_log()
+
+    def remove(self, username: Username) -> None:
+        if username in self.players:
+            self.write(username, None)
+            self.append_log()
+
+    def expire(self, before: int, limit: int) -> list[Player]:
+        expired: list[Player] = []
+        for second in self.seconds[: bisect_left(self.seconds, before)]:
+            for username in self.by_second[second]:
+                expired.append(self.players[username])
+                if len(expired) >= limit:
+                    break
+            if len(expired) >= limit:
+                break
+        for player in expired:
+            self.write(player.username, None)
+        self.append_log()
+        return expired
+
+    def start_snapshot(
+        self, blocking: bool = False
+    ) -> list[tuple[Username, int]] | None:
+        """Every player as of now, with the log started over from here
+
+        Pass the players to finish_snapshot, which may run on another thread.
+        None if there's no log, or another snapshot is still being written.
+        """
+        if self.path is None or self.log is None:
+            return None
+        if not self.snapshotting.acquire(blocking=blocking):
+            return None
+        try:
+            self.log.close()
+            if self.old_log_path.exists():
+                # The last snapshot never got written, so what's in that log
+                # is still needed; this one goes on the end of it
+                with self.old_log_path.open("ab") as old:
+                    old.write(self.path.read_bytes())
+                self.path.unlink()
+            else:
+                self.path.rename(self.old_log_path)
+        except BaseException:
+            self.snapshotting.release()
+            raise
+        finally:
+            self.log = self.path.open("ab")
+        return [(player.username, player.last_seen) for player in self.players.values()]
+
+    def finish_snapshot(self, players: list[tuple[Username, int]]) -> None:
+        try:
+            written = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+            with written.open("wb") as snapshot:
+                snapshot.write(
+                    b"".join(
+                        encode_record(_SET, username, last_seen)
+                        for username, last_seen in players
+                    )
+                )
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            written.replace(self.snapshot_path)
+            self.old_log_path.unlink()
+        finally:
+            self.snapshotting.release()
+        LOG.debug(f"Snapshot of {len(players)} player(s) written")
+
+    def snapshot(self) -> None:
+        if (players := self.start_snapshot(blocking=True)) is not None:
+            self.finish_snapshot(players)
+
+
+async def snapshot_periodically(
+    db: AsyncDatabase, storage: MemoryStorage, interval: float
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        # Waits out any open transaction, so only committed writes are copied
+        async with db.transaction():
+            players = storage.start_snapshot()
+        if players is None:
+            continue
+        try:
+            await asyncio.to_thread(storage.finish_snapshot, players)
+        except OSError:
+            LOG.exception("Failed to write snapshot")
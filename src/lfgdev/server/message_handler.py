@@ -1,19 +1,34 @@
 import logging
-from dataclasses import replace
-from typing import ClassVar
+import math
+import time
+from dataclasses import field, replace
 
-from lfgdev.message import Error, LastSeen, Message, NoHello
-from lfgdev.server.db import Database
+from lfgdev.message import (
+    ActivePlayer,
+    Batch,
+    Error,
+    LastSeen,
+    ListActive,
+    Message,
+    NoHello,
+    Stats,
+)
+from lfgdev.server.db import AsyncDatabase, Player
+from lfgdev.server.middleware import log_message, update_last_seen
+from lfgdev.server.pipeline import Middleware, Pipeline, build_pipeline, echo
 from lfgdev.server.types import MessageRoute
-from lfgdev.types import ContentType, Username, immutable
+from lfgdev.types import ContentType, PresenceEvent, Username, immutable
 
 LOG = logging.getLogger(__name__)
 
+# Most players in one LIST_ACTIVE reply, whatever the request asks for
+MAX_PAGE = 100
+
 # Just give handling Hello a shot
 # When a HELLO is received, send back a NO_HELLO
 
 
-def handle_hello(db: Database, message: Message) -> Message:
+async def handle_hello(db: AsyncDatabase, message: Message) -> Message:
     # Sounds like ContentType should really
     # only be at the beginning of a body, so this isn't duplicated
     # use something like readexactly(CONTENT_TYPE_LENGTH) and then another readexactly at
@@ -24,37 +39,116 @@ def handle_hello(db: Database, message: Message) -> Message:
     return Message(header=header, body=NoHello())
 
 
-def handle_last_seen(db: Database, message: Message) -> Message:
-    if user := db.find_by_username(message.header.sender):
+async def handle_last_seen(db: AsyncDatabase, message: Message) -> Message:
+    if user := await db.find_by_username(message.header.sender):
         body = LastSeen(content=user.last_seen)
         message = Message(header=message.header, body=body)
     return message
 
 
-def handle_register(db: Database, message: Message) -> Message:
-    if db.find_by_username(message.header.sender) is not None:
+async def handle_register(db: AsyncDatabase, message: Message) -> Message:
+    # No lookup first: the insert itself says whether they were already there
+    if not await db.save(message.header.sender):
         header = replace(message.header, content_type=ContentType.ERROR)
         return Message(header=header, body=Error(content="Username already registered"))
-    db.save(message.header.sender)
+    db.publish(PresenceEvent.REGISTERED, message.header.sender)
+    return message
+
+
+async def handle_list_active(db: AsyncDatabase, message: Message) -> Message:
+    if not isinstance(message.body, ListActive):
+        raise TypeError(
+            f"Expected a ListActive body, got {type(message.body).__name__}"
+        )
+
+    request = message.body
+    limit = min(request.limit or MAX_PAGE, MAX_PAGE)
+    since = math.floor(time.time()) - request.window
+    after = None
+    if (cursor := request.cursor) is not None:
+        after = Player(username=cursor.username, last_seen=cursor.last_seen)
+    players = await db.list_active(since, limit, after)
+
+    page = tuple(
+        ActivePlayer(username=player.username, last_seen=player.last_seen)
+        for player in players
+    )
+    # A short page is the last one; a full one may be too, and then the next is empty
+    next_cursor = page[-1] if len(page) == limit else None
+    body = replace(request, limit=limit, cursor=next_cursor, content=page)
+    return Message(header=message.header, body=body)
+
+
+async def handle_stats(db: AsyncDatabase, message: Message) -> Message:
+    body = Stats(
+        content=db.metrics.render(cache=db.cache.stats, presence=db.presence.stats)
+    )
+    return Message(header=message.header, body=body)
+
+
+async def handle_subscribe(db: AsyncDatabase, message: Message) -> Message:
+    # Echoed back as the go-ahead; the connection itself is only known to the
+    # RequestHandler or FrameProtocol, which subscribes it on seeing the reply
     return message
 
 
+def unbatchable(message: Message) -> Message:
+    header = replace(
+        message.header, sender=Username("SERVER"), content_type=ContentType.ERROR
+    )
+    name = message.header.content_type.name
+    return Message(header=header, body=Error(content=f"{name} can't be batched"))
+
+
+# Module level rather than a ClassVar: mypyc writes ClassVar[dict[...]] into
+# __annotations__ as plain dict, which dataclass() then treats as a field
+_MESSAGE_HANDLERS: MessageRoute = {
+    ContentType.HELLO: handle_hello,
+    ContentType.LAST_SEEN: handle_last_seen,
+    ContentType.REGISTER: handle_register,
+    ContentType.STATS: handle_stats,
+    ContentType.LIST_ACTIVE: handle_list_active,
+    ContentType.SUBSCRIBE: handle_subscribe,
+    ContentType.UNSUBSCRIBE: handle_subscribe,
+}
+# Act on the connection, so they mean nothing inside a BATCH
+_CONNECTION_TYPES = frozenset({ContentType.SUBSCRIBE, ContentType.UNSUBSCRIBE})
+# In the order they run, for each content type they apply to
+MIDDLEWARE: tuple[Middleware, ...] = (log_message, update_last_seen)
+
+
 @immutable
 class MessageHandler:
-    _message_handlers: ClassVar[MessageRoute] = {
-        ContentType.HELLO: handle_hello,
-        ContentType.LAST_SEEN: handle_last_seen,
-        ContentType.REGISTER: handle_register,
-    }
-    db: Database
-
-    def route(self, message: Message) -> Message:
-        if handler := self._message_handlers.get(message.header.content_type):
-            reply = handler(self.db, message)
-        else:
-            LOG.warning(f"No handler for {message.header.content_type.name}")
-            reply = message
-
-        header = replace(reply.header, sender=Username("SERVER"))
-        LOG.debug(f"Reply to {message.header.sender}: {reply}")
-        return replace(reply, header=header)
+    """Sends each message down the pipeline built for its ContentType"""
+
+    db: AsyncDatabase
+    middleware: tuple[Middleware, ...] = MIDDLEWARE
+    pipelines: dict[ContentType, Pipeline] = field(init=False)
+
+    def __post_init__(self) -> None:
+        handlers = {**_MESSAGE_HANDLERS, ContentType.BATCH: self.handle_batch}
+        pipelines = {
+            content_type: build_pipeline(
+                self.db, content_type, self.middleware, handlers.get(content_type, echo)
+            )
+            for content_type in ContentType
+        }
+        object.__setattr__(self, "pipelines", pipelines)
+
+    async def route(self, message: Message) -> Message:
+        return await self.pipelines[message.header.content_type](message)
+
+    async def handle_batch(self, db: AsyncDatabase, message: Message) -> Message:
+        if not isinstance(message.body, Batch):
+            raise TypeError(f"Expected a Batch body, got {type(message.body).__name__}")
+
+        # Every sub-message goes down its own pipeline, middleware included.
+        # One commit for the whole batch; a failure rolls every one back
+        async with db.transaction():
+            replies = [
+                await self.route(sub)
+                if sub.header.content_type not in _CONNECTION_TYPES
+                else unbatchable(sub)
+                for sub in message.body.content
+            ]
+        return Message(header=message.header, body=Batch(content=tuple(replies)))
@@ -0,0 +1,158 @@
+"""Counters and latency histograms for a running server
+
+Recording is a dict lookup and a bisect, so it's cheap enough to leave on for
+every request. render() turns everything into the Prometheus text format,
+which is what a STATS request gets back.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import field
+
+from lfgdev.server.cache import CacheStats
+from lfgdev.server.presence import PresenceStats
+from lfgdev.types import mutable
+
+# Upper bounds in seconds; anything slower lands in the implicit +Inf bucket
+LATENCY_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+
+@mutable
+class Histogram:
+    counts: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    total: float = 0.0
+    count: int = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+@mutable
+class Metrics:
+    requests: Counter[str] = field(default_factory=Counter)
+    # Keyed by reason, e.g. "internal" or "malformed"
+    errors: Counter[str] = field(default_factory=Counter)
+    # Connections closed on a deadline, keyed by idle, header, body, write or
+    # drain (still busy when a graceful stop ran out of time)
+    timeouts: Counter[str] = field(default_factory=Counter)
+    connections: int = 0
+    active_connections: int = 0
+    # Requests being processed right now, across all connections
+    in_flight: int = 0
+    # Players deleted by the reaper
+    expired: int = 0
+    # decode, db and send
+    stages: dict[str, Histogram] = field(default_factory=dict)
+    # Keyed by the ContentType being handled
+    routes: dict[str, Histogram] = field(default_factory=dict)
+    middleware: dict[str, Histogram] = field(default_factory=dict)
+
+    @staticmethod
+    def observe(histograms: dict[str, Histogram], label: str, seconds: float) -> None:
+        if (histogram := histograms.get(label)) is None:
+            histogram = histograms[label] = Histogram()
+        histogram.observe(seconds)
+
+    def connection_opened(self) -> None:
+        self.connections += 1
+        self.active_connections += 1
+
+    def connection_closed(self) -> None:
+        self.active_connections -= 1
+
+    def render(
+        self, cache: CacheStats | None = None, presence: PresenceStats | None = None
+    ) -> str:
+        lines: list[str] = []
+
+        def family(name: str, kind: str, help: str) -> None:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        family("lfgdev_requests_total", "counter", "Requests by content type")
+        for content_type, count in sorted(self.requests.items()):
+            lines.append(
+                f'lfgdev_requests_total{{content_type="{content_type}"}} {count}'
+            )
+
+        family("lfgdev_errors_total", "counter", "Failed requests by reason")
+        for reason, count in sorted(self.errors.items()):
+            lines.append(f'lfgdev_errors_total{{reason="{reason}"}} {count}')
+
+        family("lfgdev_timeouts_total", "counter", "Connections closed on a deadline")
+        for phase, count in sorted(self.timeouts.items()):
+            lines.append(f'lfgdev_timeouts_total{{phase="{phase}"}} {count}')
+
+        family("lfgdev_connections_total", "counter", "Connections accepted")
+        lines.append(f"lfgdev_connections_total {self.connections}")
+        family("lfgdev_active_connections", "gauge", "Connections currently open")
+        lines.append(f"lfgdev_active_connections {self.active_connections}")
+        family("lfgdev_in_flight", "gauge", "Requests being processed")
+        lines.append(f"lfgdev_in_flight {self.in_flight}")
+        family("lfgdev_expired_players_total", "counter", "Players the reaper deleted")
+        lines.append(f"lfgdev_expired_players_total {self.expired}")
+
+        for name, label, histograms, help in [
+            ("lfgdev_stage_seconds", "stage", self.stages, "Time per request stage"),
+            (
+                "lfgdev_route_seconds",
+                "content_type",
+                self.routes,
+                "Time in each content type's handler",
+            ),
+            (
+                "lfgdev_middleware_seconds",
+                "middleware",
+                self.middleware,
+                "Time in each middleware",
+            ),
+        ]:
+            family(name, "histogram", help)
+            for value, histogram in sorted(histograms.items()):
+                labels = f'{label}="{value}"'
+                cumulative = 0
+                for bound, count in zip(
+                    (*LATENCY_BUCKETS, "+Inf"), histogram.counts, strict=True
+                ):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        if cache is not None:
+            for stat in ("hits", "negative_hits", "misses", "evictions"):
+                help = f"Player cache {stat.replace('_', ' ')}"
+                family(f"lfgdev_cache_{stat}_total", "counter", help)
+                lines.append(f"lfgdev_cache_{stat}_total {getattr(cache, stat)}")
+
+        if presence is not None:
+            family("lfgdev_subscribers", "gauge", "Connections subscribed to presence")
+            lines.append(f"lfgdev_subscribers {presence.subscribers}")
+            for stat, help in [
+                ("events", "Presence events published"),
+                ("dropped", "Presence pushes skipped for a full queue"),
+                ("disconnected", "Subscribers disconnected for falling behind"),
+            ]:
+                family(f"lfgdev_presence_{stat}_total", "counter", help)
+                lines.append(f"lfgdev_presence_{stat}_total {getattr(presence, stat)}")
+
+        return "\n".join(lines) + "\n"
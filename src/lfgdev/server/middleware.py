@@ -1,18 +1,42 @@
 import logging
 
 from lfgdev.message import Message
-from lfgdev.server.main import Database
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.server.pipeline import middleware
+from lfgdev.types import ContentType, PresenceEvent
 
 LOG = logging.getLogger(__name__)
 
 
-def update_last_seen(db: Database, message: Message) -> Message:
-    if db.find_by_username(message.header.sender) is not None:
-        db.update(message.header.sender)
+@middleware()
+async def update_last_seen(db: AsyncDatabase, message: Message) -> Message:
+    # Every request is a heartbeat, or clients that never send LAST_SEEN would
+    # never be listed as active, and would be reaped. Except REGISTER, which
+    # saves last_seen itself and announces the player as REGISTERED
+    if message.header.content_type is ContentType.REGISTER:
+        return message
+    sender = message.header.sender
+    # Only news to subscribers the first time a player shows up in a flush
+    first = db.last_seen.get(sender) is None
+    # Buffered; unknown senders are no-ops when the buffer is flushed
+    await db.touch(sender)
+    if (
+        first
+        and db.presence.subscribers
+        and await db.find_by_username(sender) is not None
+    ):
+        db.publish(PresenceEvent.SEEN, sender)
     # TODO: Another need for a status code of some sort
     return message
 
 
-def log_message(db: Database, message: Message) -> Message:
-    LOG.info(f"Received message from {message.header.sender}: {message.body}")
+@middleware()
+def log_message(db: AsyncDatabase, message: Message) -> Message:
+    # Formatted later, and only if it gets past the level and sampling
+    LOG.info(
+        "Received message from %s: %s",
+        message.header.sender,
+        message.body,
+        extra={"content_type": message.header.content_type.name},
+    )
     return message
@@ -0,0 +1,132 @@
+"""Middleware and handler composed into one callable per ContentType
+
+Pipelines are built once, when the MessageHandler is created. Each one only
+holds the middleware that applies to its content type, already sorted into
+sync and async, so per message there's no filtering and nothing to look up.
+"""
+
+from __future__ import annotations
+
+import inspect
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import field, replace
+from typing import cast
+
+from lfgdev.message import Message
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.server.logs import ACCESS_LOG
+from lfgdev.server.types import Handler
+from lfgdev.types import ContentType, Username, immutable
+
+LOG = logging.getLogger(__name__)
+
+
+@immutable
+class Reply:
+    """Returned by middleware to answer straight away, skipping the handler"""
+
+    message: Message
+
+
+Pipeline = Callable[[Message], Awaitable[Message]]
+# Returning a Message passes it on down the pipeline
+MiddlewareFn = Callable[
+    [AsyncDatabase, Message], Message | Reply | Awaitable[Message | Reply]
+]
+
+
+@immutable
+class Middleware:
+    fn: MiddlewareFn
+    # None applies to every content type
+    content_types: frozenset[ContentType] | None = None
+    is_async: bool = field(init=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "is_async", inspect.iscoroutinefunction(self.fn))
+
+    @property
+    def name(self) -> str:
+        return self.fn.__name__
+
+    def applies_to(self, content_type: ContentType) -> bool:
+        return self.content_types is None or content_type in self.content_types
+
+    def __call__(
+        self, db: AsyncDatabase, message: Message
+    ) -> Message | Reply | Awaitable[Message | Reply]:
+        return self.fn(db, message)
+
+
+def middleware(*content_types: ContentType) -> Callable[[MiddlewareFn], Middleware]:
+    """Declare a function as middleware, for only these content types if given"""
+
+    def wrap(fn: MiddlewareFn) -> Middleware:
+        return Middleware(fn=fn, content_types=frozenset(content_types) or None)
+
+    return wrap
+
+
+async def echo(db: AsyncDatabase, message: Message) -> Message:
+    LOG.warning("No handler for %s", message.header.content_type.name)
+    return message
+
+
+def access(message: Message, reply: Message, elapsed: float) -> None:
+    ACCESS_LOG.info(
+        "Replied to %s",
+        message.header.identifier,
+        extra={
+            "identifier": str(message.header.identifier),
+            "sender": message.header.sender,
+            "content_type": message.header.content_type.name,
+            "reply": reply.header.content_type.name,
+            "duration_ms": round(elapsed * 1000, 3),
+        },
+    )
+
+
+def build_pipeline(
+    db: AsyncDatabase,
+    content_type: ContentType,
+    middleware: Iterable[Middleware],
+    handler: Handler,
+) -> Pipeline:
+    steps = tuple(
+        (step.name, step.fn, step.is_async)
+        for step in middleware
+        if step.applies_to(content_type)
+    )
+    route = content_type.name
+    metrics = db.metrics
+
+    async def pipeline(message: Message) -> Message:
+        received = time.perf_counter()
+        for name, fn, is_async in steps:
+            start = time.perf_counter()
+            outcome = fn(db, message)
+            if is_async:
+                result = await cast("Awaitable[Message | Reply]", outcome)
+            else:
+                result = cast("Message | Reply", outcome)
+            elapsed = time.perf_counter() - start
+            metrics.observe(metrics.middleware, name, elapsed)
+            if isinstance(result, Reply):
+                reply = result.message
+                break
+            message = result
+        else:
+            start = time.perf_counter()
+            reply = await handler(db, message)
+            metrics.observe(metrics.routes, route, time.perf_counter() - start)
+
+        header = replace(reply.header, sender=Username("SERVER"))
+        reply = replace(reply, header=header)
+        LOG.debug("Reply to %s: %s", message.header.sender, reply)
+        if ACCESS_LOG.isEnabledFor(logging.INFO):
+            access(message, reply, time.perf_counter() - received)
+        return reply
+
+    return pipeline
@@ -0,0 +1,123 @@
+"""Pushes presence changes to every connection that sent SUBSCRIBE
+
+An event is encoded into a frame once, however many subscribers there are,
+and the same bytes are queued for each of them. Every subscriber has its own
+bounded queue and a task writing it out, so one slow reader never holds up
+the rest: once its queue is full it's either skipped or disconnected.
+
+Only changes made through this process are seen; with --workers, each
+worker's subscribers hear about their own worker's players.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from asyncio import Queue, QueueFull, Task
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import field
+from typing import Literal
+
+from lfgdev.message import ActivePlayer, Header, Message, Presence
+from lfgdev.types import ContentType, PresenceEvent, Username, mutable
+
+LOG = logging.getLogger(__name__)
+
+# What happens to a subscriber whose queue is full when an event comes in
+SlowPolicy = Literal["drop", "disconnect"]
+
+
+@mutable
+class PresenceStats:
+    subscribers: int = 0
+    events: int = 0
+    # Pushes skipped for a subscriber with a full queue
+    dropped: int = 0
+    # Subscribers cut off for falling behind
+    disconnected: int = 0
+
+
+@mutable
+class Subscriber:
+    # Writes one frame, raising once the connection can't take it
+    send: Callable[[bytes], Awaitable[None]]
+    # Drops the connection without waiting for what's still buffered
+    abort: Callable[[], None]
+    queue: Queue[bytes]
+    task: Task[None] | None = None
+
+
+@mutable
+class PresenceHub:
+    # Frames held per subscriber before slow_policy applies
+    max_queue: int = 256
+    slow_policy: SlowPolicy = "disconnect"
+    # Keyed by whatever identifies the connection, e.g. its StreamWriter
+    subscribers: dict[Hashable, Subscriber] = field(default_factory=dict)
+    stats: PresenceStats = field(default_factory=PresenceStats)
+
+    def subscribed(self, key: Hashable) -> bool:
+        return key in self.subscribers
+
+    def subscribe(
+        self,
+        key: Hashable,
+        send: Callable[[bytes], Awaitable[None]],
+        abort: Callable[[], None],
+    ) -> None:
+        if key in self.subscribers:
+            return
+        subscriber = Subscriber(send=send, abort=abort, queue=Queue(self.max_queue))
+        subscriber.task = asyncio.create_task(self.push(key, subscriber))
+        self.subscribers[key] = subscriber
+        self.stats.subscribers = len(self.subscribers)
+
+    def unsubscribe(self, key: Hashable) -> None:
+        if (subscriber := self.subscribers.pop(key, None)) is None:
+            return
+        if subscriber.task is not None:
+            subscriber.task.cancel()
+        self.stats.subscribers = len(self.subscribers)
+
+    def publish(
+        self, event: PresenceEvent, username: Username, last_seen: int | None = None
+    ) -> None:
+        if not self.subscribers:
+            return
+        if last_seen is None:
+            last_seen = math.floor(time.time())
+        header = Header(sender=Username("SERVER"), content_type=ContentType.PRESENCE)
+        player = ActivePlayer(username=username, last_seen=last_seen)
+        frame = Message(header=header, body=Presence(event=event, content=player))
+        data = frame.encode()
+        self.stats.events += 1
+
+        # A copy, since disconnecting someone changes the dict
+        for key, subscriber in list(self.subscribers.items()):
+            try:
+                subscriber.queue.put_nowait(data)
+            except QueueFull:
+                self.stats.dropped += 1
+                if self.slow_policy == "disconnect":
+                    LOG.info(
+                        "Disconnecting a subscriber %d events behind", self.max_queue
+                    )
+                    self.stats.disconnected += 1
+                    self.unsubscribe(key)
+                    subscriber.abort()
+
+    async def push(self, key: Hashable, subscriber: Subscriber) -> None:
+        try:
+            while True:
+                await subscriber.send(await subscriber.queue.get())
+        except (ConnectionError, TimeoutError) as error:
+            LOG.debug("Stopped pushing presence: %r", error)
+            if self.subscribers.get(key) is subscriber:
+                del self.subscribers[key]
+                self.stats.subscribers = len(self.subscribers)
+
+    def close(self) -> None:
+        for key in list(self.subscribers):
+            self.unsubscribe(key)
@@ -0,0 +1,285 @@
+"""Server engine built directly on asyncio.Protocol
+
+The stream engine goes through a StreamReader buffer, two readexactly()
+coroutines per frame and a drain() per reply. Here frames are decoded straight
+out of the bytes handed to data_received, and replies are written to the
+transport as soon as they are ready. Only a trailing partial frame gets copied
+into the connection's buffer.
+
+Middleware and routing are the same RequestHandler the stream engine uses.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+from asyncio import BaseTransport, Task, TimerHandle, Transport
+from dataclasses import field
+from typing import cast
+
+from lfgdev.message import Header, Message
+from lfgdev.message.codec import HEADER_SIZE, decode_body, decode_frame_header
+from lfgdev.server.request_handler import RequestHandler
+from lfgdev.types import mutable
+
+LOG = logging.getLogger(__name__)
+
+
+@mutable
+class FrameProtocol(asyncio.Protocol):
+    request_handler: RequestHandler
+    transport: Transport | None = None
+    # Start of a frame that hasn't fully arrived yet
+    buffer: bytearray = field(default_factory=bytearray)
+    tasks: set[Task[None]] = field(default_factory=set)
+    reading_paused: bool = False
+    # Held up by RequestHandler.throttle() until a refusal goes out
+    throttled: bool = False
+    # Client sent EOF, or this is a one-shot connection that got its frame
+    done_reading: bool = False
+    writable: asyncio.Event = field(default_factory=asyncio.Event)
+    # What the connection is waiting on: idle (a new frame), header or body.
+    # A new connection has header_timeout to send its first header
+    phase: str = "header"
+    phase_started: float = field(default_factory=time.monotonic)
+    deadline_timer: TimerHandle | None = None
+    # False when turned away by admission control, so never counted as open
+    admitted: bool = False
+
+    def connection_made(self, transport: BaseTransport) -> None:
+        self.transport = cast(Transport, transport)
+        metrics = self.request_handler.metrics
+        if not self.request_handler.admission.admit_connection(
+            metrics.active_connections
+        ):
+            metrics.errors["connection_limit"] += 1
+            self.transport.close()
+            return
+        self.admitted = True
+        metrics.connection_opened()
+        self.request_handler.connections.opened(self.transport)
+        self.writable.set()
+        self.schedule_deadline()
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if exc is not None:
+            LOG.debug("Connection lost: %r", exc)
+        self.request_handler.db.presence.unsubscribe(self.transport)
+        if self.admitted:
+            self.request_handler.metrics.connection_closed()
+        if self.transport is not None:
+            self.request_handler.connections.closed(self.transport)
+        if self.deadline_timer is not None:
+            self.deadline_timer.cancel()
+        # Replies still being processed have nowhere to go
+        self.writable.set()
+        self.transport = None
+
+    def pause_writing(self) -> None:
+        self.writable.clear()
+
+    def resume_writing(self) -> None:
+        self.writable.set()
+
+    def deadline(self) -> float:
+        handler = self.request_handler
+        match self.phase:
+            case "header":
+                return self.phase_started + handler.header_timeout
+            case "body":
+                return self.phase_started + handler.body_timeout
+            case _:
+                return self.phase_started + handler.idle_timeout
+
+    def schedule_deadline(self) -> None:
+        if self.deadline_timer is not None:
+            self.deadline_timer.cancel()
+        loop = asyncio.get_running_loop()
+        self.deadline_timer = loop.call_at(self.deadline(), self.check_deadline)
+
+    def check_deadline(self) -> None:
+        if self.transport is None:
+            return
+        now = time.monotonic()
+        if now >= self.deadline():
+            if self.reading_paused or (self.phase == "idle" and self.waiting()):
+                # Waiting on us rather than on the client: start the clock over
+                self.phase_started = now
+            else:
+                LOG.debug("Closing connection: %s deadline passed", self.phase)
+                self.request_handler.metrics.timeouts[self.phase] += 1
+                self.transport.close()
+                return
+        self.schedule_deadline()
+
+    def waiting(self) -> bool:
+        """Whether an idle client is waiting on replies or pushes"""
+        presence = self.request_handler.db.presence
+        return bool(self.tasks) or presence.subscribed(self.transport)
+
+    def enter_phase(self, phase: str, now: float) -> None:
+        self.phase = phase
+        self.phase_started = now
+        # A timer that fires early just checks again; one that fires late
+        # (e.g. still set for idle_timeout) would let the client overstay
+        if self.deadline_timer is None or self.deadline_timer.when() > self.deadline():
+            self.schedule_deadline()
+
+    def data_received(self, data: bytes) -> None:
+        now = time.monotonic()
+        if self.buffer:
+            self.buffer += data
+            data = bytes(self.buffer)
+            self.buffer.clear()
+
+        handler = self.request_handler
+        metrics = handler.metrics
+        offset = 0
+        try:
+            while len(data) - offset >= HEADER_SIZE:
+                if len(self.tasks) >= handler.max_in_flight:
+                    # The rest waits in the buffer until finished() makes room
+                    break
+                start = time.perf_counter()
+                header, size = decode_frame_header(data, offset)
+                end = offset + HEADER_SIZE + size
+                if len(data) < end:
+                    break
+                if wait := handler.throttle(header):
+                    # Whatever follows it waits in the buffer
+                    offset = end
+                    self.hold_off(header, wait)
+                    break
+                body = decode_body(header, data[offset + HEADER_SIZE : end])
+                offset = end
+                elapsed = time.perf_counter() - start
+                metrics.observe(metrics.stages, "decode", elapsed)
+                self.dispatch(Message(header=header, body=body))
+                if not handler.keep_alive:
+                    self.stop_reading()
+                    return
+        except ValueError as error:
+            LOG.warning("Closing connection on malformed frame: %s", error)
+            metrics.errors["malformed"] += 1
+            assert self.transport is not None
+            self.transport.close()
+            return
+
+        if offset < len(data):
+            self.buffer += memoryview(data)[offset:]
+            # The clock only starts over for a new frame, or once its header is in
+            phase = "header" if len(self.buffer) < HEADER_SIZE else "body"
+            if offset or phase != self.phase:
+                self.enter_phase(phase, now)
+        else:
+            self.phase = "idle"
+            self.phase_started = now
+
+    def eof_received(self) -> bool:
+        if self.buffer:
+            LOG.warning("Connection closed mid-frame (%d bytes)", len(self.buffer))
+        self.done_reading = True
+        # Half-close: keep the transport open until pending replies are out
+        return bool(self.tasks)
+
+    def stop_reading(self) -> None:
+        self.done_reading = True
+        if self.transport is not None and not self.reading_paused:
+            self.transport.pause_reading()
+            self.reading_paused = True
+
+    def dispatch(self, message: Message) -> None:
+        self.track(asyncio.create_task(self.respond(message)))
+
+    def hold_off(self, header: Header, wait: float) -> None:
+        """Read nothing more until a late refusal of this request goes out"""
+        self.throttled = True
+        if self.transport is not None and not self.reading_paused:
+            self.transport.pause_reading()
+            self.reading_paused = True
+        self.track(asyncio.create_task(self.refuse(header, wait)))
+        if not self.request_handler.keep_alive:
+            self.stop_reading()
+
+    async def refuse(self, header: Header, wait: float) -> None:
+        handler = self.request_handler
+        await asyncio.sleep(wait)
+        await self.respond(header)
+        self.throttled = False
+        # Frames that arrived behind it; reading resumes once this is finished
+        if self.buffer and self.transport is not None and handler.keep_alive:
+            self.data_received(b"")
+
+    def track(self, task: Task[None]) -> None:
+        self.tasks.add(task)
+        task.add_done_callback(self.finished)
+        if (
+            len(self.tasks) >= self.request_handler.max_in_flight
+            and self.transport is not None
+            and not self.reading_paused
+        ):
+            self.transport.pause_reading()
+            self.reading_paused = True
+
+    def finished(self, task: Task[None]) -> None:
+        self.tasks.discard(task)
+        if self.transport is None:
+            return
+        if self.done_reading:
+            if not self.tasks:
+                self.transport.close()
+        elif self.reading_paused and self.has_room():
+            # Frames already read come before anything new
+            if self.buffer:
+                self.data_received(b"")
+            if self.reading_paused and self.has_room() and not self.done_reading:
+                self.transport.resume_reading()
+                self.reading_paused = False
+
+    def has_room(self) -> bool:
+        return (
+            not self.throttled
+            and len(self.tasks) < self.request_handler.max_in_flight
+            and self.transport is not None
+            and not self.transport.is_closing()
+        )
+
+    async def wait_writable(self) -> None:
+        """Same backpressure StreamWriter.drain() gives the stream engine"""
+        if self.writable.is_set():
+            return
+        try:
+            async with asyncio.timeout(self.request_handler.write_timeout):
+                await self.writable.wait()
+        except TimeoutError:
+            # The client stopped reading, so nothing queued behind this gets out
+            self.request_handler.metrics.timeouts["write"] += 1
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        if self.transport is not None:
+            self.transport.abort()
+
+    async def respond(self, message: Message | Header) -> None:
+        handler = self.request_handler
+        # Everything dispatched went through throttle() first
+        reply = await handler.reply_to(message, paid=1.0)
+        with contextlib.suppress(TimeoutError):
+            await self.wait_writable()
+        if self.transport is None or self.transport.is_closing():
+            LOG.debug("Dropping reply %s: connection closed", reply.header.identifier)
+            handler.metrics.errors["send"] += 1
+            return
+        start = time.perf_counter()
+        self.transport.write(reply.encode())
+        metrics = handler.metrics
+        metrics.observe(metrics.stages, "send", time.perf_counter() - start)
+        if handler.keep_alive:
+            handler.follow(reply, self.transport, self.push, self.abort)
+
+    async def push(self, frame: bytes) -> None:
+        await self.wait_writable()
+        if self.transport is None or self.transport.is_closing():
+            raise ConnectionError("Connection closed")
+        self.transport.write(frame)
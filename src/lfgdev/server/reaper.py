@@ -0,0 +1,71 @@
+"""Deletes players who haven't been seen for a while
+
+A sweep goes a batch at a time. Each batch is its own short transaction with
+a pause after it, so a request waiting on the write lock only ever waits for
+one batch, however many players are due.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.types import PresenceEvent, mutable
+
+LOG = logging.getLogger(__name__)
+
+
+@mutable
+class Reaper:
+    db: AsyncDatabase
+    # Seconds without a heartbeat before a player is deleted
+    ttl: float
+    # Seconds between sweeps
+    interval: float = 60.0
+    batch_size: int = 500
+    # Seconds between batches, for requests to get at the write lock
+    pause: float = 0.05
+    # Free pages handed back to the filesystem after a sweep; 0 for none
+    vacuum_pages: int = 0
+
+    async def sweep(self) -> int:
+        # Otherwise a heartbeat still in the buffer would look stale
+        await self.db.flush()
+        before = math.floor(time.time() - self.ttl)
+        expired = 0
+        while True:
+            batch = await self.db.expire(before, self.batch_size)
+            expired += len(batch)
+            self.db.metrics.expired += len(batch)
+            for player in batch:
+                self.db.publish(
+                    PresenceEvent.EXPIRED, player.username, player.last_seen
+                )
+            if len(batch) < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+
+        if expired:
+            LOG.info("Expired %d player(s) not seen since %d", expired, before)
+            if self.vacuum_pages and not await self.db.incremental_vacuum(
+                self.vacuum_pages
+            ):
+                LOG.warning(
+                    "Not vacuuming: the storage has no free pages to give back, or"
+                    " is an sqlite file from before auto_vacuum=INCREMENTAL and"
+                    " needs a one-off VACUUM"
+                )
+                self.vacuum_pages = 0
+        return expired
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                # Expiry stopping for good would be worse than a missed sweep
+                LOG.exception("Failed to expire players")
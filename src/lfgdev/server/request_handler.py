@@ -1,32 +1,260 @@
-from asyncio import StreamReader, StreamWriter
-from typing import ClassVar
+import asyncio
+import contextlib
+import logging
+import time
+from asyncio import IncompleteReadError, Semaphore, StreamReader, StreamWriter
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import field, replace
+from functools import partial
 
-from lfgdev.message import Message
-from lfgdev.server.db import Database
+from lfgdev.message import Batch, Error, Header, Message
+from lfgdev.message.codec import HEADER_SIZE, decode_body, decode_frame_header
+from lfgdev.server.admission import OVERLOADED, RATE_LIMITED, Admission
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.server.lifecycle import Connections
 from lfgdev.server.message_handler import MessageHandler
-from lfgdev.server.middleware import log_message, update_last_seen
-from lfgdev.server.types import Middleware
-from lfgdev.types import immutable
+from lfgdev.server.metrics import Metrics
+from lfgdev.types import ContentType, Username, immutable
+
+LOG = logging.getLogger(__name__)
+
+
+def error_reply(request: Header, content: str) -> Message:
+    header = replace(
+        request,
+        sender=Username("SERVER"),
+        content_type=ContentType.ERROR,
+    )
+    return Message(header=header, body=Error(content=content))
 
 
 @immutable
 class RequestHandler:
-    _middleware: ClassVar[list[Middleware]] = [log_message, update_last_seen]
-    db: Database
+    db: AsyncDatabase
+    # One-shot (read one message, reply, close) stays the default for older clients
+    keep_alive: bool = False
+    # Deadlines, see ServerConfig
+    idle_timeout: float = 30.0
+    header_timeout: float = 10.0
+    body_timeout: float = 10.0
+    write_timeout: float = 10.0
+    max_in_flight: int = 32
+    admission: Admission = field(default_factory=Admission)
+    # What a graceful stop drains, see lfgdev.server.lifecycle
+    connections: Connections = field(default_factory=Connections)
+    # Pipelines are built once, here, rather than per message
+    router: MessageHandler = field(init=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "router", MessageHandler(db=self.db))
+
+    @property
+    def metrics(self) -> Metrics:
+        return self.db.metrics
+
+    async def process(self, message: Message) -> Message:
+        self.metrics.requests[message.header.content_type.name] += 1
+        return await self.router.route(message)
+
+    def refuse(self, message: Message, paid: float = 0.0) -> Message | None:
+        """An Error reply if taking this request on would go over a limit
+
+        paid is what the sender was already charged for it, by throttle().
+        """
+        metrics = self.metrics
+        if not self.admission.admit_request(metrics.in_flight):
+            reason, content = "overloaded", OVERLOADED
+        else:
+            # A batch costs what its messages would have cost sent one by one
+            cost = len(message.body.content) if isinstance(message.body, Batch) else 1
+            if self.admission.admit_sender(message.header.sender, max(cost, 1) - paid):
+                return None
+            reason, content = "rate_limited", RATE_LIMITED
+        metrics.errors[reason] += 1
+        return error_reply(message.header, content)
+
+    def throttle(self, header: Header) -> float:
+        """Charge the sender for a request; how long to stop reading if it can't pay
+
+        Only the header is needed, so a refused request's body is skipped
+        rather than decoded. A batch's other messages are charged in refuse().
+        """
+        if self.admission.admit_sender(header.sender):
+            return 0.0
+        self.metrics.errors["rate_limited"] += 1
+        return self.admission.sender_wait(header.sender)
+
+    async def reply_to(self, message: Message | Header, paid: float = 0.0) -> Message:
+        """Like process, but refusals and failures become an Error reply
+
+        A bare Header is a request already turned away by throttle().
+        """
+        if isinstance(message, Header):
+            return error_reply(message, RATE_LIMITED)
+        if (refusal := self.refuse(message, paid)) is not None:
+            return refusal
+        self.metrics.in_flight += 1
+        try:
+            return await self.process(message)
+        except Exception:
+            LOG.exception("Failed to process %s", message.header.identifier)
+            self.metrics.errors["internal"] += 1
+            return error_reply(message.header, "Internal error")
+        finally:
+            self.metrics.in_flight -= 1
+
+    async def respond(
+        self, message: Message | Header, writer: StreamWriter, in_flight: Semaphore
+    ) -> None:
+        try:
+            # Whatever came from receive() went through throttle() first
+            reply = await self.reply_to(message, paid=1.0)
+        finally:
+            in_flight.release()
+
+        # Replies keep the request's Header.identifier, so a pipelining client
+        # can match them up even when they go out of order
+        try:
+            await self.send(reply, writer)
+        except (ConnectionError, TimeoutError) as error:
+            LOG.debug("Dropping reply %s: %r", reply.header.identifier, error)
+            self.metrics.errors["send"] += 1
+            return
+        self.follow(reply, writer, partial(self.write, writer), writer.transport.abort)
+
+    def follow(
+        self,
+        reply: Message,
+        key: Hashable,
+        send: Callable[[bytes], Awaitable[None]],
+        abort: Callable[[], None],
+    ) -> None:
+        """Subscribe or unsubscribe a connection, going by the reply it was sent"""
+        match reply.header.content_type:
+            case ContentType.SUBSCRIBE:
+                self.db.presence.subscribe(key, send, abort)
+            case ContentType.UNSUBSCRIBE:
+                self.db.presence.unsubscribe(key)
+
+    async def read(
+        self, reader: StreamReader, size: int, phase: str, timeout: float | None
+    ) -> bytes:
+        try:
+            async with asyncio.timeout(timeout):
+                return await reader.readexactly(size)
+        except TimeoutError:
+            self.metrics.timeouts[phase] += 1
+            raise
+
+    async def receive(
+        self, reader: StreamReader, first: bool = True, subscribed: bool = False
+    ) -> Message | Header:
+        """Message.receive with deadlines, timing only the decoding
+
+        A new connection has header_timeout to send its first header. After
+        that, waiting for the next header is idling, for up to idle_timeout.
+        Subscribers may idle for as long as they like: a dead one is found out
+        by the write deadline on the next push.
 
-    def apply_middleware(self, message: Message) -> Message:
-        for middleware in self._middleware:
-            message = middleware(self.db, message)
+        Just the Header if throttle() turned the request away, once the
+        connection has been held up for as long as it says.
+        """
+        if first:
+            header_data = await self.read(
+                reader, HEADER_SIZE, "header", self.header_timeout
+            )
+        else:
+            idle_timeout = None if subscribed else self.idle_timeout
+            header_data = await self.read(reader, HEADER_SIZE, "idle", idle_timeout)
+        start = time.perf_counter()
+        header, size = decode_frame_header(header_data)
+        elapsed = time.perf_counter() - start
+        if wait := self.throttle(header):
+            await self.read(reader, size, "body", self.body_timeout)
+            # Nothing else reads this connection meanwhile
+            await asyncio.sleep(wait)
+            return header
+        data = await self.read(reader, size, "body", self.body_timeout)
+        start = time.perf_counter()
+        message = Message(header=header, body=decode_body(header, data))
+        elapsed += time.perf_counter() - start
+        self.metrics.observe(self.metrics.stages, "decode", elapsed)
         return message
 
+    async def send(self, reply: Message, writer: StreamWriter) -> None:
+        start = time.perf_counter()
+        await self.write(writer, reply.encode())
+        self.metrics.observe(self.metrics.stages, "send", time.perf_counter() - start)
+
+    async def write(self, writer: StreamWriter, frame: bytes) -> None:
+        try:
+            async with asyncio.timeout(self.write_timeout):
+                writer.write(frame)
+                await writer.drain()
+        except TimeoutError:
+            # The client stopped reading, so nothing queued behind this gets out
+            self.metrics.timeouts["write"] += 1
+            writer.transport.abort()
+            raise
+
+    async def serve_connection(
+        self, reader: StreamReader, writer: StreamWriter
+    ) -> None:
+        """Keep reading frames until the client closes or goes idle"""
+        in_flight = Semaphore(self.max_in_flight)
+        first = True
+        async with asyncio.TaskGroup() as tg:
+            while True:
+                await in_flight.acquire()
+                try:
+                    message = await self.receive(
+                        reader, first, self.db.presence.subscribed(writer)
+                    )
+                    first = False
+                except IncompleteReadError as error:
+                    if error.partial:
+                        LOG.warning("Connection closed mid-frame: %s", error)
+                    in_flight.release()
+                    break
+                except ValueError as error:
+                    LOG.warning("Closing connection on malformed frame: %s", error)
+                    self.metrics.errors["malformed"] += 1
+                    in_flight.release()
+                    break
+                except (TimeoutError, ConnectionError) as error:
+                    LOG.debug("Closing connection: %r", error)
+                    in_flight.release()
+                    break
+                tg.create_task(self.respond(message, writer, in_flight))
+
     async def handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        if not self.admission.admit_connection(self.metrics.active_connections):
+            self.metrics.errors["connection_limit"] += 1
+            writer.close()
+            await writer.wait_closed()
+            return
+
+        self.metrics.connection_opened()
+        self.connections.opened(writer.transport)
         try:
-            message = await Message.receive(reader)
-            self.apply_middleware(message)
-            router = MessageHandler(db=self.db)
-            reply = router.route(message)
-            await reply.send(stream=writer)
+            if self.keep_alive:
+                await self.serve_connection(reader, writer)
+            else:
+                try:
+                    message = await self.receive(reader)
+                    reply = await self.reply_to(message, paid=1.0)
+                    await self.send(reply, writer)
+                except ValueError as error:
+                    LOG.warning("Closing connection on malformed frame: %s", error)
+                    self.metrics.errors["malformed"] += 1
+                except (IncompleteReadError, TimeoutError, ConnectionError) as error:
+                    LOG.debug("Closing connection: %r", error)
 
         finally:
+            self.db.presence.unsubscribe(writer)
+            self.metrics.connection_closed()
+            self.connections.closed(writer.transport)
             writer.close()
-            await writer.wait_closed()
+            # Raises whatever the connection was lost to, e.g. an abort
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
@@ -0,0 +1,110 @@
+"""Copy players into a different number of shards, with the server stopped
+
+    lfgdev-reshard --db /tmp/lfg.db --to-shards 4
+
+reads /tmp/lfg.db and writes /tmp/lfg.0.db to /tmp/lfg.3.db. The source keeps
+its players (its schema is migrated like any other file opened); the server
+picks up the new files once started with --shards 4.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import sqlite3
+from contextlib import ExitStack
+from pathlib import Path
+
+from lfgdev.server.db import Database
+from lfgdev.server.logs import LogConfig, configure_logging
+from lfgdev.server.shards import check_shard, shard_of, shard_paths
+
+LOG = logging.getLogger(__name__)
+
+# Rows read, and written per shard, at a time
+BATCH_SIZE = 10_000
+
+
+def reshard(
+    source: Path,
+    source_shards: int,
+    target: Path,
+    target_shards: int,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """How many players were copied
+
+    Refuses to write over existing files, and removes the ones it started if
+    anything goes wrong, so a failed run can simply be retried.
+    """
+    sources = shard_paths(source, source_shards)
+    targets = shard_paths(target, target_shards)
+    if missing := [path for path in sources if not path.exists()]:
+        raise FileNotFoundError(f"No such shard: {missing[0]}")
+    if existing := [path for path in targets if path.exists()]:
+        raise FileExistsError(f"{existing[0]} already exists")
+
+    copied = 0
+    try:
+        with ExitStack() as stack:
+            readers = [stack.enter_context(Database.init(path)) for path in sources]
+            writers = [stack.enter_context(Database.init(path)) for path in targets]
+            for i, writer in enumerate(writers):
+                check_shard(writer, i, target_shards)
+                writer.begin()
+            for reader in readers:
+                rows = reader.connection.execute("SELECT username, last_seen FROM lfg")
+                while batch := rows.fetchmany(batch_size):
+                    by_shard: list[list[tuple[str, int]]] = [[] for _ in writers]
+                    for username, last_seen in batch:
+                        by_shard[shard_of(username, target_shards)].append(
+                            (username, last_seen)
+                        )
+                    for writer, shard_rows in zip(writers, by_shard, strict=True):
+                        writer.connection.executemany(
+                            "INSERT INTO lfg VALUES (?, ?)", shard_rows
+                        )
+                    copied += len(batch)
+                    LOG.debug(f"Copied {copied} player(s)")
+            for writer in writers:
+                writer.commit()
+    except BaseException:
+        for path in targets:
+            for leftover in (path, Path(f"{path}-wal"), Path(f"{path}-shm")):
+                leftover.unlink(missing_ok=True)
+        raise
+    return copied
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Copy players into a different number of sqlite shards"
+    )
+    parser.add_argument("--db", type=Path, default=Path("/tmp/lfg.db"))
+    parser.add_argument(
+        "--shards", type=int, default=1, help="How many shards --db is in now"
+    )
+    parser.add_argument(
+        "--to-db",
+        type=Path,
+        default=None,
+        help="Where the new shards go (default: alongside --db, as lfg.N.db)",
+    )
+    parser.add_argument("--to-shards", type=int, required=True)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.shards < 1 or args.to_shards < 1:
+        parser.error("There has to be at least one shard")
+
+    listener = configure_logging(
+        LogConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    )
+    target = args.to_db or args.db
+    try:
+        copied = reshard(args.db, args.shards, target, args.to_shards)
+        LOG.info(f"Copied {copied} player(s) into {args.to_shards} shard(s)")
+    except (OSError, sqlite3.Error) as error:
+        LOG.error(error)
+        raise SystemExit(1) from error
+    finally:
+        listener.stop()
@@ -0,0 +1,212 @@
+"""sqlite Storage spread over several files by a hash of the username
+
+sqlite takes one writer at a time per file, however many processes share it.
+Each shard is a file of its own with its own connection, and a thread of its
+own that every call to it queues on, so writes to different shards (say, a
+heartbeat flush, which is split between them) commit side by side. Each shard
+is one of parts(), so AsyncDatabase calls it on that thread directly, under a
+lock of its own, and a write to one shard never waits on another.
+
+A player's shard comes from crc32 rather than hash(), which is salted per
+process. Lookups go to a single shard. list_active asks every shard for a page
+and merges them, and expire works through the shards in turn.
+
+A transaction is begun on every shard, in order, so that two processes can't
+each hold a shard the other is waiting on. It's committed shard by shard: a
+crash part way through keeps some shards' writes and loses the rest.
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import zlib
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+from typing import ParamSpec, TypeVar
+
+from lfgdev.server.db import Database
+from lfgdev.server.storage import Player, Storage
+from lfgdev.types import Username
+
+LOG = logging.getLogger(__name__)
+
+_P = ParamSpec("_P")
+_T = TypeVar("_T")
+
+
+def shard_of(username: Username, shards: int) -> int:
+    return zlib.crc32(username.encode("UTF-8")) % shards
+
+
+def shard_paths(path: Path, shards: int) -> list[Path]:
+    """lfg.db as is for a single shard, or lfg.0.db, lfg.1.db, ..."""
+    if shards == 1:
+        return [path]
+    return [path.with_name(f"{path.stem}.{i}{path.suffix}") for i in range(shards)]
+
+
+def check_shard(db: Database, shard: int, shards: int) -> None:
+    """Record which shard a file is, or make sure it's the one expected
+
+    Opening shards with a different count would look players up in the wrong
+    files, so it's refused until they're resharded. So is opening a file on
+    its own once it's been resharded, as lfgdev-reshard leaves it in place.
+    """
+    if shards == 1 and (first := shard_paths(db.path, 2)[0]).exists():
+        raise ValueError(
+            f"{db.path} has been resharded into {first} and others; open those "
+            "with --shards, or use lfgdev-reshard to merge them back"
+        )
+    with db.transaction() as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lfg_shard (shard INTEGER, shards INTEGER)"
+        )
+        row = conn.execute("SELECT shard, shards FROM lfg_shard").fetchone()
+        if row is None:
+            conn.execute("INSERT INTO lfg_shard VALUES (?, ?)", (shard, shards))
+        elif tuple(row) != (shard, shards):
+            raise ValueError(
+                f"{db.path} is shard {row[0]} of {row[1]}, not {shard} of {shards}; "
+                "use lfgdev-reshard to change the number of shards"
+            )
+
+
+def holds_players(path: Path) -> bool:
+    if not path.exists():
+        return False
+    with Database.init(path) as db:
+        return db.connection.execute("SELECT 1 FROM lfg LIMIT 1").fetchone() is not None
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class ShardedDatabase(Storage):
+    shards: tuple[Database, ...]
+    # One thread per shard, which is the only one to use its connection
+    executors: tuple[ThreadPoolExecutor, ...]
+
+    @contextmanager
+    @staticmethod
+    def init(
+        path: Path, shards: int, busy_timeout: float = 5.0
+    ) -> Iterator[ShardedDatabase]:
+        paths = shard_paths(path, shards)
+        if shards > 1 and not any(p.exists() for p in paths) and holds_players(path):
+            raise ValueError(
+                f"{path} holds players but isn't sharded; use lfgdev-reshard to "
+                f"split it into {shards} shards"
+            )
+        with ExitStack() as stack:
+            databases = []
+            for i, shard_path in enumerate(paths):
+                db = stack.enter_context(Database.init(shard_path, busy_timeout))
+                check_shard(db, i, shards)
+                databases.append(db)
+            executors = tuple(
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"lfgdev-shard{i}")
+                for i in range(shards)
+            )
+            for executor in executors:
+                stack.callback(executor.shutdown, wait=True)
+            LOG.debug(f"Sharding players over {shards} files")
+            yield ShardedDatabase(shards=tuple(databases), executors=executors)
+
+    def submit(
+        self, shard: int, fn: Callable[_P, _T], *args: _P.args, **kwargs: _P.kwargs
+    ) -> Future[_T]:
+        return self.executors[shard].submit(fn, *args, **kwargs)
+
+    def locate(self, username: Username) -> tuple[int, Database]:
+        shard = shard_of(username, len(self.shards))
+        return shard, self.shards[shard]
+
+    def parts(self) -> Sequence[tuple[Storage, Executor | None]]:
+        return tuple(zip(self.shards, self.executors, strict=True))
+
+    def part_of(self, username: Username) -> int:
+        return shard_of(username, len(self.shards))
+
+    @staticmethod
+    def gather(futures: Iterable[Future[_T]]) -> list[_T]:
+        """Every result, in order, once they're all done; else the first error"""
+        futures = list(futures)
+        errors = [error for future in futures if (error := future.exception())]
+        if errors:
+            raise errors[0]
+        return [future.result() for future in futures]
+
+    def begin(self) -> None:
+        for i, db in enumerate(self.shards):
+            try:
+                self.submit(i, db.begin).result()
+            except BaseException:
+                # Let go of the shards already locked
+                self.gather(self.submit(j, self.shards[j].rollback) for j in range(i))
+                raise
+
+    def commit(self) -> None:
+        self.gather(self.submit(i, db.commit) for i, db in enumerate(self.shards))
+
+    def rollback(self) -> None:
+        self.gather(self.submit(i, db.rollback) for i, db in enumerate(self.shards))
+
+    def find_by_username(self, username: Username) -> Player | None:
+        shard, db = self.locate(username)
+        return self.submit(shard, db.find_by_username, username).result()
+
+    def list_active(
+        self, since: int, limit: int, after: Player | None = None
+    ) -> list[Player]:
+        pages = self.gather(
+            self.submit(i, db.list_active, since, limit, after)
+            for i, db in enumerate(self.shards)
+        )
+        # Each page is already newest first, so the first limit of the merge
+        # is the same page one file would have given
+        merged = heapq.merge(
+            *pages, key=lambda player: (player.last_seen, player.username), reverse=True
+        )
+        return list(islice(merged, limit))
+
+    def save(self, username: Username) -> bool:
+        shard, db = self.locate(username)
+        return self.submit(shard, db.save, username).result()
+
+    def update(self, username: Username) -> None:
+        shard, db = self.locate(username)
+        self.submit(shard, db.update, username).result()
+
+    def update_many(self, last_seen: Iterable[tuple[Username, int]]) -> None:
+        by_shard: list[list[tuple[Username, int]]] = [[] for _ in self.shards]
+        for username, timestamp in last_seen:
+            by_shard[shard_of(username, len(self.shards))].append((username, timestamp))
+        self.gather(
+            self.submit(i, self.shards[i].update_many, rows)
+            for i, rows in enumerate(by_shard)
+            if rows
+        )
+
+    def remove(self, username: Username) -> None:
+        shard, db = self.locate(username)
+        self.submit(shard, db.remove, username).result()
+
+    def expire(self, before: int, limit: int) -> list[Player]:
+        # A shard at a time, so a short batch still means there's none left
+        expired: list[Player] = []
+        for i, db in enumerate(self.shards):
+            if len(expired) >= limit:
+                break
+            expired += self.submit(i, db.expire, before, limit - len(expired)).result()
+        return expired
+
+    def incremental_vacuum(self, pages: int) -> bool:
+        return all(
+            self.gather(
+                self.submit(i, db.incremental_vacuum, pages)
+                for i, db in enumerate(self.shards)
+            )
+        )
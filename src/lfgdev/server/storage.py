@@ -0,0 +1,89 @@
+"""What AsyncDatabase needs from wherever players are kept
+
+Database keeps them in sqlite, shared by every worker process. MemoryStorage
+keeps them in a dict in this process, with an optional log on disk.
+"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Sequence
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import ClassVar, Literal
+
+from lfgdev.types import Username
+
+StorageEngine = Literal["sqlite", "memory"]
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class Player:
+    """Ideally this maps to the record in sqlite"""
+
+    username: Username
+    last_seen: int
+
+
+class Storage(ABC):
+    __slots__ = ()
+
+    # Calls that may block (on disk, or on another process's lock) are run on
+    # AsyncDatabase's worker thread; the rest are cheaper called in place
+    BLOCKING: ClassVar[bool] = True
+
+    @abstractmethod
+    def begin(self) -> None:
+        """Hold every write until commit(), or undo them all on rollback()"""
+
+    @abstractmethod
+    def commit(self) -> None: ...
+
+    @abstractmethod
+    def rollback(self) -> None: ...
+
+    @abstractmethod
+    def find_by_username(self, username: Username) -> Player | None: ...
+
+    @abstractmethod
+    def list_active(
+        self, since: int, limit: int, after: Player | None = None
+    ) -> list[Player]:
+        """Players seen since then, newest first, starting after the given one
+
+        Ties on last_seen go by username, also descending, which is what makes
+        (last_seen, username) of a page's last player a cursor for the next.
+        """
+
+    @abstractmethod
+    def save(self, username: Username) -> bool:
+        """Add a player seen now; False if they already exist"""
+
+    @abstractmethod
+    def update(self, username: Username) -> None: ...
+
+    @abstractmethod
+    def update_many(self, last_seen: Iterable[tuple[Username, int]]) -> None:
+        """Set last_seen for each player that exists, skipping the rest"""
+
+    @abstractmethod
+    def remove(self, username: Username) -> None: ...
+
+    @abstractmethod
+    def expire(self, before: int, limit: int) -> list[Player]:
+        """Delete up to limit players last seen before then, and say who"""
+
+    def incremental_vacuum(self, pages: int) -> bool:
+        """Give up to that many free pages back; False if there's no such thing"""
+        return False
+
+    def parts(self) -> Sequence[tuple[Storage, Executor | None]]:
+        """Pieces that take writes side by side, and the thread each is called on
+
+        AsyncDatabase locks each on its own. None is its own worker thread.
+        """
+        return ((self, None),)
+
+    def part_of(self, username: Username) -> int:
+        """Which of parts() holds this player"""
+        return 0
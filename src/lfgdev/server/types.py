@@ -1,11 +1,10 @@
-from typing import Callable, NewType, TypeAlias
+from typing import Awaitable, Callable, NewType, TypeAlias
 
 from lfgdev.message import Message
-from lfgdev.server.db import Database
+from lfgdev.server.db import AsyncDatabase
 from lfgdev.types import ContentType
 
-Middleware: TypeAlias = Callable[[Database, Message], Message]
-# Middleware probably doesn't describe this right
-MessageRoute: TypeAlias = dict[ContentType, Middleware]
+Handler: TypeAlias = Callable[[AsyncDatabase, Message], Awaitable[Message]]
+MessageRoute: TypeAlias = dict[ContentType, Handler]
 
 Order = NewType("Order", int)
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import signal
+import time
+from dataclasses import field
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from types import FrameType
+from typing import Any, Callable
+
+from lfgdev.types import mutable
+
+LOG = logging.getLogger(__name__)
+
+
+@mutable
+class Supervisor:
+    """Runs N copies of a worker process and restarts any that die
+
+    Workers are spawned rather than forked so none of them inherit the
+    supervisor's threads or sqlite connections. Each one binds the same port
+    with reuse_port and the kernel spreads incoming connections across them.
+    """
+
+    target: Callable[..., None]
+    args: tuple[Any, ...]
+    workers: int
+    # A worker that dies sooner than this after starting is crash looping
+    min_uptime: float = 5.0
+    max_restart_delay: float = 30.0
+    # Seconds workers get to exit once told to, before they're killed
+    stop_timeout: float = 10.0
+    processes: dict[int, BaseProcess] = field(default_factory=dict)
+    started: dict[int, float] = field(default_factory=dict)
+    restart_delays: dict[int, float] = field(default_factory=dict)
+    # Crash looping workers' slots, and when to start them again
+    restart_at: dict[int, float] = field(default_factory=dict)
+    stopping: bool = False
+
+    def start_worker(self, slot: int) -> None:
+        context = multiprocessing.get_context("spawn")
+        process = context.Process(
+            target=self.target, args=self.args, name=f"lfgdev-worker-{slot}"
+        )
+        process.start()
+        self.processes[slot] = process
+        self.started[slot] = time.monotonic()
+        LOG.info(f"Started worker {slot} (pid {process.pid})")
+
+    def restart(self, slot: int) -> None:
+        """Start the slot's exited worker again, later if it's crash looping"""
+        process = self.processes.pop(slot)
+        process.join()
+        uptime = time.monotonic() - self.started[slot]
+        LOG.warning(
+            f"Worker {slot} (pid {process.pid}) exited with {process.exitcode} "
+            f"after {uptime:.1f}s"
+        )
+        if uptime < self.min_uptime:
+            delay = min(self.restart_delays.get(slot, 0.5) * 2, self.max_restart_delay)
+            self.restart_delays[slot] = delay
+            LOG.warning(f"Worker {slot} is crash looping; restarting in {delay:.1f}s")
+            self.restart_at[slot] = time.monotonic() + delay
+            return
+        self.restart_delays.pop(slot, None)
+        if not self.stopping:
+            self.start_worker(slot)
+
+    def supervise(self, timeout: float = 1.0) -> None:
+        """Wait up to timeout for a worker to exit or be due a restart"""
+        if self.restart_at:
+            timeout = min(timeout, min(self.restart_at.values()) - time.monotonic())
+        sentinels = [process.sentinel for process in self.processes.values()]
+        exited = wait(sentinels, timeout=max(timeout, 0))
+        for slot, process in list(self.processes.items()):
+            if process.sentinel in exited and not self.stopping:
+                self.restart(slot)
+        now = time.monotonic()
+        for slot, at in list(self.restart_at.items()):
+            if at <= now and not self.stopping:
+                del self.restart_at[slot]
+                self.start_worker(slot)
+
+    def stop(self, signum: int | None = None, frame: FrameType | None = None) -> None:
+        self.stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        for slot in range(self.workers):
+            self.start_worker(slot)
+        try:
+            while not self.stopping:
+                self.supervise()
+        except KeyboardInterrupt:
+            self.stopping = True
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for slot, process in self.processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                LOG.warning(f"Worker {slot} didn't stop in time, killing it")
+                process.kill()
+                process.join()
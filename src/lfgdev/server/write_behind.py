@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import field
+
+from lfgdev.types import Username, mutable
+
+
+@mutable
+class LastSeenBuffer:
+    """Latest last_seen per username, held in memory until the next flush
+
+    Repeated heartbeats from the same player overwrite each other here, so a
+    flush costs one row per active player rather than one per message.
+    """
+
+    flush_interval: float = 1.0
+    max_pending: int = 1024
+    pending: dict[Username, int] = field(default_factory=dict)
+
+    def record(self, username: Username) -> bool:
+        """Returns True once the buffer is large enough to flush early"""
+        self.pending[username] = math.floor(time.time())
+        return len(self.pending) >= self.max_pending
+
+    def get(self, username: Username) -> int | None:
+        return self.pending.get(username)
+
+    def drain(self) -> dict[Username, int]:
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def restore(self, drained: dict[Username, int]) -> None:
+        """Put back entries whose flush failed, unless touched again since"""
+        for username, last_seen in drained.items():
+            if last_seen > self.pending.get(username, -1):
+                self.pending[username] = last_seen
@@ -25,6 +25,28 @@ class ContentType(IntEnum):
     LAST_SEEN = auto()
     REGISTER = auto()
     ERROR = auto()
+    BATCH = auto()
+    STATS = auto()
+    LIST_ACTIVE = auto()
+    SUBSCRIBE = auto()
+    UNSUBSCRIBE = auto()
+    PRESENCE = auto()
+
+
+class PresenceEvent(IntEnum):
+    """What a PRESENCE push is telling subscribers about a player"""
+
+    REGISTERED = auto()
+    SEEN = auto()
+    EXPIRED = auto()
+
+
+class ProtocolVersion(IntEnum):
+    """Lives in the header byte that v1 frames always send as padding"""
+
+    V1 = 0
+    # Length-prefixed, variable size bodies
+    V2 = 2
 
 
 @dataclass_transform(kw_only_default=True, frozen_default=True)
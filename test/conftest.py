@@ -1,15 +1,25 @@
 import asyncio
-import time
 from pathlib import Path
-from threading import Thread
-from typing import Generator
+from threading import Event, Thread
+from typing import AsyncGenerator, Generator
 
 import pytest
+import pytest_asyncio
 
 from lfgdev.client import Client
+from lfgdev.message import Header, Hello, Message
 from lfgdev.server import serve
-from lfgdev.server.db import Database
-from lfgdev.types import Username
+from lfgdev.server.db import AsyncDatabase, Database
+from lfgdev.types import ContentType, ProtocolVersion, Username
+
+
+def hello(
+    sender: str = "TestUser", version: ProtocolVersion = ProtocolVersion.V2
+) -> Message:
+    header = Header(
+        sender=Username(sender), content_type=ContentType.HELLO, version=version
+    )
+    return Message(header=header, body=Hello(content=None))
 
 
 @pytest.fixture(scope="session")
@@ -19,18 +29,28 @@ def db() -> Generator[Database, None, None]:
         db.path.unlink()
 
 
+@pytest.fixture
+def async_db(db: Database) -> Generator[AsyncDatabase, None, None]:
+    async_db = AsyncDatabase(db=db)
+    yield async_db
+    async_db.close()
+
+
 @pytest.fixture(autouse=True, scope="session")
 def server(db: Database) -> Generator[None, None, None]:
+    ready = Event()
+
     def test_server():
-        asyncio.run(serve(host="localhost", port=3117, db=db))
+        asyncio.run(serve(host="localhost", port=3117, db=db, ready=ready.set))
 
     thread = Thread(target=test_server, daemon=True)
     thread.start()
-    # TODO: This is some duct tape to wait for the server to come up
-    time.sleep(0.5)
+    assert ready.wait(5), "Test server didn't start"
     yield
 
 
-@pytest.fixture
-def client(server: None) -> Client:
-    return Client(address="localhost", port=3117, username=Username("TestUser"))
+@pytest_asyncio.fixture
+async def client(server: None) -> AsyncGenerator[Client, None]:
+    client = Client(address="localhost", port=3117, username=Username("TestUser"))
+    yield client
+    await client.close()
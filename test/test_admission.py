@@ -0,0 +1,133 @@
+import time
+from asyncio import StreamReader, StreamWriter
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from conftest import hello
+
+from lfgdev.message import Batch, Error, Header, Message, NoHello, Register
+from lfgdev.message.codec import HEADER_SIZE, decode_frame
+from lfgdev.server.admission import (
+    OVERLOADED,
+    RATE_LIMITED,
+    Admission,
+    TokenBucket,
+)
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.server.request_handler import RequestHandler
+from lfgdev.types import ContentType, Username
+
+
+def undecodable(sender: str) -> bytes:
+    """A REGISTER frame whose username isn't UTF-8, so decoding it fails"""
+    header = Header(sender=Username(sender), content_type=ContentType.REGISTER)
+    frame = Message(header=header, body=Register(content=Username(sender))).encode()
+    return frame[:HEADER_SIZE] + b"\xff" * (len(frame) - HEADER_SIZE)
+
+
+def test_token_bucket() -> None:
+    bucket = TokenBucket(rate=10, burst=2, tokens=2, updated=0.0)
+    assert bucket.take(0.0)
+    assert bucket.take(0.0)
+    assert not bucket.take(0.0)
+    # A tenth of a second buys one more, and never more than the burst
+    assert bucket.take(0.1)
+    assert not bucket.take(0.1)
+    assert not bucket.take(10.0, cost=3)
+    assert bucket.take(10.0, cost=2)
+    assert bucket.wait(10.0) == pytest.approx(0.1)
+    assert bucket.wait(10.05) == pytest.approx(0.05)
+    assert bucket.wait(10.2) == 0
+
+
+def test_admission_forgets_senders() -> None:
+    admission = Admission(sender_rate=0, sender_burst=1, max_senders=2)
+    assert admission.admit_sender(Username("a"))
+    assert admission.admit_sender(Username("b"))
+    assert not admission.admit_sender(Username("a"))
+    # c pushes out b, the least recently seen, which then starts over
+    assert admission.admit_sender(Username("c"))
+    assert list(admission.buckets) == ["a", "c"]
+    assert admission.admit_sender(Username("b"))
+
+
+@pytest.mark.asyncio
+async def test_overloaded(async_db: AsyncDatabase) -> None:
+    request_handler = RequestHandler(db=async_db, admission=Admission(max_requests=2))
+    async_db.metrics.in_flight = 2
+
+    reply = await request_handler.reply_to(hello())
+    assert reply.header.content_type == ContentType.ERROR
+    assert reply.body == Error(content=OVERLOADED)
+    assert async_db.metrics.errors["overloaded"] == 1
+    assert async_db.metrics.requests["HELLO"] == 0
+
+    async_db.metrics.in_flight = 1
+    reply = await request_handler.reply_to(hello())
+    assert reply.header.content_type == ContentType.NO_HELLO
+    assert async_db.metrics.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limited(async_db: AsyncDatabase) -> None:
+    admission = Admission(sender_rate=0, sender_burst=3)
+    request_handler = RequestHandler(db=async_db, admission=admission)
+
+    batch = Message(
+        header=Header(sender=Username("Noisy"), content_type=ContentType.BATCH),
+        body=Batch(content=(hello("Noisy"), hello("Noisy"))),
+    )
+    # The batch takes two of the three tokens
+    replies = [
+        await request_handler.reply_to(message)
+        for message in (batch, hello("Noisy"), hello("Noisy"), hello("Quiet"))
+    ]
+    assert [reply.body == Error(content=RATE_LIMITED) for reply in replies] == [
+        False,
+        False,
+        True,
+        # Other senders have their own bucket
+        False,
+    ]
+    assert async_db.metrics.errors["rate_limited"] == 1
+
+
+@pytest.mark.asyncio
+async def test_connection_limit(async_db: AsyncDatabase) -> None:
+    request_handler = RequestHandler(
+        db=async_db, admission=Admission(max_connections=1)
+    )
+    async_db.metrics.active_connections = 1
+    reader = Mock(spec=StreamReader, readexactly=AsyncMock())
+    writer = Mock(spec=StreamWriter)
+
+    await request_handler.handle(reader=reader, writer=writer)
+    reader.readexactly.assert_not_awaited()
+    writer.close.assert_called_once()
+    assert async_db.metrics.active_connections == 1
+    assert async_db.metrics.errors["connection_limit"] == 1
+
+
+@pytest.mark.asyncio
+async def test_throttled_before_decoding(async_db: AsyncDatabase) -> None:
+    admission = Admission(sender_rate=10, sender_burst=1)
+    request_handler = RequestHandler(db=async_db, keep_alive=True, admission=admission)
+    reader = StreamReader()
+    reader.feed_data(
+        hello("Noisy").encode() + undecodable("Noisy") + hello("Noisy").encode()
+    )
+    reader.feed_eof()
+    writer = Mock(spec=StreamWriter, drain=AsyncMock())
+
+    start = time.monotonic()
+    await request_handler.handle(reader=reader, writer=writer)
+    # The second frame is refused without its body being looked at, and
+    # nothing more is read until there's a token for the third
+    assert time.monotonic() - start >= 0.09
+    replies = [decode_frame(call.args[0]) for call in writer.write.call_args_list]
+    assert [(header.content_type, body) for header, body, _ in replies] == [
+        (ContentType.NO_HELLO, NoHello(content=None)),
+        (ContentType.ERROR, Error(content=RATE_LIMITED)),
+        (ContentType.NO_HELLO, NoHello(content=None)),
+    ]
+    assert async_db.metrics.errors == {"rate_limited": 1}
@@ -0,0 +1,121 @@
+import asyncio
+import time
+from dataclasses import replace
+from pathlib import Path
+
+import pytest
+
+from lfgdev.client import Client
+from lfgdev.client.bench import (
+    Bench,
+    BenchConfig,
+    BenchResult,
+    LatencyHistogram,
+    compare,
+    find_baseline,
+    parse_mix,
+)
+from lfgdev.types import Username
+
+
+def test_parse_mix() -> None:
+    assert parse_mix("hello=8,last_seen=1,register") == {
+        "HELLO": 8.0,
+        "LAST_SEEN": 1.0,
+        "REGISTER": 1.0,
+    }
+    with pytest.raises(ValueError):
+        parse_mix("batch=1")
+    with pytest.raises(ValueError):
+        parse_mix("hello=0")
+
+
+def test_latency_histogram() -> None:
+    histogram = LatencyHistogram()
+    for millis in range(1, 1001):
+        histogram.record(millis / 1000)
+
+    assert histogram.count == 1000
+    assert histogram.percentile(50) == pytest.approx(0.5, rel=0.01)
+    assert histogram.percentile(99) == pytest.approx(0.99, rel=0.01)
+    assert histogram.percentile(100) == histogram.max == 1.0
+
+
+def result(started: float, throughput: float, p99: float) -> BenchResult:
+    latency = {"p50": 0.001, "p90": 0.002, "p99": p99, "p99.9": p99}
+    return BenchResult(
+        commit="abc1234",
+        started=started,
+        config=BenchConfig(seed=1),
+        requests=int(throughput * 10),
+        errors=0,
+        timeouts=0,
+        error_replies=0,
+        elapsed=10.0,
+        latency=latency,
+        by_kind={"HELLO": int(throughput * 10)},
+        histogram={},
+    )
+
+
+def test_compare_against_baseline(tmp_path: Path) -> None:
+    now = time.time()
+    baseline = result(now - 20, throughput=1000, p99=0.005)
+    baseline.save(tmp_path)
+    # Different settings, so never a baseline for the default config
+    other = result(now - 10, throughput=1, p99=1)
+    replace(other, config=BenchConfig(users=1)).save(tmp_path)
+
+    current = replace(result(now, throughput=700, p99=0.010), config=BenchConfig())
+    previous = find_baseline(tmp_path, current)
+    assert previous is not None
+    assert previous["commit"] == baseline.commit
+    assert previous["throughput"] == baseline.throughput
+
+    regressions = compare(previous, current, threshold=0.2)
+    assert [regression.split()[0] for regression in regressions] == [
+        "throughput",
+        "p99",
+        "p99.9",
+    ]
+    assert compare(previous, baseline, threshold=0.2) == []
+    timing_out = replace(baseline, timeouts=3)
+    assert compare(previous, timing_out, threshold=0.2) == ["timeouts 0 -> 3"]
+
+
+@pytest.mark.asyncio
+async def test_timeouts_count_towards_latency() -> None:
+    # Nothing listening replies, so every request waits out the timeout
+    server = await asyncio.start_server(lambda r, w: None, "localhost", 0)
+    port = server.sockets[0].getsockname()[1]
+    client = Client(
+        address="localhost", port=port, username=Username("TestBench"), timeout=0.05
+    )
+    config = BenchConfig(duration=0.2, warmup=0, users=2)
+    result = await Bench(config=config, client=client).run()
+    await client.close()
+    server.close()
+
+    assert result.errors == 0
+    assert result.timeouts == result.requests > 0
+    assert result.latency["p50"] >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_bench(client: Client) -> None:
+    for mode in ("closed", "open"):
+        config = BenchConfig(
+            mode=mode,
+            duration=0.2,
+            warmup=0.1,
+            users=5,
+            rate=200,
+            mix=parse_mix("hello=2,last_seen=1,register=1"),
+            seed=0,
+        )
+        result = await Bench(config=config, client=client).run()
+
+        assert result.errors == 0
+        assert result.requests == sum(result.by_kind.values()) > 0
+        assert set(result.by_kind) <= {"HELLO", "LAST_SEEN", "REGISTER"}
+        assert 0 < result.latency["p50"] <= result.latency["p99.9"]
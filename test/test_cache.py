@@ -0,0 +1,52 @@
+from lfgdev.server.cache import PlayerCache
+from lfgdev.server.db import Player
+from lfgdev.types import Username
+
+
+def test_cache_hits_and_negative_entries() -> None:
+    cache = PlayerCache()
+    username = Username("TestBasil")
+    assert cache.get(username) is None
+
+    cache.put(username, None)
+    if entry := cache.get(username):
+        assert entry.player is None
+    else:
+        raise AssertionError("Expected a negative entry")
+
+    player = Player(username=username, last_seen=1)
+    cache.put(username, player)
+    if entry := cache.get(username):
+        assert entry.player == player
+    else:
+        raise AssertionError("Expected a cached player")
+
+    assert (cache.stats.misses, cache.stats.negative_hits, cache.stats.hits) == (
+        1,
+        1,
+        1,
+    )
+
+
+def test_cache_lru_and_ttl() -> None:
+    cache = PlayerCache(max_size=2, ttl=60.0)
+    first, second, third = Username("A"), Username("B"), Username("C")
+    for username in (first, second):
+        cache.put(username, Player(username=username, last_seen=0))
+    cache.get(first)
+    cache.put(third, Player(username=third, last_seen=0))
+    assert second not in cache.entries
+    assert cache.stats.evictions == 1
+
+    expired = PlayerCache(ttl=-1.0)
+    expired.put(first, Player(username=first, last_seen=0))
+    assert expired.get(first) is None
+
+
+def test_cache_fill_skips_stale_reads() -> None:
+    cache = PlayerCache()
+    username = Username("TestDill")
+    generation = cache.generation
+    cache.invalidate(username)
+    cache.fill(username, None, generation)
+    assert username not in cache.entries
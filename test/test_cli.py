@@ -0,0 +1,76 @@
+import asyncio
+import subprocess
+import sys
+from argparse import Namespace
+from pathlib import Path
+
+import pytest
+
+from lfgdev.client import Client
+from lfgdev.client.commands import daemon
+from lfgdev.client.main import forward
+from lfgdev.types import Username
+
+CLIENT = [sys.executable, "-c", "from lfgdev.client.main import main; main()"]
+
+
+def test_lazy_imports() -> None:
+    # Parsing, and getting as far as forwarding, loads none of these
+    code = """
+import sys
+from lfgdev.client.cli import cli
+cli(["--via", "/nowhere", "send", "-k", "HELLO"])
+print(sorted({"asyncio", "lfgdev.message", "lfgdev.client.bench"} & set(sys.modules)))
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
+
+
+@pytest.mark.integration
+def test_repl(server: None) -> None:
+    commands = (
+        "send -k HELLO\nsend -k NOPE\nsend -k 'HELLO\nsend -k SUBSCRIBE\n"
+        "send -k STATS\n"
+    )
+    result = subprocess.run(
+        [*CLIENT, "-p", "3117", "-u", "TestRepl", "repl"],
+        input=commands,
+        capture_output=True,
+        text=True,
+        timeout=10,
+        check=True,
+    )
+    lines = result.stdout.splitlines()
+    assert lines[0] == "NoHello(content=None)"
+    # Neither a bad command nor one that can't run here ends the session
+    assert "invalid choice" in result.stderr
+    assert "No closing quotation" in result.stderr
+    assert lines[1] == "Only `send` runs here, and not -k SUBSCRIBE"
+    assert "lfgdev_requests_total" in result.stdout
+
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_daemon(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    path = tmp_path / "lfgdev.sock"
+    client = Client(address="localhost", port=3117, username=Username("TestDaemon"))
+    task = asyncio.create_task(daemon(client, path))
+    while not path.exists():
+        await asyncio.sleep(0.01)
+
+    command = Namespace(
+        command="send", kind="HELLO", window=300, protocol=2, username=None
+    )
+    for _ in range(3):
+        assert await asyncio.to_thread(forward, path, command) == 0
+    assert capsys.readouterr().out == "NoHello(content=None)\n" * 3
+    # Every command went over the one connection
+    assert len(client.pool.connections) == 1
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await client.close()
+    assert not path.exists()
@@ -1,8 +1,13 @@
+import asyncio
+from dataclasses import replace
+from uuid import uuid4
+
 import pytest
 
 from lfgdev.client import Client
-from lfgdev.message import Header, Hello, Message
-from lfgdev.types import ContentType, Username
+from lfgdev.message import Batch, Header, Hello, LastSeen, Message, Register, Stats
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.types import ContentType, PresenceEvent, Username
 
 pytestmark = [pytest.mark.asyncio, pytest.mark.integration]
 
@@ -24,3 +29,146 @@ async def test_client_metadata_persistence(client: Client) -> None:
     await client.send(message)
     await client.send(message)
     assert client.metadata.messages_sent == 2
+
+
+async def test_client_pool_multiplexes_requests(client: Client) -> None:
+    header = Header(sender=Username("TestUser"), content_type=ContentType.HELLO)
+    messages = [
+        Message(header=replace(header, identifier=uuid4()), body=Hello(content=None))
+        for _ in range(200)
+    ]
+    async with asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(client.send(message)) for message in messages]
+
+    for message, task in zip(messages, tasks):
+        reply = task.result()
+        assert reply is not None
+        assert reply.header.identifier == message.header.identifier
+    assert 0 < len(client.pool.connections) <= client.pool.max_connections
+
+
+async def test_client_one_shot(client: Client) -> None:
+    one_shot = Client(
+        address=client.address,
+        port=client.port,
+        username=client.username,
+        keep_alive=False,
+    )
+    header = Header(sender=Username("TestUser"), content_type=ContentType.HELLO)
+    reply = await one_shot.send(Message(header=header, body=Hello(content=None)))
+    assert reply is not None
+    assert reply.header.content_type == ContentType.NO_HELLO
+    assert one_shot.pool.connections == []
+
+
+async def test_client_batch(client: Client, async_db: AsyncDatabase) -> None:
+    players = [Username(f"TestBatch{i}") for i in range(3)]
+    subs = tuple(
+        Message(
+            header=Header(sender=player, content_type=ContentType.REGISTER),
+            body=Register(content=player),
+        )
+        for player in players
+    ) + (
+        Message(
+            header=Header(sender=players[0], content_type=ContentType.REGISTER),
+            body=Register(content=players[0]),
+        ),
+    )
+    header = Header(sender=Username("TestAggregator"), content_type=ContentType.BATCH)
+    reply = await client.send(Message(header=header, body=Batch(content=subs)))
+
+    assert reply is not None and isinstance(reply.body, Batch)
+    assert [sub.header.identifier for sub in reply.body.content] == [
+        sub.header.identifier for sub in subs
+    ]
+    assert [sub.header.content_type for sub in reply.body.content] == [
+        ContentType.REGISTER,
+        ContentType.REGISTER,
+        ContentType.REGISTER,
+        ContentType.ERROR,
+    ]
+    for player in players:
+        assert await async_db.find_by_username(player) is not None
+        await async_db.remove(player)
+
+
+async def test_client_stats(client: Client) -> None:
+    hello = Header(sender=Username("TestUser"), content_type=ContentType.HELLO)
+    await client.send(Message(header=hello, body=Hello(content=None)))
+
+    header = Header(sender=Username("TestUser"), content_type=ContentType.STATS)
+    reply = await client.send(Message(header=header, body=Stats()))
+    assert reply is not None and isinstance(reply.body, Stats)
+    lines = reply.body.content.splitlines()
+    assert any(
+        line.startswith('lfgdev_requests_total{content_type="HELLO"}') for line in lines
+    )
+    assert 'lfgdev_route_seconds_count{content_type="HELLO"}' in reply.body.content
+    assert "lfgdev_active_connections" in reply.body.content
+    assert "lfgdev_cache_hits_total" in reply.body.content
+
+
+async def test_client_timeout() -> None:
+    # Accepts, reads and never replies
+    async def ignore(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await reader.read()
+        writer.close()
+
+    server = await asyncio.start_server(ignore, host="localhost", port=3119)
+    header = Header(sender=Username("TestUser"), content_type=ContentType.HELLO)
+    message = Message(header=header, body=Hello(content=None))
+    async with server:
+        for keep_alive in (True, False):
+            client = Client(
+                address="localhost",
+                port=3119,
+                username=Username("TestUser"),
+                keep_alive=keep_alive,
+                timeout=0.05,
+            )
+            assert await client.send(message) is None
+            assert await client.send(message, timeout=0.01) is None
+            assert client.metadata.timeouts == 2
+            await client.close()
+
+
+async def test_client_list_active(client: Client, async_db: AsyncDatabase) -> None:
+    usernames = [Username(f"TestLobby{i}") for i in range(7)]
+    for i, username in enumerate(usernames):
+        await async_db.save(username)
+        # Ahead of anything else in the test db, so these come first
+        await async_db.run(async_db.db.update_many, [(username, 3_000_000_000 + i)])
+
+    players = []
+    async for player in client.list_active(window=60, page_size=3):
+        if not player.username.startswith("TestLobby"):
+            break
+        players.append(player)
+
+    assert [player.username for player in players] == usernames[::-1]
+    for username in usernames:
+        await async_db.remove(username)
+
+
+async def test_client_subscribe(client: Client, async_db: AsyncDatabase) -> None:
+    presence = client.subscribe()
+    first = asyncio.create_task(anext(presence))
+    # Time for the SUBSCRIBE to be acknowledged before anything happens
+    await asyncio.sleep(0.1)
+
+    username = Username("TestPresence")
+    player = Client(address=client.address, port=client.port, username=username)
+    register = Header(sender=username, content_type=ContentType.REGISTER)
+    await player.send(Message(header=register, body=Register(content=username)))
+    event = await asyncio.wait_for(first, 2)
+    assert (event.event, event.content.username) == (PresenceEvent.REGISTERED, username)
+
+    last_seen = Header(sender=username, content_type=ContentType.LAST_SEEN)
+    await player.send(Message(header=last_seen, body=LastSeen(content=None)))
+    event = await asyncio.wait_for(anext(presence), 2)
+    assert (event.event, event.content.username) == (PresenceEvent.SEEN, username)
+
+    await presence.aclose()
+    await player.close()
+    await async_db.remove(username)
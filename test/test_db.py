@@ -1,17 +1,230 @@
+import asyncio
+import sqlite3
+from pathlib import Path
+
 import pytest
 
-from lfgdev.server.db import Database
-from lfgdev.types import Username
+from lfgdev.server.db import (
+    SCHEMA_VERSION,
+    AsyncDatabase,
+    Database,
+    Player,
+    schema_version,
+)
+from lfgdev.types import PresenceEvent, Username
 
 
 @pytest.mark.integration
 @pytest.mark.asyncio
 async def test_save_player(db: Database) -> None:
     username = Username("TestCilantro")
-    db.save(username=username)
+    assert db.save(username=username)
+    assert not db.save(username=username)
     if player := db.find_by_username(username=username):
         assert player.username == username
     else:
         raise Exception("Player not found")
     db.remove(username)
     assert db.find_by_username(username=username) is None
+
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_async_database(async_db: AsyncDatabase) -> None:
+    username = Username("TestCoriander")
+    await async_db.save(username=username)
+    if player := await async_db.find_by_username(username=username):
+        assert player.username == username
+    else:
+        raise Exception("Player not found")
+    await async_db.remove(username)
+    assert await async_db.find_by_username(username=username) is None
+
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_last_seen_write_behind(db: Database, async_db: AsyncDatabase) -> None:
+    username = Username("TestParsley")
+    await async_db.save(username=username)
+    await async_db.run(db.update_many, [(username, 0)])
+
+    await async_db.touch(username)
+    buffered = async_db.last_seen.get(username)
+    assert buffered is not None
+    # Not written yet, but reads through the facade already see it
+    assert db.find_by_username(username=username) == Player(
+        username=username, last_seen=0
+    )
+    if player := await async_db.find_by_username(username=username):
+        assert player.last_seen == buffered
+    else:
+        raise Exception("Player not found")
+
+    await async_db.flush()
+    assert db.find_by_username(username=username) == Player(
+        username=username, last_seen=buffered
+    )
+    await async_db.remove(username)
+
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_last_seen(
+    db: Database, async_db: AsyncDatabase, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    username = Username("TestChervil")
+    await async_db.save(username=username)
+    await async_db.run(db.update_many, [(username, 0)])
+    await async_db.find_by_username(username=username)
+
+    def update_many(self: Database, rows: object) -> None:
+        raise sqlite3.OperationalError("database is locked")
+
+    await async_db.touch(username)
+    buffered = async_db.last_seen.get(username)
+    assert buffered is not None
+    with monkeypatch.context() as patch:
+        patch.setattr(Database, "update_many", update_many)
+        with pytest.raises(sqlite3.OperationalError):
+            await async_db.flush()
+    # Still pending, and the cache hasn't got ahead of the table
+    assert async_db.last_seen.get(username) == buffered
+    entry = async_db.cache.get(username)
+    assert entry is not None and entry.player == Player(username=username, last_seen=0)
+
+    # A heartbeat that arrived during the failed flush wins
+    async_db.last_seen.pending[username] = buffered + 5
+    async_db.last_seen.restore({username: buffered})
+    assert async_db.last_seen.get(username) == buffered + 5
+
+    await async_db.flush()
+    assert db.find_by_username(username=username) == Player(
+        username=username, last_seen=buffered + 5
+    )
+    await async_db.remove(username)
+
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_transaction_rollback(db: Database, async_db: AsyncDatabase) -> None:
+    username = Username("TestSorrel")
+    with pytest.raises(RuntimeError):
+        async with async_db.transaction():
+            await async_db.save(username=username)
+            raise RuntimeError("Abort batch")
+    assert db.find_by_username(username=username) is None
+
+    async with async_db.transaction():
+        await async_db.save(username=username)
+    assert db.find_by_username(username=username) is not None
+    await async_db.remove(username)
+
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_transaction_isolation(db: Database, async_db: AsyncDatabase) -> None:
+    username = Username("TestTarragon")
+    pushed: list[bytes] = []
+
+    async def send(frame: bytes) -> None:
+        pushed.append(frame)
+
+    async def batch(opened: asyncio.Event, finish: asyncio.Event, outcome: str):
+        async with async_db.transaction():
+            await async_db.save(username=username)
+            async_db.publish(PresenceEvent.REGISTERED, username)
+            opened.set()
+            await finish.wait()
+            if outcome == "rollback":
+                raise RuntimeError("Abort batch")
+
+    async_db.presence.subscribe("test", send, lambda: None)
+    for outcome in ("rollback", "commit"):
+        opened = asyncio.Event()
+        finish = asyncio.Event()
+        task = asyncio.create_task(batch(opened, finish, outcome))
+        await opened.wait()
+        # Neither the row nor the event shows until the batch is done
+        reading = asyncio.create_task(async_db.find_by_username(username))
+        await asyncio.sleep(0.05)
+        assert not reading.done()
+        assert async_db.presence.stats.events == 0
+
+        finish.set()
+        if outcome == "rollback":
+            with pytest.raises(RuntimeError):
+                await task
+            assert await reading is None
+            assert async_db.presence.stats.events == 0
+        else:
+            await task
+            assert await reading is not None
+            assert async_db.presence.stats.events == 1
+    async_db.presence.unsubscribe("test")
+    await async_db.remove(username)
+
+
+@pytest.mark.integration
+def test_list_active_pages(db: Database) -> None:
+    # Far enough in the future that nothing else in the test db is this recent
+    since = 3_000_000_000
+    seen = {f"TestActive{i}": since + i // 3 for i in range(10)}
+    for username in seen:
+        db.save(Username(username))
+    db.update_many([(Username(username), ts) for username, ts in seen.items()])
+    db.update_many([(Username("TestActive0"), since - 1)])
+
+    pages: list[list[Player]] = []
+    after = None
+    while page := db.list_active(since, limit=4, after=after):
+        pages.append(page)
+        after = page[-1]
+
+    players = [player for page in pages for player in page]
+    assert [len(page) for page in pages] == [4, 4, 1]
+    # Newest first, ties broken by username, and TestActive0 is out of the window
+    assert [player.username for player in players] == sorted(
+        (username for username in seen if username != "TestActive0"),
+        key=lambda username: (seen[username], username),
+        reverse=True,
+    )
+    for username in seen:
+        db.remove(Username(username))
+
+
+def test_migrate_legacy_database(tmp_path: Path) -> None:
+    path = tmp_path / "lfg.db"
+    # As files were made before the schema had a version
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE lfg (username TEXT PRIMARY KEY UNIQUE, last_seen INTEGER)"
+        )
+        connection.execute("CREATE INDEX lfg_last_seen ON lfg (last_seen, username)")
+        connection.executemany(
+            "INSERT INTO lfg VALUES (?, ?)", [("TestOld", 1), ("TestNull", None)]
+        )
+    connection.close()
+
+    with Database.init(path) as db:
+        assert schema_version(db.connection) == SCHEMA_VERSION
+        (sql,) = db.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'lfg'"
+        ).fetchone()
+        assert "WITHOUT ROWID" in sql
+        # Nothing left over from UNIQUE
+        indexes = db.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'lfg'"
+        ).fetchall()
+        assert indexes == [("lfg_last_seen",)]
+        assert db.find_by_username(Username("TestOld")) == Player(
+            username=Username("TestOld"), last_seen=1
+        )
+        assert db.list_active(0, limit=10) == [
+            Player(username=Username("TestOld"), last_seen=1),
+            Player(username=Username("TestNull"), last_seen=0),
+        ]
+        db.connection.execute("UPDATE lfg_schema SET version = version + 1")
+        db.connection.commit()
+
+    with pytest.raises(ValueError, match="newer"), Database.init(path):
+        pass
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from conftest import hello
+
+from lfgdev.client import Client
+from lfgdev.message import Header, Message, Register
+from lfgdev.server import serve
+from lfgdev.server.config import Engine, ServerConfig
+from lfgdev.server.db import Database
+from lfgdev.server.lifecycle import Lifecycle
+from lfgdev.types import ContentType, Username
+
+SERVER = [sys.executable, "-c", "from lfgdev.server.main import main; main()"]
+
+
+def register(username: str) -> Message:
+    header = Header(sender=Username(username), content_type=ContentType.REGISTER)
+    return Message(header=header, body=Register(content=Username(username)))
+
+
+def lock(path: Path, seconds: float) -> None:
+    """Hold sqlite's write lock from elsewhere, holding up registrations"""
+    blocker = sqlite3.connect(path, check_same_thread=False)
+    blocker.execute("BEGIN IMMEDIATE")
+    threading.Timer(seconds, blocker.close).start()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("engine", ["stream", "protocol"])
+async def test_drain(tmp_path: Path, engine: Engine) -> None:
+    with Database.init(path=tmp_path / "lfg.db") as db:
+        lifecycle = Lifecycle()
+        ready = asyncio.Event()
+        server = asyncio.create_task(
+            serve(
+                host="localhost",
+                port=3119,
+                db=db,
+                config=ServerConfig(engine=engine),
+                lifecycle=lifecycle,
+                ready=ready.set,
+            )
+        )
+        await ready.wait()
+        idle = Client(address="localhost", port=3119, username=Username("TestIdle"))
+        busy = Client(address="localhost", port=3119, username=Username("TestBusy"))
+        assert await idle.send(hello("TestIdle")) is not None
+
+        lock(db.path, 0.5)
+        registering = asyncio.create_task(busy.send(register("TestBusy")))
+        await asyncio.sleep(0.1)
+        lifecycle.stop()
+        await asyncio.sleep(0.1)
+        with pytest.raises(ConnectionError):
+            await asyncio.open_connection("localhost", 3119)
+
+        # The request in flight is answered, and the idle connection doesn't
+        # hold things up until drain_timeout
+        start = time.monotonic()
+        reply = await registering
+        assert reply is not None
+        assert reply.header.content_type == ContentType.REGISTER
+        await server
+        assert time.monotonic() - start < 2
+        await idle.close()
+        await busy.close()
+
+
+@pytest.mark.asyncio
+async def test_drain_deadline(tmp_path: Path) -> None:
+    with Database.init(path=tmp_path / "lfg.db") as db:
+        lifecycle = Lifecycle()
+        ready = asyncio.Event()
+        server = asyncio.create_task(
+            serve(
+                host="localhost",
+                port=3119,
+                db=db,
+                config=ServerConfig(drain_timeout=0.2),
+                lifecycle=lifecycle,
+                ready=ready.set,
+            )
+        )
+        await ready.wait()
+        client = Client(address="localhost", port=3119, username=Username("TestSlow"))
+
+        lock(db.path, 1.0)
+        registering = asyncio.create_task(client.send(register("TestSlow")))
+        await asyncio.sleep(0.1)
+        lifecycle.stop()
+        with pytest.raises(ConnectionError):
+            await registering
+        await server
+        await client.close()
+
+
+def wait_for(condition, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_restart(tmp_path: Path) -> None:
+    ready_file = tmp_path / "lfgdev.pid"
+    started: list[int] = []
+    first = subprocess.Popen(
+        [
+            *SERVER,
+            "--port",
+            "3120",
+            "--local-only",
+            "--db",
+            str(tmp_path / "lfg.db"),
+            "--ready-file",
+            str(ready_file),
+        ]
+    )
+    try:
+        await asyncio.to_thread(wait_for, ready_file.exists)
+        assert ready_file.read_text().strip() == str(first.pid)
+        client = Client(address="localhost", port=3120, username=Username("TestIdle"))
+        assert await client.send(hello("TestIdle")) is not None
+
+        os.kill(first.pid, signal.SIGHUP)
+        await asyncio.to_thread(first.wait, 10)
+        assert first.returncode == 0
+        second = int(ready_file.read_text())
+        assert second != first.pid
+        started.append(second)
+
+        # The pooled connection was closed, and the next request reconnects
+        assert await client.send(hello("TestIdle")) is not None
+        await client.close()
+        os.kill(second, signal.SIGTERM)
+        await asyncio.to_thread(wait_for, lambda: not ready_file.exists())
+        started.clear()
+    finally:
+        first.kill()
+        for pid in started:
+            os.kill(pid, signal.SIGKILL)
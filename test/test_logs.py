@@ -0,0 +1,96 @@
+import json
+import logging
+from pathlib import Path
+
+import pytest
+
+from lfgdev.message import Header, Hello, Message
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.server.logs import (
+    ACCESS_LOG,
+    LazyQueueHandler,
+    LogConfig,
+    RequestSampler,
+    configure_logging,
+    parse_sample,
+)
+from lfgdev.server.message_handler import MessageHandler
+from lfgdev.types import ContentType, Username
+
+
+def record(content_type: str | None, created: float = 0.0) -> logging.LogRecord:
+    record = logging.makeLogRecord({"name": "lfgdev.test", "created": created})
+    if content_type is not None:
+        record.content_type = content_type
+    return record
+
+
+def test_parse_sample() -> None:
+    assert parse_sample("hello=0.01,last_seen") == {"HELLO": 0.01, "LAST_SEEN": 1.0}
+    with pytest.raises(ValueError):
+        parse_sample("hello=2")
+
+
+def test_sampler() -> None:
+    sampler = RequestSampler(rates={"HELLO": 0.25})
+    kept = [sampler.filter(record("HELLO")) for _ in range(100)]
+    assert sum(kept) == 25
+    assert all(sampler.filter(record("REGISTER")) for _ in range(10))
+    assert sampler.filter(record(None))
+    assert sampler.dropped == 75
+
+
+def test_sampler_rate_limit() -> None:
+    sampler = RequestSampler(rate_limit=3)
+    assert [sampler.filter(record("HELLO", created=1.5)) for _ in range(5)] == [
+        True,
+        True,
+        True,
+        False,
+        False,
+    ]
+    assert sampler.filter(record("REGISTER", created=1.5))
+    assert sampler.filter(record("HELLO", created=2.0))
+
+
+def test_lazy_queue_handler() -> None:
+    class Loud:
+        formatted = 0
+
+        def __str__(self) -> str:
+            Loud.formatted += 1
+            return "loud"
+
+    handler = LazyQueueHandler(queue=None)  # type: ignore[arg-type]
+    queued = handler.prepare(
+        logging.makeLogRecord({"msg": "Got %s", "args": (Loud(),)})
+    )
+    assert Loud.formatted == 0
+    assert queued.getMessage() == "Got loud"
+
+
+@pytest.mark.asyncio
+async def test_access_log(
+    async_db: AsyncDatabase, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    server_logger = logging.getLogger("lfgdev")
+    monkeypatch.setattr(server_logger, "handlers", [])
+    monkeypatch.setattr(server_logger, "level", server_logger.level)
+    monkeypatch.setattr(ACCESS_LOG, "disabled", ACCESS_LOG.disabled)
+    path = tmp_path / "access.jsonl"
+    listener = configure_logging(
+        LogConfig(access_log=str(path), access_format="json", sample={"HELLO": 0.5})
+    )
+
+    router = MessageHandler(db=async_db)
+    header = Header(sender=Username("TestUser"), content_type=ContentType.HELLO)
+    for _ in range(4):
+        await router.route(Message(header=header, body=Hello(content=None)))
+    listener.stop()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(lines) == 2
+    assert lines[0]["sender"] == "TestUser"
+    assert lines[0]["content_type"] == "HELLO"
+    assert lines[0]["reply"] == "NO_HELLO"
+    assert lines[0]["duration_ms"] >= 0
@@ -0,0 +1,128 @@
+from pathlib import Path
+
+import pytest
+
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.server.memory import MemoryStorage
+from lfgdev.server.storage import Player
+from lfgdev.types import Username
+
+
+def players(storage: MemoryStorage) -> dict[Username, int]:
+    return {player.username: player.last_seen for player in storage.players.values()}
+
+
+def test_list_active_and_expire() -> None:
+    storage = MemoryStorage()
+    since = 3_000_000_000
+    seen = {Username(f"TestActive{i}"): since + i // 3 for i in range(10)}
+    for username in seen:
+        storage.save(username)
+    storage.update_many([*seen.items(), (Username("TestActive0"), since - 1)])
+    # Players that were never saved are skipped, as with sqlite
+    storage.update_many([(Username("TestUnknown"), since)])
+    assert storage.find_by_username(Username("TestUnknown")) is None
+
+    pages: list[list[Player]] = []
+    after = None
+    while page := storage.list_active(since, limit=4, after=after):
+        pages.append(page)
+        after = page[-1]
+    assert [len(page) for page in pages] == [4, 4, 1]
+    assert [player.username for page in pages for player in page] == sorted(
+        (username for username in seen if username != "TestActive0"),
+        key=lambda username: (seen[username], username),
+        reverse=True,
+    )
+
+    # Oldest first, and the index forgets them too
+    expired = storage.expire(since + 1, limit=2)
+    assert expired[0] == Player(username=Username("TestActive0"), last_seen=since - 1)
+    assert len(expired) == 2
+    assert len(storage.expire(since + 1, limit=100)) == 1
+    assert min(storage.seconds) == since + 1
+    assert len(storage.list_active(0, limit=100)) == 7
+
+
+def test_rollback() -> None:
+    storage = MemoryStorage()
+    kept, added = Username("TestKept"), Username("TestAdded")
+    storage.save(kept)
+    storage.update_many([(kept, 1)])
+
+    storage.begin()
+    storage.save(added)
+    storage.update_many([(kept, 2)])
+    storage.remove(kept)
+    storage.rollback()
+
+    assert storage.find_by_username(added) is None
+    assert storage.find_by_username(kept) == Player(username=kept, last_seen=1)
+    assert storage.list_active(0, limit=10) == [Player(username=kept, last_seen=1)]
+
+
+def test_recovery(tmp_path: Path) -> None:
+    log = tmp_path / "lfg.log"
+    with MemoryStorage.init(path=log) as storage:
+        for i in range(5):
+            storage.save(Username(f"TestPlayer{i}"))
+        storage.update_many([(Username("TestPlayer0"), 7)])
+        storage.remove(Username("TestPlayer1"))
+        storage.begin()
+        storage.save(Username("TestRolledBack"))
+        storage.rollback()
+        expected = players(storage)
+
+        # A crash now leaves only the log, which has every commit in it
+        assert players(MemoryStorage.load(log)) == expected
+    # Shutting down leaves a snapshot and an empty log
+    assert log.stat().st_size == 0
+    with MemoryStorage.init(path=log) as restarted:
+        assert players(restarted) == expected
+        restarted.remove(Username("TestPlayer2"))
+        del expected[Username("TestPlayer2")]
+
+    # A record cut off mid-write is skipped, and the rest still loads
+    with log.open("ab") as torn:
+        torn.write(b"\x01\x00\x00")
+    assert players(MemoryStorage.load(log)) == expected
+
+
+def test_snapshot_rotates_log(tmp_path: Path) -> None:
+    log = tmp_path / "lfg.log"
+    with MemoryStorage.init(path=log) as storage:
+        storage.save(Username("TestBefore"))
+        snapshot = storage.start_snapshot()
+        assert snapshot is not None
+        # Writes carry on into a fresh log while the snapshot is written
+        storage.save(Username("TestDuring"))
+        # Only one snapshot at a time
+        assert storage.start_snapshot() is None
+        # Never finished: the rotated log is what's left to recover from
+        crashed = MemoryStorage.load(log)
+        assert set(crashed.players) == {"TestBefore", "TestDuring"}
+
+        storage.finish_snapshot(snapshot)
+        assert not storage.old_log_path.exists()
+        storage.save(Username("TestAfter"))
+    with MemoryStorage.init(path=log) as restarted:
+        assert set(restarted.players) == {"TestBefore", "TestDuring", "TestAfter"}
+
+
+@pytest.mark.asyncio
+async def test_async_database_over_memory() -> None:
+    async_db = AsyncDatabase(db=MemoryStorage())
+    username = Username("TestCoriander")
+    await async_db.save(username=username)
+    async with async_db.transaction():
+        await async_db.touch(username)
+        await async_db.flush()
+    if player := await async_db.find_by_username(username=username):
+        assert player.username == username
+    else:
+        pytest.fail("Player not found")
+    # Called in place, never on the worker thread
+    assert async_db.executor._threads == set()
+    await async_db.remove(username)
+    assert await async_db.find_by_username(username=username) is None
+    async_db.close()
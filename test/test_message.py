@@ -1,8 +1,148 @@
-from lfgdev.message import Header
-from lfgdev.types import ContentType, Username
+from dataclasses import replace
+
+import pytest
+
+from lfgdev.message import (
+    ActivePlayer,
+    Batch,
+    Body,
+    Error,
+    Header,
+    Hello,
+    LastSeen,
+    ListActive,
+    Message,
+    Presence,
+    Register,
+    Stats,
+    Subscribe,
+)
+from lfgdev.message.codec import HEADER_SIZE, decode_frame
+from lfgdev.types import ContentType, PresenceEvent, ProtocolVersion, Username
 
 
 def test_encode_decode() -> None:
     header = Header(content_type=ContentType.HELLO, sender=Username("TestUser"))
     bytes = header.encode()
     assert Header.decode(bytes) == header
+
+
+def test_encode_decode_v1() -> None:
+    header = Header(
+        content_type=ContentType.HELLO,
+        sender=Username("TestUser"),
+        version=ProtocolVersion.V1,
+    )
+    assert Header.decode(header.encode()) == header
+
+
+def test_frame_codec_round_trip() -> None:
+    sender = Username("TestUser")
+    bodies: list[tuple[ContentType, Body]] = [
+        (ContentType.HELLO, Hello()),
+        (ContentType.LAST_SEEN, LastSeen(content=1_700_000_000)),
+        (ContentType.REGISTER, Register(content=sender)),
+        (ContentType.ERROR, Error(content="Username already registered")),
+    ]
+    for version in ProtocolVersion:
+        for content_type, body in bodies:
+            header = Header(content_type=content_type, sender=sender, version=version)
+            frame = Message(header=header, body=body).encode()
+            assert decode_frame(frame) == (header, body, len(frame))
+            assert decode_frame(frame[:-1]) is None
+
+
+@pytest.mark.parametrize("version", list(ProtocolVersion))
+def test_unknown_content_type(version: ProtocolVersion) -> None:
+    header = Header(
+        content_type=ContentType.HELLO, sender=Username("TestUser"), version=version
+    )
+    frame = bytearray(Message(header=header, body=Hello()).encode())
+    # The last byte of the content type, in either layout
+    frame[HEADER_SIZE - 3 if version is ProtocolVersion.V2 else HEADER_SIZE - 1] = 250
+    with pytest.raises(ValueError, match="Unknown content type"):
+        decode_frame(bytes(frame))
+
+
+def test_truncated_body() -> None:
+    header = Header(content_type=ContentType.LAST_SEEN, sender=Username("TestUser"))
+    # Half a timestamp, which the header says is the whole body
+    frame = (
+        header.encode(body_length=2) + LastSeen(content=1_700_000_000).encode_v2()[:2]
+    )
+    with pytest.raises(ValueError, match="Malformed LAST_SEEN body"):
+        decode_frame(frame)
+
+
+def test_v2_bodies_are_variable_size() -> None:
+    sender = Username("TestUser")
+    hello = Header(content_type=ContentType.HELLO, sender=sender)
+    assert len(Message(header=hello, body=Hello()).encode()) == HEADER_SIZE
+
+    error = Error(content="x" * 500)
+    header = Header(content_type=ContentType.ERROR, sender=sender)
+    if decoded := decode_frame(Message(header=header, body=error).encode()):
+        assert decoded[1] == error
+    else:
+        raise AssertionError("Expected a complete frame")
+
+
+def test_batch_round_trip() -> None:
+    sender = Username("TestUser")
+    subs = (
+        Message(
+            header=Header(content_type=ContentType.HELLO, sender=sender),
+            body=Hello(),
+        ),
+        Message(
+            header=Header(content_type=ContentType.REGISTER, sender=sender),
+            body=Register(content=sender),
+        ),
+    )
+    header = Header(content_type=ContentType.BATCH, sender=sender)
+    frame = Message(header=header, body=Batch(content=subs)).encode()
+    assert decode_frame(frame) == (header, Batch(content=subs), len(frame))
+
+    with pytest.raises(ValueError):
+        v1 = Header(
+            content_type=ContentType.BATCH, sender=sender, version=ProtocolVersion.V1
+        )
+        Message(header=v1, body=Batch(content=subs)).encode()
+
+
+def test_stats_round_trip() -> None:
+    header = Header(content_type=ContentType.STATS, sender=Username("SERVER"))
+    stats = Stats(content='lfgdev_requests_total{content_type="HELLO"} 1\n')
+    frame = Message(header=header, body=stats).encode()
+    assert decode_frame(frame) == (header, stats, len(frame))
+
+
+def test_list_active_round_trip() -> None:
+    header = Header(content_type=ContentType.LIST_ACTIVE, sender=Username("SERVER"))
+    players = tuple(
+        ActivePlayer(username=Username(name), last_seen=1_700_000_000 - i)
+        for i, name in enumerate(["Ana", "Bo", "Ünal"])
+    )
+    for body in (
+        ListActive(window=60, limit=3),
+        ListActive(window=60, limit=3, cursor=players[-1], content=players),
+    ):
+        frame = Message(header=header, body=body).encode()
+        assert decode_frame(frame) == (header, body, len(frame))
+
+    with pytest.raises(ValueError):
+        ListActive.decode_v2(ListActive(content=players).encode_v2()[:-1])
+
+
+def test_presence_round_trip() -> None:
+    header = Header(content_type=ContentType.PRESENCE, sender=Username("SERVER"))
+    player = ActivePlayer(username=Username("Ünal"), last_seen=1_700_000_000)
+    for event in PresenceEvent:
+        body = Presence(event=event, content=player)
+        frame = Message(header=header, body=body).encode()
+        assert decode_frame(frame) == (header, body, len(frame))
+
+    # Pushes need a length-prefixed body, so subscribing is v2 only
+    v1 = replace(header, content_type=ContentType.SUBSCRIBE, version=ProtocolVersion.V1)
+    with pytest.raises(ValueError):
+        Message(header=v1, body=Subscribe()).encode()
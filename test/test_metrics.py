@@ -0,0 +1,37 @@
+from lfgdev.server.cache import CacheStats
+from lfgdev.server.metrics import LATENCY_BUCKETS, Histogram, Metrics
+
+
+def test_histogram_buckets() -> None:
+    histogram = Histogram()
+    for seconds in (0.00001, 0.0001, 0.003, 2.0):
+        histogram.observe(seconds)
+
+    assert histogram.count == 4
+    assert histogram.counts[0] == 1
+    # Bounds are inclusive, like Prometheus' le
+    assert histogram.counts[LATENCY_BUCKETS.index(0.0001)] == 1
+    assert histogram.counts[LATENCY_BUCKETS.index(0.005)] == 1
+    # Slower than the largest bound
+    assert histogram.counts[-1] == 1
+
+
+def test_render_prometheus_text() -> None:
+    metrics = Metrics()
+    metrics.requests["HELLO"] += 3
+    metrics.errors["malformed"] += 1
+    metrics.connection_opened()
+    metrics.observe(metrics.routes, "HELLO", 0.002)
+    metrics.observe(metrics.routes, "HELLO", 0.2)
+
+    lines = metrics.render(cache=CacheStats(hits=5)).splitlines()
+    assert 'lfgdev_requests_total{content_type="HELLO"} 3' in lines
+    assert 'lfgdev_errors_total{reason="malformed"} 1' in lines
+    assert "lfgdev_active_connections 1" in lines
+    assert "# TYPE lfgdev_route_seconds histogram" in lines
+    # Buckets are cumulative
+    assert 'lfgdev_route_seconds_bucket{content_type="HELLO",le="0.001"} 0' in lines
+    assert 'lfgdev_route_seconds_bucket{content_type="HELLO",le="0.0025"} 1' in lines
+    assert 'lfgdev_route_seconds_bucket{content_type="HELLO",le="+Inf"} 2' in lines
+    assert 'lfgdev_route_seconds_count{content_type="HELLO"} 2' in lines
+    assert "lfgdev_cache_hits_total 5" in lines
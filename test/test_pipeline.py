@@ -0,0 +1,79 @@
+import math
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+from conftest import hello
+
+from lfgdev.message import Error, Message, NoHello
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.server.message_handler import MessageHandler
+from lfgdev.server.pipeline import Reply, build_pipeline, middleware
+from lfgdev.types import ContentType, Username
+
+
+@pytest.mark.asyncio
+async def test_pipeline_order_and_filtering(async_db: AsyncDatabase) -> None:
+    seen: list[str] = []
+
+    @middleware()
+    def first(db: AsyncDatabase, message: Message) -> Message:
+        seen.append("first")
+        return message
+
+    @middleware(ContentType.HELLO)
+    async def second(db: AsyncDatabase, message: Message) -> Message:
+        seen.append("second")
+        return message
+
+    @middleware(ContentType.LAST_SEEN)
+    def skipped(db: AsyncDatabase, message: Message) -> Message:
+        seen.append("skipped")
+        return message
+
+    assert not first.is_async and second.is_async
+    handler = AsyncMock(side_effect=lambda db, message: message)
+    pipeline = build_pipeline(
+        async_db, ContentType.HELLO, (first, second, skipped), handler
+    )
+
+    reply = await pipeline(hello())
+    assert seen == ["first", "second"]
+    handler.assert_awaited_once()
+    assert reply.header.sender == "SERVER"
+    assert {"first", "second"} == set(async_db.metrics.middleware)
+    assert async_db.metrics.routes["HELLO"].count == 1
+
+
+@pytest.mark.asyncio
+async def test_pipeline_short_circuit(async_db: AsyncDatabase) -> None:
+    @middleware()
+    async def deny(db: AsyncDatabase, message: Message) -> Reply:
+        return Reply(
+            message=Message(header=message.header, body=Error(content="Denied"))
+        )
+
+    handler = AsyncMock()
+    pipeline = build_pipeline(async_db, ContentType.HELLO, (deny,), handler)
+
+    reply = await pipeline(hello())
+    assert reply.body == Error(content="Denied")
+    assert reply.header.sender == "SERVER"
+    handler.assert_not_awaited()
+
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_hello_counts_as_seen(async_db: AsyncDatabase) -> None:
+    username = Username("TestHelloOnly")
+    await async_db.save(username)
+    await async_db.run(async_db.db.update_many, [(username, 0)])
+    router = MessageHandler(db=async_db)
+
+    reply = await router.route(hello(username))
+    assert isinstance(reply.body, NoHello)
+    await async_db.flush()
+    since = math.floor(time.time()) - 60
+    active = await async_db.list_active(since, limit=100)
+    assert username in [player.username for player in active]
+    await async_db.remove(username)
@@ -0,0 +1,64 @@
+import asyncio
+from unittest.mock import Mock
+
+import pytest
+
+from lfgdev.message import ActivePlayer, Presence
+from lfgdev.message.codec import decode_frame
+from lfgdev.server.presence import PresenceHub
+from lfgdev.types import PresenceEvent, Username
+
+
+@pytest.mark.asyncio
+async def test_publish_encodes_once() -> None:
+    hub = PresenceHub()
+    received: dict[str, list[bytes]] = {"a": [], "b": []}
+    for key, frames in received.items():
+
+        async def send(frame: bytes, frames: list[bytes] = frames) -> None:
+            frames.append(frame)
+
+        hub.subscribe(key, send, Mock())
+
+    hub.publish(PresenceEvent.REGISTERED, Username("TestUser"), 1_700_000_000)
+    await asyncio.sleep(0)
+    assert received["a"] == received["b"]
+    # Not just equal: the same bytes, encoded once
+    assert received["a"][0] is received["b"][0]
+    decoded = decode_frame(received["a"][0])
+    assert decoded is not None
+    player = ActivePlayer(username=Username("TestUser"), last_seen=1_700_000_000)
+    assert decoded[1] == Presence(event=PresenceEvent.REGISTERED, content=player)
+
+    hub.unsubscribe("a")
+    hub.publish(PresenceEvent.SEEN, Username("TestUser"))
+    await asyncio.sleep(0)
+    assert (len(received["a"]), len(received["b"])) == (1, 2)
+    assert hub.stats.events == 2
+    hub.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("slow_policy", ["drop", "disconnect"])
+async def test_slow_subscriber(slow_policy: str) -> None:
+    hub = PresenceHub(max_queue=2, slow_policy=slow_policy)  # type: ignore[arg-type]
+    stuck = asyncio.Event()
+
+    async def send(frame: bytes) -> None:
+        await stuck.wait()
+
+    abort = Mock()
+    hub.subscribe("slow", send, abort)
+    for _ in range(4):
+        hub.publish(PresenceEvent.SEEN, Username("TestUser"))
+
+    if slow_policy == "drop":
+        assert hub.subscribed("slow")
+        assert hub.stats.dropped == 2
+        abort.assert_not_called()
+    else:
+        # Cut off at the first event it had no room for
+        assert not hub.subscribed("slow")
+        assert (hub.stats.dropped, hub.stats.disconnected) == (1, 1)
+        abort.assert_called_once()
+    hub.close()
@@ -0,0 +1,226 @@
+import asyncio
+import contextlib
+from asyncio import StreamReader, StreamWriter, Transport
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+from conftest import hello
+
+from lfgdev.client import Client
+from lfgdev.message import Header, LastSeen, Message, Register
+from lfgdev.message.codec import HEADER_SIZE, decode_header
+from lfgdev.message.header import VERSION_OFFSET
+from lfgdev.server import serve
+from lfgdev.server.admission import Admission
+from lfgdev.server.config import ServerConfig
+from lfgdev.server.db import AsyncDatabase, Database
+from lfgdev.server.protocol import FrameProtocol
+from lfgdev.server.request_handler import RequestHandler
+from lfgdev.types import ContentType, ProtocolVersion, Username
+
+
+@pytest.fixture
+def transport() -> Transport:
+    return Mock(spec=Transport, is_closing=Mock(return_value=False))
+
+
+@pytest.mark.asyncio
+async def test_frames_split_across_reads(async_db: AsyncDatabase, transport: Mock):
+    messages = [hello(version=ProtocolVersion.V1), hello()] * 2
+    data = b"".join(message.encode() for message in messages)
+    protocol = FrameProtocol(
+        request_handler=RequestHandler(db=async_db, keep_alive=True)
+    )
+    protocol.connection_made(transport)
+
+    # Cut through a header, then through a body
+    for chunk in (data[:10], data[10:50], data[50:]):
+        protocol.data_received(chunk)
+    await asyncio.gather(*protocol.tasks)
+
+    replies = [decode_header(call.args[0]) for call in transport.write.call_args_list]
+    assert [reply.identifier for reply in replies] == [
+        message.header.identifier for message in messages
+    ]
+    assert all(reply.content_type == ContentType.NO_HELLO for reply in replies)
+    assert not protocol.buffer
+
+    assert protocol.eof_received() is False
+    protocol.connection_lost(None)
+
+
+@pytest.mark.asyncio
+async def test_throttled_sender_pauses_reading(
+    async_db: AsyncDatabase, transport: Mock
+):
+    admission = Admission(sender_rate=10, sender_burst=1)
+    protocol = FrameProtocol(
+        request_handler=RequestHandler(
+            db=async_db, keep_alive=True, admission=admission
+        )
+    )
+    protocol.connection_made(transport)
+
+    header = Header(sender=Username("TestUser"), content_type=ContentType.REGISTER)
+    register = Message(header=header, body=Register(content=header.sender)).encode()
+    frames = [
+        hello().encode(),
+        # A username that isn't UTF-8, never decoded: the sender's out of tokens
+        register[:HEADER_SIZE] + b"\xff" * (len(register) - HEADER_SIZE),
+        hello().encode(),
+    ]
+    protocol.data_received(b"".join(frames))
+    transport.pause_reading.assert_called_once()
+    assert protocol.buffer == frames[2]
+    while protocol.tasks:
+        await asyncio.gather(*protocol.tasks)
+
+    replies = [decode_header(call.args[0]) for call in transport.write.call_args_list]
+    assert [reply.content_type for reply in replies] == [
+        ContentType.NO_HELLO,
+        ContentType.ERROR,
+        ContentType.NO_HELLO,
+    ]
+    transport.resume_reading.assert_called_once()
+    assert not protocol.buffer
+    assert async_db.metrics.errors == {"rate_limited": 1}
+    protocol.connection_lost(None)
+
+
+@pytest.mark.asyncio
+async def test_pipelined_frames_wait_for_room(async_db: AsyncDatabase, transport: Mock):
+    protocol = FrameProtocol(
+        request_handler=RequestHandler(db=async_db, keep_alive=True, max_in_flight=2)
+    )
+    protocol.connection_made(transport)
+
+    messages = [hello() for _ in range(10)]
+    protocol.data_received(b"".join(message.encode() for message in messages))
+    # Parsing stops at the limit rather than only pausing further reads
+    assert len(protocol.tasks) == 2
+    assert len(protocol.buffer) == sum(len(m.encode()) for m in messages[2:])
+    while protocol.tasks:
+        assert len(protocol.tasks) <= 2
+        await asyncio.wait(protocol.tasks, return_when=asyncio.FIRST_COMPLETED)
+        await asyncio.sleep(0)
+
+    replies = [decode_header(call.args[0]) for call in transport.write.call_args_list]
+    assert [reply.identifier for reply in replies] == [
+        message.header.identifier for message in messages
+    ]
+    assert not protocol.buffer
+    transport.resume_reading.assert_called_once()
+    protocol.connection_lost(None)
+
+
+@pytest.mark.asyncio
+async def test_one_shot_closes_after_reply(async_db: AsyncDatabase, transport: Mock):
+    protocol = FrameProtocol(request_handler=RequestHandler(db=async_db))
+    protocol.connection_made(transport)
+
+    protocol.data_received(hello().encode() * 2)
+    await asyncio.gather(*protocol.tasks)
+    await asyncio.sleep(0)
+
+    transport.pause_reading.assert_called_once()
+    assert transport.write.call_count == 1
+    transport.close.assert_called_once()
+    protocol.connection_lost(None)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("offset", "value"),
+    [
+        (VERSION_OFFSET, 7),
+        # Unknown content type, then half the timestamp the body should be
+        (HEADER_SIZE - 3, 250),
+        (HEADER_SIZE - 1, 2),
+    ],
+)
+async def test_malformed_frame_closes(
+    async_db: AsyncDatabase, transport: Mock, offset: int, value: int
+):
+    protocol = FrameProtocol(
+        request_handler=RequestHandler(db=async_db, keep_alive=True)
+    )
+    protocol.connection_made(transport)
+
+    header = Header(sender=Username("TestUser"), content_type=ContentType.LAST_SEEN)
+    frame = bytearray(Message(header=header, body=LastSeen(content=1)).encode())
+    frame[offset] = value
+    protocol.data_received(bytes(frame))
+
+    transport.close.assert_called_once()
+    assert not protocol.tasks
+    protocol.connection_lost(None)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("keep_alive", [True, False])
+async def test_stream_malformed_frame_closes(async_db: AsyncDatabase, keep_alive: bool):
+    header = Header(sender=Username("TestUser"), content_type=ContentType.LAST_SEEN)
+    frame = bytearray(Message(header=header, body=LastSeen(content=1)).encode())
+    frame[VERSION_OFFSET] = 7
+    reader = StreamReader()
+    reader.feed_data(bytes(frame))
+    writer = Mock(spec=StreamWriter)
+
+    request_handler = RequestHandler(db=async_db, keep_alive=keep_alive)
+    await asyncio.wait_for(request_handler.handle(reader=reader, writer=writer), 1)
+
+    assert async_db.metrics.errors["malformed"] == 1
+    writer.write.assert_not_called()
+    writer.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_slow_frames_time_out(async_db: AsyncDatabase, transport: Mock):
+    request_handler = RequestHandler(
+        db=async_db, keep_alive=True, header_timeout=0.05, body_timeout=0.05
+    )
+    header = Header(sender=Username("TestUser"), content_type=ContentType.REGISTER)
+    frame = Message(header=header, body=Register(content=Username("Slow"))).encode()
+    for phase, partial in [("header", frame[:10]), ("body", frame[:-1])]:
+        transport.reset_mock()
+        protocol = FrameProtocol(request_handler=request_handler)
+        protocol.connection_made(transport)
+        # Fed in a byte at a time, then left unfinished
+        for i in range(len(partial)):
+            protocol.data_received(partial[i : i + 1])
+        await asyncio.sleep(0.1)
+
+        transport.close.assert_called_once()
+        assert protocol.phase == phase
+        assert async_db.metrics.timeouts[phase] == 1
+        protocol.connection_lost(None)
+
+
+@pytest.mark.asyncio
+async def test_protocol_engine(tmp_path: Path):
+    with Database.init(path=tmp_path / "lfg.db") as db:
+        ready = asyncio.Event()
+        server = asyncio.create_task(
+            serve(
+                host="localhost",
+                port=3118,
+                db=db,
+                config=ServerConfig(engine="protocol"),
+                ready=ready.set,
+            )
+        )
+        await ready.wait()
+        client = Client(address="localhost", port=3118, username=Username("TestUser"))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                replies = [tg.create_task(client.send(hello())) for _ in range(100)]
+            assert all(
+                reply.result().header.content_type == ContentType.NO_HELLO
+                for reply in replies
+            )
+        finally:
+            await client.close()
+            server.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await server
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from lfgdev.server.db import AsyncDatabase
+from lfgdev.server.reaper import Reaper
+from lfgdev.types import Username
+
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_sweep_expires_stale_players(async_db: AsyncDatabase) -> None:
+    stale = [Username(f"TestStale{i}") for i in range(7)]
+    for username in [*stale, Username("TestFresh")]:
+        await async_db.save(username)
+    async_db.db.update_many([(username, 1) for username in stale])
+    # Cached before expiry, so the cache must let go of it
+    assert await async_db.find_by_username(stale[0]) is not None
+    # Buffered, not yet written: the sweep has to flush it before judging
+    await async_db.touch(stale[1])
+
+    reaper = Reaper(db=async_db, ttl=60, batch_size=2, pause=0, vacuum_pages=8)
+    assert await reaper.sweep() == 6
+    assert async_db.metrics.expired == 6
+    assert await async_db.find_by_username(stale[0]) is None
+    assert await async_db.find_by_username(stale[1]) is not None
+    assert await async_db.find_by_username(Username("TestFresh")) is not None
+    assert await reaper.sweep() == 0
+    # The test database is new, so it was created with incremental auto_vacuum
+    assert reaper.vacuum_pages == 8
+
+
+@pytest.mark.asyncio
+async def test_run_survives_failed_sweeps(
+    async_db: AsyncDatabase, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    sweeps = 0
+
+    async def sweep(self: Reaper) -> int:
+        nonlocal sweeps
+        sweeps += 1
+        raise RuntimeError("not sqlite3.Error")
+
+    monkeypatch.setattr(Reaper, "sweep", sweep)
+    reaper = Reaper(db=async_db, ttl=60, interval=0)
+    task = asyncio.create_task(reaper.run())
+    async with asyncio.timeout(1):
+        while sweeps < 3:
+            await asyncio.sleep(0)
+            assert not task.done()
+    task.cancel()
@@ -1,12 +1,14 @@
-from asyncio import StreamReader, StreamWriter
+import asyncio
+from asyncio import IncompleteReadError, StreamReader, StreamWriter
+from dataclasses import replace
 from unittest.mock import AsyncMock, Mock
 
 import pytest
 
 from lfgdev.message import Header, Hello, Message
-from lfgdev.server.db import Database
+from lfgdev.server.db import AsyncDatabase
 from lfgdev.server.request_handler import RequestHandler
-from lfgdev.types import ContentType, Username
+from lfgdev.types import ContentType, ProtocolVersion, Username
 
 
 @pytest.fixture
@@ -37,7 +39,85 @@ def writer(message: Message) -> StreamWriter:
 
 @pytest.mark.asyncio
 async def test_request_handler(
-    db: Database, message: Message, reader: StreamReader, writer: StreamWriter
+    async_db: AsyncDatabase,
+    message: Message,
+    reader: StreamReader,
+    writer: StreamWriter,
 ):
-    request_handler = RequestHandler(db=db)
+    request_handler = RequestHandler(db=async_db)
     await request_handler.handle(reader=reader, writer=writer)
+
+
+@pytest.mark.asyncio
+async def test_request_handler_keep_alive(async_db: AsyncDatabase, header: Header):
+    # v1 frames, where header and body are each read in one go
+    first = Message(
+        header=replace(header, version=ProtocolVersion.V1),
+        body=Hello(content=None),
+    )
+    second = Message(
+        header=Header(
+            sender=header.sender,
+            content_type=ContentType.HELLO,
+            version=ProtocolVersion.V1,
+        ),
+        body=Hello(content=None),
+    )
+    readexactly = AsyncMock(
+        side_effect=[
+            first.header.encode(),
+            first.body.encode(),
+            second.header.encode(),
+            second.body.encode(),
+            IncompleteReadError(partial=b"", expected=Header.STRUCT.size),
+        ]
+    )
+    reader = Mock(spec=StreamReader, readexactly=readexactly)
+    writer = Mock(spec=StreamWriter)
+
+    request_handler = RequestHandler(db=async_db, keep_alive=True)
+    await request_handler.handle(reader=reader, writer=writer)
+
+    replies = [
+        Header.decode(call.args[0][: Header.STRUCT.size])
+        for call in writer.write.call_args_list
+    ]
+    assert {reply.identifier for reply in replies} == {
+        first.header.identifier,
+        second.header.identifier,
+    }
+    assert all(reply.content_type == ContentType.NO_HELLO for reply in replies)
+    writer.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_request_handler_header_timeout(
+    async_db: AsyncDatabase, message: Message
+):
+    # Half a header, and then nothing
+    reader = StreamReader()
+    reader.feed_data(message.header.encode()[:5])
+    writer = Mock(spec=StreamWriter)
+
+    request_handler = RequestHandler(db=async_db, keep_alive=True, header_timeout=0.05)
+    await asyncio.wait_for(request_handler.handle(reader=reader, writer=writer), 1)
+
+    assert async_db.metrics.timeouts["header"] == 1
+    writer.write.assert_not_called()
+    writer.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_request_handler_write_timeout(async_db: AsyncDatabase, message: Message):
+    # A client that never reads its replies
+    async def drain() -> None:
+        await asyncio.sleep(1)
+
+    writer = Mock(spec=StreamWriter, drain=drain)
+
+    request_handler = RequestHandler(db=async_db, write_timeout=0.05)
+    with pytest.raises(TimeoutError):
+        await request_handler.send(message, writer)
+
+    assert async_db.metrics.timeouts["write"] == 1
+    writer.transport.abort.assert_called_once()
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+from pathlib import Path
+
+import pytest
+
+from lfgdev.server.db import AsyncDatabase, Database
+from lfgdev.server.main import open_storage
+from lfgdev.server.reshard import reshard
+from lfgdev.server.shards import ShardedDatabase, shard_of, shard_paths
+from lfgdev.server.storage import Player
+from lfgdev.types import Username
+
+
+def players(db: Database) -> dict[str, int]:
+    return dict(db.connection.execute("SELECT username, last_seen FROM lfg"))
+
+
+def test_routing_and_merging(tmp_path: Path) -> None:
+    since = 3_000_000_000
+    seen = {Username(f"TestShard{i}"): since + i // 3 for i in range(20)}
+    with ShardedDatabase.init(tmp_path / "lfg.db", shards=3) as db:
+        for username in seen:
+            db.save(username)
+        db.update_many(seen.items())
+
+        # Each player is in exactly the shard it hashes to
+        for i, shard in enumerate(db.shards):
+            assert all(shard_of(Username(name), 3) == i for name in players(shard))
+        assert sum(len(players(shard)) for shard in db.shards) == len(seen)
+        assert db.find_by_username(Username("TestShard7")) == Player(
+            username=Username("TestShard7"), last_seen=since + 2
+        )
+        assert not db.save(Username("TestShard7"))
+
+        # Pages across shards come out as they would from one file
+        pages: list[list[Player]] = []
+        after = None
+        while page := db.list_active(since + 1, limit=6, after=after):
+            pages.append(page)
+            after = page[-1]
+        assert [len(page) for page in pages] == [6, 6, 5]
+        assert [player.username for page in pages for player in page] == sorted(
+            (username for username in seen if seen[username] > since),
+            key=lambda username: (seen[username], username),
+            reverse=True,
+        )
+
+        # Batches come up short only once every shard is done
+        assert len(db.expire(since + 2, limit=4)) == 4
+        assert len(db.expire(since + 2, limit=4)) == 2
+        assert db.expire(since + 2, limit=4) == []
+
+
+@pytest.mark.asyncio
+async def test_transaction_across_shards(tmp_path: Path) -> None:
+    with ShardedDatabase.init(tmp_path / "lfg.db", shards=2) as db:
+        async_db = AsyncDatabase(db=db)
+        usernames = [Username(f"TestTransaction{i}") for i in range(6)]
+        assert len({shard_of(username, 2) for username in usernames}) == 2
+        with pytest.raises(RuntimeError):
+            async with async_db.transaction():
+                for username in usernames:
+                    await async_db.save(username)
+                raise RuntimeError
+        assert [await async_db.find_by_username(name) for name in usernames] == [
+            None
+        ] * len(usernames)
+
+        async with async_db.transaction():
+            for username in usernames:
+                await async_db.save(username)
+        assert all([await async_db.find_by_username(name) for name in usernames])
+        async_db.close()
+
+
+@pytest.mark.asyncio
+async def test_writes_to_other_shards_go_ahead(tmp_path: Path) -> None:
+    with ShardedDatabase.init(tmp_path / "lfg.db", shards=2) as db:
+        async_db = AsyncDatabase(db=db)
+        names = (Username(f"TestBusyShard{i}") for i in range(100))
+        by_shard = {shard_of(name, 2): name for name in names}
+        # Hold up shard 0's thread, as a slow commit would
+        busy = threading.Event()
+        db.submit(0, busy.wait)
+
+        waiting = asyncio.create_task(async_db.save(by_shard[0]))
+        await asyncio.sleep(0.05)
+        try:
+            async with asyncio.timeout(1):
+                assert await async_db.save(by_shard[1])
+                assert await async_db.find_by_username(by_shard[1]) is not None
+            assert not waiting.done()
+        finally:
+            busy.set()
+        assert await waiting
+        async_db.close()
+
+
+def test_shard_count_is_checked(tmp_path: Path) -> None:
+    with ShardedDatabase.init(tmp_path / "lfg.db", shards=2):
+        pass
+    with (
+        pytest.raises(ValueError, match="shard 0 of 2"),
+        ShardedDatabase.init(tmp_path / "lfg.db", shards=3),
+    ):
+        pass
+
+
+def test_unsharded_file_is_checked(tmp_path: Path) -> None:
+    path = tmp_path / "lfg.db"
+    with open_storage("sqlite", path) as db:
+        db.save(Username("TestUnsharded"))
+
+    # Its players would otherwise be missing from brand new shards
+    with (
+        pytest.raises(ValueError, match="lfgdev-reshard"),
+        open_storage("sqlite", path, shards=2),
+    ):
+        pass
+    assert shard_paths(path, 2) == [tmp_path / "lfg.0.db", tmp_path / "lfg.1.db"]
+    assert not any(shard.exists() for shard in shard_paths(path, 2))
+
+    # Once resharded, the original is stale but left in place
+    reshard(path, 1, path, 2)
+    with (
+        pytest.raises(ValueError, match="resharded"),
+        open_storage("sqlite", path),
+    ):
+        pass
+    with open_storage("sqlite", path, shards=2) as sharded:
+        assert sharded.find_by_username(Username("TestUnsharded")) is not None
+
+
+def test_shard_opened_alone_is_refused(tmp_path: Path) -> None:
+    with ShardedDatabase.init(tmp_path / "lfg.db", shards=2):
+        pass
+    with (
+        pytest.raises(ValueError, match="shard 1 of 2, not 0 of 1"),
+        open_storage("sqlite", tmp_path / "lfg.1.db"),
+    ):
+        pass
+
+
+def test_reshard(tmp_path: Path) -> None:
+    seen = {f"TestReshard{i}": 1_000 + i for i in range(50)}
+    with Database.init(tmp_path / "lfg.db") as db:
+        db.connection.executemany("INSERT INTO lfg VALUES (?, ?)", seen.items())
+        db.connection.commit()
+
+    assert reshard(tmp_path / "lfg.db", 1, tmp_path / "lfg.db", 3, batch_size=7) == 50
+    with ShardedDatabase.init(tmp_path / "lfg.db", shards=3) as sharded:
+        assert {
+            name: last_seen
+            for shard in sharded.shards
+            for name, last_seen in players(shard).items()
+        } == seen
+
+    # And back again, which needs somewhere that isn't the original file
+    with pytest.raises(FileExistsError):
+        reshard(tmp_path / "lfg.db", 3, tmp_path / "lfg.db", 1)
+    assert reshard(tmp_path / "lfg.db", 3, tmp_path / "merged.db", 1) == 50
+    assert shard_paths(tmp_path / "merged.db", 1) == [tmp_path / "merged.db"]
+    with Database.init(tmp_path / "merged.db") as merged:
+        assert players(merged) == seen
@@ -0,0 +1,41 @@
+import sys
+import time
+
+from lfgdev.server.workers import Supervisor
+
+
+def crash() -> None:
+    sys.exit(3)
+
+
+def test_supervisor_restarts_crashed_worker() -> None:
+    supervisor = Supervisor(target=crash, args=(), workers=1, min_uptime=0.0)
+    supervisor.start_worker(0)
+    first = supervisor.processes[0]
+    first.join()
+    assert first.exitcode == 3
+
+    supervisor.restart(0)
+    assert supervisor.processes[0] is not first
+    supervisor.shutdown()
+    assert not supervisor.processes[0].is_alive()
+
+
+def test_crash_loop_backoff_doesnt_block() -> None:
+    supervisor = Supervisor(target=crash, args=(), workers=1, min_uptime=60.0)
+    supervisor.start_worker(0)
+    supervisor.processes[0].join()
+
+    # Restarting is put off, but the supervisor isn't held up waiting for it
+    start = time.monotonic()
+    supervisor.supervise()
+    assert time.monotonic() - start < 0.5
+    assert 0 not in supervisor.processes
+    assert 0 in supervisor.restart_at
+
+    while 0 not in supervisor.processes:
+        supervisor.supervise()
+        assert time.monotonic() - start < 5
+    assert supervisor.restart_at == {}
+    supervisor.stopping = True
+    supervisor.shutdown()